@@ -1,8 +1,40 @@
 __version__ = "0.1.0"
 
+import logging
+from typing import Awaitable, Callable, List, Type
 
 from discord.ext import commands
 import discord
 
+ShutdownHook = Callable[[], Awaitable[None]]
+
+
+class RegBot(commands.Bot):
+    """The bot, with hooks that get awaited before it closes its connection to Discord"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shutdown_hooks: List[ShutdownHook] = []
+        self.context_class: Type[commands.Context] = commands.Context
+
+    def add_shutdown_hook(self, hook: ShutdownHook) -> None:
+        """Register a coroutine function to be awaited on shut down. Hooks are awaited in
+        the reverse order that they were added.
+        """
+        self.shutdown_hooks.append(hook)
+
+    async def get_context(self, message, *, cls=None):
+        return await super().get_context(message, cls=cls or self.context_class)
+
+    async def close(self):
+        for hook in reversed(self.shutdown_hooks):
+            try:
+                await hook()
+            except Exception:
+                logging.exception(f"Shutdown hook {hook} failed!")
+        self.shutdown_hooks = []
+        await super().close()
+
+
 intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", description="Registration bot", intents=intents)
+bot = RegBot(command_prefix="!", description="Registration bot", intents=intents)
@@ -6,14 +6,30 @@ import regbot.commands  # noqa: F401
 import regbot.events  # noqa: F401
 from regbot import bot
 from regbot.google import get_client_credentials
-from regbot.helpers import get_bool_env, get_str_env
-from regbot.tasks import QuicketSync, WaferSync, YouTubeVideoSync
+from regbot.helpers import close_log_sink, get_bool_env, get_str_env
+from regbot.http_client import close_http_client, create_http_client, set_http_client
+from regbot.outbound import OutboundContext
+from regbot.snapshot import load_snapshot
+from regbot.tasks import (
+    LoopLagMonitor,
+    QuicketSync,
+    QuizSync,
+    RegistrationLedgerSync,
+    RoleReconcile,
+    WaferSync,
+    WorksheetCacheRefresh,
+    YouTubeVideoSync,
+)
+from regbot.youtube import get_youtube
 
 TOKEN = get_str_env("DISCORD_TOKEN")
 LOGGING_LEVEL = os.getenv("LOGGING_LEVEL", "INFO")
+FEATURE_REGISTRATION = get_bool_env("FEATURE_REGISTRATION")
 FEATURE_WAFER_SYNC = get_bool_env("FEATURE_WAFER_SYNC")
 FEATURE_QUICKET_SYNC = get_bool_env("FEATURE_QUICKET_SYNC")
 FEATURE_YOUTUBE = get_bool_env("FEATURE_YOUTUBE")
+FEATURE_QUIZ = get_bool_env("FEATURE_QUIZ")
+FEATURE_ROLE_RECONCILE = get_bool_env("FEATURE_ROLE_RECONCILE")
 
 
 logging.basicConfig(
@@ -24,13 +40,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
+# Added first, so that it is awaited last and sends what the other hooks logged
+bot.add_shutdown_hook(close_log_sink)
+bot.context_class = OutboundContext
+set_http_client(create_http_client())
+bot.add_shutdown_hook(close_http_client)
+bot.add_cog(LoopLagMonitor(bot))
+
+if FEATURE_REGISTRATION or FEATURE_QUIZ:
+    bot.add_cog(WorksheetCacheRefresh(bot))
+if FEATURE_REGISTRATION:
+    bot.add_cog(RegistrationLedgerSync(bot))
+if FEATURE_REGISTRATION and FEATURE_ROLE_RECONCILE:
+    bot.add_cog(RoleReconcile(bot))
+if FEATURE_QUIZ:
+    bot.add_cog(QuizSync(bot))
 if FEATURE_QUICKET_SYNC:
     bot.add_cog(QuicketSync(bot))
 if FEATURE_WAFER_SYNC:
     bot.add_cog(WaferSync(bot))
 if FEATURE_YOUTUBE:
-    # Get oAuth Credentials on start.
+    # Get oAuth Credentials and build the YouTube resource on start.
     credentials = get_client_credentials()
+    get_youtube()
     bot.add_cog(YouTubeVideoSync(bot))
 
+# Warm start the sync caches before connecting, so that they are usable straight away.
+load_snapshot()
 bot.run(TOKEN)
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from regbot import quicket, wafer
+from regbot.helpers import (
+    ATTENDEE_ROLE,
+    SPEAKER_ROLE,
+    SPONSOR_GOLD_ROLE,
+    SPONSOR_PATRON_ROLE,
+    SPONSOR_SILVER_ROLE,
+)
+from regbot.quicket import Ticket
+
+MAX_NICKNAME_LENGTH = 32  # Max nickname length on Discord
+# The role given for each type of ticket, by the words that its (lower case) ticket type
+# must contain. The first matching entry wins.
+TICKET_TYPE_ROLES: Tuple[Tuple[Tuple[str, ...], str], ...] = (
+    (("sponsor", "gold"), SPONSOR_GOLD_ROLE),
+    (("sponsor", "silver"), SPONSOR_SILVER_ROLE),
+    (("sponsor", "patron"), SPONSOR_PATRON_ROLE),
+)
+
+
+@dataclass(frozen=True)
+class Attendee:
+    """What the holder of a ticket is entitled to on registering, joined from the Quicket
+    guest list and the Wafer speakers.
+    """
+
+    ticket: Ticket
+    nickname: str
+    roles: Tuple[str, ...]  # Names of the roles to grant
+    speaker: bool
+    sponsor: bool
+
+    @property
+    def nickname_truncated(self) -> bool:
+        return len(self.nickname) < len(self.ticket.full_name)
+
+    @classmethod
+    def from_ticket(cls, ticket: Ticket, speaker: bool) -> "Attendee":
+        roles = [ATTENDEE_ROLE]
+        if speaker:
+            roles.append(SPEAKER_ROLE)
+        ticket_type = ticket.type.lower()
+        sponsor = False
+        for words, role in TICKET_TYPE_ROLES:
+            if all(word in ticket_type for word in words):
+                roles.append(role)
+                sponsor = "sponsor" in words
+                break
+        return cls(
+            ticket=ticket,
+            nickname=ticket.full_name[:MAX_NICKNAME_LENGTH],
+            roles=tuple(roles),
+            speaker=speaker,
+            sponsor=sponsor,
+        )
+
+
+ATTENDEES: Dict[str, Attendee] = {}
+
+
+def update_attendees(barcodes: Optional[Iterable[str]] = None) -> None:
+    """Rejoin the attendees of the given barcodes, or of all the tickets if none are
+    given, from the tickets and speakers caches.
+    """
+    if barcodes is None:
+        ATTENDEES.clear()
+        barcodes = quicket.TICKETS.keys()
+    for barcode in barcodes:
+        ticket = quicket.TICKETS.get(barcode)
+        if ticket is None:
+            ATTENDEES.pop(barcode, None)
+        else:
+            ATTENDEES[barcode] = Attendee.from_ticket(
+                ticket, barcode in wafer.SPEAKERS_TICKETS
+            )
+
+
+def get_attendee(barcode: str) -> Optional[Attendee]:
+    """Get the attendee with the ticket of the given barcode, if there is one."""
+    return ATTENDEES.get(barcode)
@@ -1,29 +1,135 @@
+import asyncio
+import time
+from typing import Any, Dict
+
 from discord.errors import Forbidden
+from discord.ext.commands import has_role
 from googleapiclient.errors import HttpError
 
 from regbot import bot
-from regbot.helpers import ServerInfo, get_bool_env, get_str_env, log
-from regbot.quicket import get_ticket_by_barcode
-from regbot.sheets import QuizQuestion, is_ticket_used, register_ticket
-from regbot.wafer import is_barcode_belong_to_speaker
-from regbot.youtube import get_broadcast_channels, get_youtube
+from regbot.attendees import get_attendee
+from regbot.helpers import (
+    ORGANIZER_ROLE,
+    ServerInfo,
+    find_role,
+    get_bool_env,
+    get_stats_report,
+    get_str_env,
+    log,
+    register_stats,
+    safe_send_message,
+)
+from regbot.outbound import OUTBOUND, Priority
+from regbot.reconcile import apply_reconcile, plan_reconcile
+from regbot.registration import REGISTRATION_QUEUE
+from regbot.sheets import (
+    QuizQuestion,
+    is_ticket_used,
+    register_ticket,
+    reload_quiz_state,
+)
+from regbot.youtube import get_broadcast_channels, get_question_relay
 
 EVENT_NAME = get_str_env("EVENT_NAME")
 FEATURE_REGISTRATION = get_bool_env("FEATURE_REGISTRATION")
 FEATURE_YOUTUBE = get_bool_env("FEATURE_YOUTUBE")
 FEATURE_QUIZ = get_bool_env("FEATURE_QUIZ")
+# Total seconds taken by each step of the completed registrations
+REGISTRATION_STEP_TIMES: Dict[str, float] = {}
+REGISTRATIONS_TIMED = 0
 BASE_URL = "https://youtube.googleapis.com/youtube/v3/"
 MESSAGES_URL = "liveChat/messages"
 LIVE_BROADCAST_URL = "liveBroadcasts"
 
+
+class RegistrationTimings:
+    """Times the steps of a registration, adding them up for the statistics"""
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.steps: Dict[str, float] = {}
+
+    def step(self, name: str) -> None:
+        """Record the time taken since the previous step as the given step."""
+        now = time.perf_counter()
+        self.steps[name] = now - self.last
+        self.last = now
+
+    def summary(self) -> str:
+        """Add the step times to the totals, and return a human readable breakdown."""
+        global REGISTRATIONS_TIMED
+        REGISTRATIONS_TIMED += 1
+        total = self.last - self.start
+        for name, seconds in (("total", total), *self.steps.items()):
+            REGISTRATION_STEP_TIMES[name] = (
+                REGISTRATION_STEP_TIMES.get(name, 0.0) + seconds
+            )
+        steps = ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in self.steps.items()
+        )
+        return f"{total:.3f}s ({steps})"
+
+
+def get_registration_stats() -> Dict[str, Any]:
+    """The average time taken by each step of the completed registrations"""
+    stats: Dict[str, Any] = {"Registrations timed": REGISTRATIONS_TIMED}
+    for name, seconds in REGISTRATION_STEP_TIMES.items():
+        stats[f"Average {name} time (s)"] = seconds / REGISTRATIONS_TIMED
+    return stats
+
+
+register_stats("Registration", get_registration_stats)
+
+
+@bot.command("stats")
+@has_role(ORGANIZER_ROLE)
+async def stats(ctx):
+    """Show the bot's internal statistics, for organizers."""
+    await safe_send_message(ctx, get_stats_report())
+
+
 if FEATURE_REGISTRATION:
 
     @bot.command("register")
     async def register(ctx, barcode: str):
         """Registers the calling user based on their Quicket ticket barcode number."""
+        deleted = None
         if ctx.channel.type.name != "private":
-            await ctx.message.delete()
-        ticket = await get_ticket_by_barcode(barcode)
+            # Hide the barcode straight away, whatever becomes of the registration
+            deleted = asyncio.ensure_future(ctx.message.delete())
+        try:
+            await queue_registration(ctx, barcode)
+        finally:
+            if deleted is not None:
+                await deleted
+
+    async def queue_registration(ctx, barcode: str):
+        """Queue the registration of the calling user, and wait for it to be done."""
+        if REGISTRATION_QUEUE.is_in_progress(barcode, ctx.author.id):
+            return await ctx.send(
+                f"Sorry {ctx.author.name}, a registration of that ticket, or by you, is "
+                "already in progress. Please wait a moment before trying again."
+            )
+        try:
+            done, waiting = REGISTRATION_QUEUE.submit(
+                barcode, ctx.author.id, lambda: process_registration(ctx, barcode)
+            )
+        except asyncio.QueueFull:
+            return await ctx.send(
+                f"Sorry {ctx.author.name}, there are a lot of people registering right "
+                "now. Please try again in a few minutes."
+            )
+        if waiting:
+            await ctx.send(
+                f"Thank you {ctx.author.name}, there are {waiting} registration(s) ahead "
+                "of yours. I'll get to yours as soon as I can!"
+            )
+        await done
+
+    async def process_registration(ctx, barcode: str):
+        """Registers the calling user with the ticket of the given barcode."""
+        timings = RegistrationTimings()
+        attendee = get_attendee(barcode)
         server_info = await ServerInfo.get()
         member = server_info.guild.get_member(ctx.author.id)
         if member is None:
@@ -32,8 +138,9 @@ if FEATURE_REGISTRATION:
             "\nIf you need assistance, then please ask for assistance from the "
             f"{server_info.help_desk.mention} or a/an {server_info.registration.name}"
         )
+        timings.step("lookup")
 
-        if ticket is None:
+        if attendee is None:
             await ctx.send(
                 f"Sorry {member.name}, I could not find a ticket with the given barcode. "
                 f"{assistance}"
@@ -43,6 +150,7 @@ if FEATURE_REGISTRATION:
                 f"barcode {barcode} as it wasn't found!"
             )
 
+        ticket = attendee.ticket
         if await is_ticket_used(ticket):
             await ctx.send(
                 f"Sorry {member.name}, your ticket with the given barcode was already "
@@ -52,62 +160,107 @@ if FEATURE_REGISTRATION:
                 f"{member.name} tried and failed to register a ticket with the "
                 f"barcode {barcode} as it was already registered!"
             )
+        timings.step("ledger check")
 
-        await member.add_roles(server_info.attendee)
-        truncated_name = ticket.full_name[:32]  # Max nickname length on Discord
-        try:
-            await member.edit(nick=truncated_name)
-        except Forbidden as e:
-            await log(
-                f"Failed to change the nickname of {member.mention}, due to {e.text}"
-            )
-        if len(ticket.full_name) > len(truncated_name):
-            await ctx.send(
+        # Work out all the changes to the member first, so that they are made at once
+        roles = []
+        for name in attendee.roles:
+            role = find_role(name)
+            if role is None:
+                await log(f"The {name} role was not found, so it can't be given!")
+            else:
+                roles.append(role)
+        replies = [
+            f"Registration successful! Thank you for registering for {EVENT_NAME}! "
+            f"We hope that you enjoy your stay, {ticket.full_name}!"
+        ]
+        if attendee.nickname_truncated:
+            replies.append(
                 f"We apologize {member.name}, but we had to truncate your full name on the"
                 " discord server as it was over 32 characters. You are free to modify your"
                 f" own nickname by right clicking on your user name on the {EVENT_NAME} "
                 "server and selecting 'Change Nickname'."
             )
-            await log(f"{ticket.full_name} was truncated to {truncated_name}")
+            await log(f"{ticket.full_name} was truncated to {attendee.nickname}")
+        if attendee.speaker:
+            replies.append(
+                "I have also detected that you are a speaker and have assigned you that role."
+            )
+        if attendee.sponsor:
+            replies.append(
+                "I have also detected that you are a sponsor and have assigned you that role."
+            )
+        timings.step("planning")
 
-        await ctx.send(
-            f"Registration successful! Thank you for registering for {EVENT_NAME}! "
-            f"We hope that you enjoy your stay, {ticket.full_name}!"
-        )
-        await log(
-            f"{member.mention} was successfully registered with ticket {ticket.barcode}"
-        )
+        reason = f"Registered with ticket {ticket.barcode}"
 
-        await register_ticket(ticket, member)
+        async def edit_member(**changes):
+            # The roles are read when the edit is sent, on the same route as the other
+            # role changes of the member, so that roles given meanwhile aren't taken away
+            current = server_info.guild.get_member(member.id) or member
+            new_roles = list(
+                {role.id: role for role in current.roles[1:] + roles}.values()
+            )
+            await current.edit(roles=new_roles, reason=reason, **changes)
 
-        if await is_barcode_belong_to_speaker(barcode):
-            await member.add_roles(server_info.speaker)
-            await log(f"{member.mention} has been given the speaker role.")
-            await ctx.send(
-                "I have also detected that you are a speaker and have assigned you that role."
+        route = ("member", member.id)
+        try:
+            await OUTBOUND.submit(
+                route, Priority.INTERACTIVE, lambda: edit_member(nick=attendee.nickname)
+            )
+        except Forbidden as e:
+            await log(
+                f"Failed to change the nickname of {member.mention}, due to {e.text}"
             )
+            await OUTBOUND.submit(route, Priority.INTERACTIVE, edit_member)
+        timings.step("member edit")
 
-        ticket_type = ticket.type.lower()
-        if "sponsor" in ticket_type:
-            for level, role in (
-                ("gold", server_info.gold_sponsor),
-                ("silver", server_info.silver_sponsor),
-                ("patron", server_info.patron_sponsor),
-            ):
-                if level in ticket_type:
-                    await member.add_roles(role)
-                    await log(
-                        f"{member.mention} has been given the " f"{role.name} role."
-                    )
-                    await ctx.send(
-                        "I have also detected that you are a sponsor and have assigned you "
-                        "that role."
-                    )
-                    break
+        await log(
+            f"{member.mention} was successfully registered with ticket {ticket.barcode}, "
+            f"and given the {', '.join(role.name for role in roles)} role(s)."
+        )
+        await asyncio.gather(
+            register_ticket(ticket, member), ctx.send("\n".join(replies))
+        )
+        timings.step("side effects")
+        await log(f"Registration of {member.mention} took {timings.summary()}")
+
+    @bot.command("reconcile")
+    @has_role(ORGANIZER_ROLE)
+    async def reconcile(ctx, mode: str = "dry-run"):
+        """Bring the registration roles of all members in line with the registration
+        ledger, Quicket tickets and Wafer speakers. Only reports the changes it would
+        make, unless called with `!reconcile apply`.
+        """
+        server_info = await ServerInfo.get()
+        try:
+            plan = plan_reconcile(server_info.guild)
+        except AssertionError as e:
+            return await ctx.send(f"Can't reconcile the roles yet: {e}")
+        if mode != "apply":
+            return await safe_send_message(ctx, plan.summary(detailed=True))
+
+        await ctx.send(f"Reconciling roles. {plan.summary()}")
+        failed = await apply_reconcile(plan, ctx.send)
+        await ctx.send(
+            f"Role reconciliation complete, {len(plan.changes) - failed} member(s) changed "
+            f"and {failed} failed."
+        )
+        await log(f"{ctx.author.mention} reconciled the roles. {plan.summary()}")
 
 
 if FEATURE_YOUTUBE:
 
+    @bot.command("channelplan")
+    @has_role(ORGANIZER_ROLE)
+    async def channel_plan(ctx):
+        """Show what the next talk channels sync would change, without changing it."""
+        cog = bot.get_cog("YouTubeVideoSync")
+        if cog is None:
+            return await ctx.send("The talk channels sync isn't running.")
+        plan = await cog.plan_channels(sync=False)
+        await safe_send_message(ctx, plan.summary(detailed=True))
+
     @bot.command("question")
     async def question(ctx, *question_words):
         """Echo a question to YouTube"""
@@ -127,9 +280,8 @@ if FEATURE_YOUTUBE:
         question = " ".join(question_words)
         live_chat_id = channels[ctx.channel]["live_chat_id"]
 
-        youtube = get_youtube()
-        question = f"{ctx.author.display_name} asks: {question}"
-        len_question = len(question)
+        text = f"{ctx.author.display_name} asks: {question}"
+        len_question = len(text)
         if len_question > 200:
             return await ctx.send(
                 f"Thank you for your question {ctx.author.mention}, however your question"
@@ -137,25 +289,45 @@ if FEATURE_YOUTUBE:
                 " YouTube limits it to 200.\n"
                 f"Please reduce your question by at least {len_question - 200} characters."
             )
-        request = youtube.liveChatMessages().insert(
-            part="snippet",
-            body={
-                "snippet": {
-                    "liveChatId": live_chat_id,
-                    "type": "textMessageEvent",
-                    "textMessageDetails": {"messageText": question},
-                }
-            },
-        )
+        relay = get_question_relay(live_chat_id, ctx.channel.name)
+        cooldown = relay.cooldown_remaining(ctx.author.id)
+        if cooldown:
+            return await ctx.send(
+                f"Thank you for your question {ctx.author.mention}, however you have "
+                f"to wait {cooldown:.0f} more seconds before asking another one."
+            )
         try:
-            request.execute()
+            sent, position = relay.submit(ctx.author.id, question, text)
+        except asyncio.QueueFull:
+            return await ctx.send(
+                f"Thank you for your question {ctx.author.mention}, however there are "
+                "too many questions waiting to be sent right now. Please try again later."
+            )
+        if position:
+            await ctx.send(
+                f"Thank you for your question {ctx.author.mention}, it is queued to be "
+                f"sent to YouTube (number {position} in the queue)."
+            )
+        else:
+            await ctx.send(
+                f"Thank you for your question {ctx.author.mention}, the same question is "
+                "already queued to be sent to YouTube, so yours was added to it."
+            )
+
+        try:
+            await sent
         except HttpError as e:
             return await ctx.send(
-                f"Thank you for your question {ctx.author.mention}, however it was "
-                f"rejected by YouTube for the following reason: {e.reason}"
+                f"Sorry {ctx.author.mention}, your question was rejected by YouTube for "
+                f"the following reason: {e.reason}"
+            )
+        except asyncio.TimeoutError:
+            return await ctx.send(
+                f"Sorry {ctx.author.mention}, YouTube took too long to respond to your "
+                "question. Please try again."
             )
 
-        await ctx.send(f"Thank you for your question {ctx.author.mention}")
+        await ctx.send(f"Your question was sent to YouTube {ctx.author.mention}")
 
 
 if FEATURE_QUIZ:
@@ -208,8 +380,22 @@ if FEATURE_QUIZ:
         if not answer_words:
             return await ctx.send(question.question)
         if answer.lower() == question.answer.lower():
-            await question.mark_as_answered(ctx.author.id)
+            if not await question.mark_as_answered(ctx.author.id):
+                return await ctx.send(
+                    f"{ctx.author.mention} That's right, but somebody beat you to it! "
+                    "Please check if there is another question."
+                )
             return await ctx.send(
                 f"{ctx.author.mention} {question.correct_answer_response()}"
             )
         return await ctx.send(f"{ctx.author.mention} {question.wrong_answer_response()}")
+
+    @bot.command("quizreload")
+    @has_role(ORGANIZER_ROLE)
+    async def quiz_reload(ctx):
+        """Reload the quiz questions and answers from the quiz sheet, for organizers."""
+        state = await reload_quiz_state()
+        await ctx.send(
+            f"Reloaded {len(state.questions)} quiz question(s), of which "
+            f"{len([q for q in state.questions if q.answerer_id])} have been answered."
+        )
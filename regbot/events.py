@@ -1,9 +1,24 @@
 from regbot import bot
-from regbot.helpers import ServerInfo, get_bool_env, get_str_env, log
+from regbot.helpers import (
+    GUILD_ID,
+    ServerInfo,
+    get_bool_env,
+    index_channel,
+    index_guild,
+    index_role,
+    invalidate_server_info,
+    log,
+    unindex_channel,
+    unindex_role,
+)
+from regbot.onboarding import onboard
+from regbot.outbound import Priority, send
+from regbot.snapshot import resolve_snapshot_channels
 from discord import Reaction
+from discord import Role
 from discord import User
+from discord.abc import GuildChannel
 
-EVENT_NAME = get_str_env("EVENT_NAME")
 FEATURE_REGISTRATION = get_bool_env("FEATURE_REGISTRATION")
 FEATURE_REPOST_ANNOUNCE = get_bool_env("FEATURE_REPOST_ANNOUNCE")
 REPOST_REACTION = "🔔"
@@ -11,6 +26,10 @@ REPOST_REACTION = "🔔"
 
 @bot.event
 async def on_ready():
+    guild = bot.get_guild(GUILD_ID)
+    if guild is not None:
+        index_guild(guild)
+    resolve_snapshot_channels(bot)
     await log(f"{bot.user.name} has connected to the following guilds:")
     for guild in bot.guilds:
         await log(f"{guild.name}, ID: {guild.id}")
@@ -18,30 +37,9 @@ async def on_ready():
 
 @bot.event
 async def on_member_join(member):
-    server_info = await ServerInfo.get()
     await log(f"{member.mention} has joined the server!")
     if FEATURE_REGISTRATION:
-        channel = member.dm_channel
-        if channel is None:
-            channel = await member.create_dm()
-        else:
-            await log(f"Could not create DM channel for {member.mention}!")
-        await member.dm_channel.send(f"Welcome {member.name} to {EVENT_NAME}!")
-        await member.dm_channel.send(
-            f"I am the registration bot for {EVENT_NAME}. Simply "
-            "say `!register <Quicket Ticket barcode number>` without the `<`/`>`, and I "
-            "will check in your ticket and give you the appropriate permissions on the "
-            "discord server! You can also use the `!help` command for more options."
-        )
-        await member.dm_channel.send(
-            f"If you need any assistance, then please do not hesitate to ask for it at the"
-            f" {server_info.help_desk.mention}, or from an organizer."
-        )
-        await log(f"{member.mention} has been greeted via DM.")
-        await server_info.welcome_channel.send(
-            f"Welcome to {EVENT_NAME}, {member.mention}! Please register your ticket with me "
-            "in the Direct Message channel that I created with you..."
-        )
+        await onboard(member)
 
 
 @bot.event
@@ -60,4 +58,55 @@ async def on_reaction_add(reaction: Reaction, user: User):
             reaction.emoji == REPOST_REACTION
             and reaction.message.channel == server_info.announcement_staging_channel
         ):
-            await server_info.announcement_channel.send(reaction.message.content)
+            await send(
+                server_info.announcement_channel,
+                reaction.message.content,
+                Priority.ANNOUNCEMENT,
+            )
+
+
+@bot.event
+async def on_guild_role_create(role: Role):
+    if role.guild.id == GUILD_ID:
+        index_role(role)
+        invalidate_server_info()
+
+
+@bot.event
+async def on_guild_role_update(before: Role, after: Role):
+    if after.guild.id == GUILD_ID:
+        unindex_role(before)
+        index_role(after)
+        invalidate_server_info()
+
+
+@bot.event
+async def on_guild_role_delete(role: Role):
+    if role.guild.id == GUILD_ID:
+        unindex_role(role)
+        invalidate_server_info()
+
+
+@bot.event
+async def on_guild_channel_create(channel: GuildChannel):
+    if channel.guild.id == GUILD_ID:
+        index_channel(channel)
+        invalidate_server_info()
+
+
+@bot.event
+async def on_guild_channel_update(before: GuildChannel, after: GuildChannel):
+    if after.guild.id == GUILD_ID:
+        unindex_channel(before)
+        index_channel(after)
+        # The server info only depends on the channels' names and categories, so most
+        # updates, such as to their topic or position, don't need it looked up again
+        if (before.name, before.category_id) != (after.name, after.category_id):
+            invalidate_server_info()
+
+
+@bot.event
+async def on_guild_channel_delete(channel: GuildChannel):
+    if channel.guild.id == GUILD_ID:
+        unindex_channel(channel)
+        invalidate_server_info()
@@ -1,20 +1,23 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
 import re
 import textwrap
+from collections import deque
 from dataclasses import dataclass
 from distutils.util import strtobool
-from typing import Any, List, Optional
+from typing import Any, Callable, Deque, Dict, List, Optional
 
 from discord import CategoryChannel, Guild, Message, Role, TextChannel
-from discord.abc import Messageable
-from discord.utils import get
+from discord.abc import GuildChannel, Messageable
 
 from regbot import bot
+from regbot.outbound import OUTBOUND, Priority, send
 
 SERVER_INFO_CACHE = None
+STATS_PROVIDERS: Dict[str, Callable[[], Dict[str, Any]]] = {}
 
 
 def get_str_env(env_name: str) -> str:
@@ -57,8 +60,11 @@ def to_discord_description_safe(text: str) -> str:
     return text[:1024]
 
 
-async def safe_send_message(target: Messageable, text: str) -> List[Message]:
-    """Safely send a message to the given messageable target.
+async def safe_send_message(
+    target: Messageable, text: str, priority: Priority = Priority.INTERACTIVE
+) -> List[Message]:
+    """Safely send a message to the given messageable target, through the outbound
+    scheduler with the given priority.
     The utility of this is function, is that the message will be split into multiple parts
     if its too long.
     """
@@ -70,7 +76,7 @@ async def safe_send_message(target: Messageable, text: str) -> List[Message]:
         replace_whitespace=False,
         drop_whitespace=False,
     ):
-        message = await target.send(part)
+        message = await send(target, part, priority)
         messages.append(message)
     return messages
 
@@ -83,15 +89,144 @@ def int_or_none(something: Any) -> Optional[int]:
         return None
 
 
+def register_stats(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """Register a function that returns a dictionary of statistics under the given name,
+    for organizers to view with the `!stats` command.
+    """
+    STATS_PROVIDERS[name] = provider
+
+
+register_stats("Outbound", OUTBOUND.stats)
+
+
+def get_stats_report() -> str:
+    """Get a human readable report of all the registered statistics"""
+    sections = []
+    for name, provider in STATS_PROVIDERS.items():
+        lines = [f"**{name}**"]
+        for key, value in provider().items():
+            if isinstance(value, float):
+                value = f"{value:.3f}"
+            lines.append(f"{key}: {value}")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections) or "No statistics are available yet."
+
+
 LOG_CHANNEL = get_int_env("DISCORD_LOG_CHANNEL_ID")
+DISCORD_MESSAGE_LIMIT = 2000
+LOG_BUFFER_SIZE = 1000
+LOG_FLUSH_INTERVAL_SECONDS = 2
+# Lines waiting to be sent to the log channel, oldest first
+LOG_BUFFER: Deque[str] = deque()
+LOG_STATS = {"Lines logged": 0, "Lines dropped": 0, "Messages sent": 0, "Send errors": 0}
+_LOG_BUFFER_LENGTH = 0  # The length of the buffered lines, joined into one message
+_LOG_WAKEUP: Optional[asyncio.Event] = None
+_LOG_WORKER: Optional[asyncio.Future] = None
+_LOG_FLUSH_LOCK: Optional[asyncio.Lock] = None
+register_stats("Log", lambda: {**LOG_STATS, "Lines buffered": len(LOG_BUFFER)})
+
+
+def _drop_log_lines() -> None:
+    """Drop the oldest lines, until the buffer is within its size."""
+    global _LOG_BUFFER_LENGTH
+    while len(LOG_BUFFER) > LOG_BUFFER_SIZE:
+        _LOG_BUFFER_LENGTH -= len(LOG_BUFFER.popleft()) + 1
+        LOG_STATS["Lines dropped"] += 1
 
 
 async def log(message: str):
-    """Helper to log to discord as well as standard logging"""
+    """Helper to log to discord as well as standard logging. The message is only
+    buffered for the log sink to send, so this returns straight away. If the buffer is
+    full, then the oldest line is dropped.
+    """
+    global _LOG_BUFFER_LENGTH, _LOG_WAKEUP, _LOG_WORKER, _LOG_FLUSH_LOCK
     logging.info(message)
-    channel = bot.get_channel(LOG_CHANNEL)
-    assert channel is not None, "Need a log channel!"
-    await safe_send_message(channel, message)
+    LOG_BUFFER.append(message)
+    _LOG_BUFFER_LENGTH += len(message) + 1
+    LOG_STATS["Lines logged"] += 1
+    _drop_log_lines()
+    if _LOG_WAKEUP is None or _LOG_WORKER is None:
+        _LOG_WAKEUP = asyncio.Event()
+        _LOG_FLUSH_LOCK = asyncio.Lock()
+        _LOG_WORKER = asyncio.ensure_future(_log_worker(_LOG_WAKEUP))
+    if _LOG_BUFFER_LENGTH > DISCORD_MESSAGE_LIMIT:
+        _LOG_WAKEUP.set()
+
+
+def _take_log_message() -> List[str]:
+    """Take as many buffered lines as fit in one message, splitting a line that is too
+    long on its own.
+    """
+    global _LOG_BUFFER_LENGTH
+    lines: List[str] = []
+    length = 0
+    while LOG_BUFFER:
+        line = LOG_BUFFER[0]
+        if not lines and len(line) > DISCORD_MESSAGE_LIMIT:
+            LOG_BUFFER[0] = line[DISCORD_MESSAGE_LIMIT:]
+            _LOG_BUFFER_LENGTH -= DISCORD_MESSAGE_LIMIT
+            return [line[:DISCORD_MESSAGE_LIMIT]]
+        if length + len(line) + len(lines) > DISCORD_MESSAGE_LIMIT:
+            break
+        lines.append(LOG_BUFFER.popleft())
+        length += len(line)
+        _LOG_BUFFER_LENGTH -= len(line) + 1
+    return lines
+
+
+async def flush_logs(direct: bool = False) -> None:
+    """Send the buffered lines to the log channel, merged into as few messages as
+    possible. Lines that fail to send are put back to be retried on the next flush. If
+    direct, then they are sent straight to the channel, rather than through the outbound
+    scheduler.
+    """
+    global _LOG_BUFFER_LENGTH
+    if _LOG_FLUSH_LOCK is None:
+        return
+    async with _LOG_FLUSH_LOCK:
+        channel = bot.get_channel(LOG_CHANNEL)
+        if channel is None:
+            return  # Not connected yet
+        while LOG_BUFFER:
+            lines = _take_log_message()
+            try:
+                if direct:
+                    await channel.send("\n".join(lines))
+                else:
+                    await send(channel, "\n".join(lines), Priority.LOG)
+            except Exception:
+                logging.exception("Failed to send to the log channel!")
+                LOG_STATS["Send errors"] += 1
+                LOG_BUFFER.extendleft(reversed(lines))
+                _LOG_BUFFER_LENGTH += sum(len(line) + 1 for line in lines)
+                _drop_log_lines()
+                return
+            LOG_STATS["Messages sent"] += 1
+
+
+async def _log_worker(wakeup: asyncio.Event):
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), LOG_FLUSH_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        try:
+            await flush_logs()
+        except Exception:
+            # The worker is only started once, so it mustn't die
+            logging.exception("Flushing the log sink failed!")
+
+
+async def close_log_sink() -> None:
+    """Stop the log sink, and send whatever is still buffered. It's sent directly, as on
+    shut down discord.py may have cancelled the outbound scheduler's workers already.
+    """
+    global _LOG_WORKER
+    if _LOG_WORKER is not None:
+        _LOG_WORKER.cancel()
+        _LOG_WORKER = None
+    await flush_logs(direct=True)
 
 
 ATTENDEE_ROLE = get_str_env("DISCORD_REGISTERED_ROLE_NAME")
@@ -111,9 +246,82 @@ YOUTUBE_CATEGORY = get_int_env("DISCORD_YOUTUBE_CATEGORY")
 GUILD_ID = get_int_env("DISCORD_GUILD_ID")
 
 
+# Indexes of the guild's roles and channels, kept up to date by the gateway events. As
+# names aren't unique, the name indexes hold all the objects with the name by ID.
+ROLES_BY_ID: Dict[int, Role] = {}
+ROLES_BY_NAME: Dict[str, Dict[int, Role]] = {}
+CHANNELS_BY_ID: Dict[int, GuildChannel] = {}
+CHANNELS_BY_NAME: Dict[str, Dict[int, GuildChannel]] = {}
+
+
+def index_role(role: Role) -> None:
+    """Add the role to the role indexes."""
+    ROLES_BY_ID[role.id] = role
+    ROLES_BY_NAME.setdefault(role.name, {})[role.id] = role
+
+
+def unindex_role(role: Role) -> None:
+    """Remove the role, by its ID and the given role's name, from the role indexes."""
+    ROLES_BY_ID.pop(role.id, None)
+    roles = ROLES_BY_NAME.get(role.name, {})
+    roles.pop(role.id, None)
+    if not roles:
+        ROLES_BY_NAME.pop(role.name, None)
+
+
+def index_channel(channel: GuildChannel) -> None:
+    """Add the channel to the channel indexes."""
+    CHANNELS_BY_ID[channel.id] = channel
+    CHANNELS_BY_NAME.setdefault(channel.name, {})[channel.id] = channel
+
+
+def unindex_channel(channel: GuildChannel) -> None:
+    """Remove the channel, by its ID and the given channel's name, from the channel
+    indexes.
+    """
+    CHANNELS_BY_ID.pop(channel.id, None)
+    channels = CHANNELS_BY_NAME.get(channel.name, {})
+    channels.pop(channel.id, None)
+    if not channels:
+        CHANNELS_BY_NAME.pop(channel.name, None)
+
+
+def index_guild(guild: Guild) -> None:
+    """Rebuild the role and channel indexes from the guild, and forget the server info
+    so that it is looked up again.
+    """
+    for index in (ROLES_BY_ID, ROLES_BY_NAME, CHANNELS_BY_ID, CHANNELS_BY_NAME):
+        index.clear()
+    for role in guild.roles:
+        index_role(role)
+    for channel in guild.channels:
+        index_channel(channel)
+    invalidate_server_info()
+
+
+def find_role(name: str) -> Optional[Role]:
+    """Get a role of the guild with the given name, if there is one."""
+    roles = ROLES_BY_NAME.get(name)
+    return next(iter(roles.values())) if roles else None
+
+
+def find_channel(name: str) -> Optional[GuildChannel]:
+    """Get a channel of the guild with the given name, if there is one."""
+    channels = CHANNELS_BY_NAME.get(name)
+    return next(iter(channels.values())) if channels else None
+
+
+def invalidate_server_info() -> None:
+    """Forget the server info, so that it is looked up again the next time."""
+    global SERVER_INFO_CACHE
+    SERVER_INFO_CACHE = None
+
+
 @dataclass
 class ServerInfo:
-    """A representation of data to be retrieved only once from the discord server"""
+    """A representation of data to be retrieved from the discord server, once after
+    each change to its roles or channels.
+    """
 
     guild: Guild
     attendee: Role
@@ -138,29 +346,31 @@ class ServerInfo:
         if SERVER_INFO_CACHE is None:
             guild = bot.get_guild(GUILD_ID)
             assert guild is not None, "No guild was found!"
+            if not ROLES_BY_ID:
+                index_guild(guild)
 
-            attendee = get(guild.roles, name=ATTENDEE_ROLE)
+            attendee = find_role(ATTENDEE_ROLE)
             assert attendee is not None, "The attendee role was not found!"
 
-            registration = get(guild.roles, name=REGISTRATION_ROLE)
+            registration = find_role(REGISTRATION_ROLE)
             assert registration is not None, "The registration role was not found!"
 
-            organizer = get(guild.roles, name=ORGANIZER_ROLE)
+            organizer = find_role(ORGANIZER_ROLE)
             assert organizer is not None, "The organizer role was not found!"
 
-            speaker = get(guild.roles, name=SPEAKER_ROLE)
+            speaker = find_role(SPEAKER_ROLE)
             assert speaker is not None, "The speaker role was not found!"
 
-            patron_sponsor = get(guild.roles, name=SPONSOR_PATRON_ROLE)
+            patron_sponsor = find_role(SPONSOR_PATRON_ROLE)
             assert patron_sponsor is not None, "The patron sponsor role was not found!"
 
-            # silver_sponsor = get(guild.roles, name=SPONSOR_SILVER_ROLE)
+            # silver_sponsor = find_role(SPONSOR_SILVER_ROLE)
             # assert silver_sponsor is not None, "The silver sponsor role was not found!"
 
-            gold_sponsor = get(guild.roles, name=SPONSOR_GOLD_ROLE)
+            gold_sponsor = find_role(SPONSOR_GOLD_ROLE)
             assert gold_sponsor is not None, "The gold sponsor role was not found!"
 
-            platinum_sponsor = get(guild.roles, name=SPONSOR_PLATINUM_ROLE)
+            platinum_sponsor = find_role(SPONSOR_PLATINUM_ROLE)
             assert platinum_sponsor is not None, "The platinum sponsor role was not found!"
 
             help_desk = bot.get_channel(HELP_DESK)
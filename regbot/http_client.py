@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, Optional
+
+import httpx
+
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE_SECONDS = 1.0
+HTTP_BACKOFF_MAX_SECONDS = 30.0
+HTTP_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=10, max_connections=20)
+HTTP_DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+# Timeouts for hosts that need more than the default, such as for large responses.
+HTTP_HOST_TIMEOUTS: Dict[str, httpx.Timeout] = {
+    "api.quicket.co.za": httpx.Timeout(60.0, connect=5.0),
+}
+
+HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+class TokenBucket:
+    """A token bucket rate limiter, allowing bursts of up to `capacity` requests and
+    refilling at `rate` requests per second.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available, then take it"""
+        async with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create a pooled async HTTP client, using HTTP/2 if the h2 package is installed"""
+    try:
+        import h2  # noqa: F401
+
+        http2 = True
+    except ImportError:
+        http2 = False
+    return httpx.AsyncClient(
+        http2=http2, limits=HTTP_LIMITS, timeout=HTTP_DEFAULT_TIMEOUT
+    )
+
+
+def set_http_client(client: Optional[httpx.AsyncClient]) -> None:
+    """Set the application wide HTTP client, such as one pointing at a stand in server"""
+    global HTTP_CLIENT
+    HTTP_CLIENT = client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the application wide HTTP client, creating it if it doesn't exist yet"""
+    if HTTP_CLIENT is None:
+        set_http_client(create_http_client())
+    assert HTTP_CLIENT is not None
+    return HTTP_CLIENT
+
+
+async def close_http_client() -> None:
+    """Close the application wide HTTP client and its pooled connections"""
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+        set_http_client(None)
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff for the given (0 indexed) attempt, with full jitter"""
+    return random.uniform(
+        0, min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * 2**attempt)
+    )
+
+
+async def request(
+    method: str, url: str, rate_limiter: Optional[TokenBucket] = None, **kwargs
+) -> httpx.Response:
+    """Make a request with the application wide HTTP client, retrying transport errors
+    and retryable status codes with a jittered exponential backoff. If a rate limiter is
+    given, a token is taken before every attempt, retries included.
+    """
+    client = get_http_client()
+    host = httpx.URL(url).host
+    if "timeout" not in kwargs and host in HTTP_HOST_TIMEOUTS:
+        kwargs["timeout"] = HTTP_HOST_TIMEOUTS[host]
+    attempt = 0
+    while True:
+        retry_after = 0.0
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+            reason = repr(e)
+        else:
+            if (
+                response.status_code not in HTTP_RETRY_STATUS_CODES
+                or attempt >= HTTP_MAX_RETRIES
+            ):
+                return response
+            reason = f"status {response.status_code}"
+            if response.headers.get("Retry-After", "").isdigit():
+                retry_after = float(response.headers["Retry-After"])
+        delay = max(backoff_seconds(attempt), retry_after)
+        logging.info(f"Retrying {method} {url} in {delay:.1f}s due to {reason}")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def get(
+    url: str, rate_limiter: Optional[TokenBucket] = None, **kwargs
+) -> httpx.Response:
+    """Make a GET request, see `request`"""
+    return await request("GET", url, rate_limiter, **kwargs)
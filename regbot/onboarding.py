@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from discord import Member
+
+from regbot.helpers import (
+    DISCORD_MESSAGE_LIMIT,
+    ServerInfo,
+    get_str_env,
+    log,
+    register_stats,
+)
+from regbot.outbound import Priority, send
+
+EVENT_NAME = get_str_env("EVENT_NAME")
+# Members that joined within this many seconds of each other are welcomed together
+WELCOME_BATCH_SECONDS = 5
+WELCOME_PREFIX = f"Welcome to {EVENT_NAME}, "
+WELCOME_SUFFIX = (
+    "! Please register your ticket with me in the Direct Message channel that I created "
+    "with you..."
+)
+
+# Mentions of the members waiting to be welcomed in the welcome channel
+PENDING_WELCOMES: List[str] = []
+_WELCOMER: Optional[asyncio.Future] = None
+ONBOARDING_STATS = {
+    "Members onboarded": 0,
+    "DMs failed": 0,
+    "Welcome messages sent": 0,
+    "Welcome messages failed": 0,
+    "Members welcomed": 0,
+    "Total DM latency (s)": 0.0,
+    "Max DM latency (s)": 0.0,
+}
+
+
+def get_onboarding_stats() -> Dict[str, Any]:
+    """The onboarding statistics, with the average latency from joining to being sent
+    the DM.
+    """
+    stats = {k: v for k, v in ONBOARDING_STATS.items() if k != "Total DM latency (s)"}
+    onboarded = ONBOARDING_STATS["Members onboarded"]
+    stats["Average DM latency (s)"] = (
+        ONBOARDING_STATS["Total DM latency (s)"] / onboarded if onboarded else 0.0
+    )
+    stats["Welcomes pending"] = len(PENDING_WELCOMES)
+    return stats
+
+
+register_stats("Onboarding", get_onboarding_stats)
+
+
+def get_greeting(member: Member, server_info: ServerInfo) -> str:
+    """The DM greeting a new member, with instructions on registering"""
+    return (
+        f"Welcome {member.name} to {EVENT_NAME}!\n\n"
+        f"I am the registration bot for {EVENT_NAME}. Simply "
+        "say `!register <Quicket Ticket barcode number>` without the `<`/`>`, and I "
+        "will check in your ticket and give you the appropriate permissions on the "
+        "discord server! You can also use the `!help` command for more options.\n\n"
+        f"If you need any assistance, then please do not hesitate to ask for it at the"
+        f" {server_info.help_desk.mention}, or from an organizer."
+    )
+
+
+def batch_welcomes(mentions: List[str]) -> List[List[str]]:
+    """Split the mentions into as few batches as fit within Discord's message length
+    limit, once made into welcome messages.
+    """
+    room = DISCORD_MESSAGE_LIMIT - len(WELCOME_PREFIX) - len(WELCOME_SUFFIX)
+    batches = []
+    batch: List[str] = []
+    length = 0
+    for mention in mentions:
+        if batch and length + len(", ") + len(mention) > room:
+            batches.append(batch)
+            batch, length = [], 0
+        length += len(mention) + (len(", ") if batch else 0)
+        batch.append(mention)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def get_welcome(mentions: List[str]) -> str:
+    """The message welcoming the mentioned members in the welcome channel"""
+    return WELCOME_PREFIX + ", ".join(mentions) + WELCOME_SUFFIX
+
+
+async def _welcome_batch():
+    """Wait for the batch window to close, then welcome everyone that joined in it.
+    Members are only taken off the pending list once their welcome was sent, so that
+    the next batch welcomes them if it failed.
+    """
+    global _WELCOMER
+    await asyncio.sleep(WELCOME_BATCH_SECONDS)
+    try:
+        server_info = await ServerInfo.get()
+        for batch in batch_welcomes(PENDING_WELCOMES[:]):
+            await send(
+                server_info.welcome_channel, get_welcome(batch), Priority.ONBOARDING
+            )
+            # Members that joined meanwhile were added to the end
+            del PENDING_WELCOMES[: len(batch)]
+            ONBOARDING_STATS["Welcome messages sent"] += 1
+            ONBOARDING_STATS["Members welcomed"] += len(batch)
+    except Exception:
+        ONBOARDING_STATS["Welcome messages failed"] += 1
+        logging.exception("Failed to welcome new members, retrying with the next batch!")
+    _WELCOMER = None
+    if PENDING_WELCOMES:
+        _WELCOMER = asyncio.ensure_future(_welcome_batch())
+
+
+async def onboard(member: Member) -> None:
+    """Greet the new member with a single DM, and queue them to be welcomed in the
+    welcome channel along with the others that join around the same time.
+    """
+    global _WELCOMER
+    joined = time.monotonic()
+    server_info = await ServerInfo.get()
+
+    PENDING_WELCOMES.append(member.mention)
+    if _WELCOMER is None or _WELCOMER.done():
+        _WELCOMER = asyncio.ensure_future(_welcome_batch())
+
+    try:
+        await send(member, get_greeting(member, server_info), Priority.ONBOARDING)
+    except Exception as e:
+        ONBOARDING_STATS["DMs failed"] += 1
+        return await log(f"Could not greet {member.mention} via DM, due to {e}")
+    latency = time.monotonic() - joined
+    ONBOARDING_STATS["Members onboarded"] += 1
+    ONBOARDING_STATS["Total DM latency (s)"] += latency
+    ONBOARDING_STATS["Max DM latency (s)"] = max(
+        ONBOARDING_STATS["Max DM latency (s)"], latency
+    )
+    await log(f"{member.mention} has been greeted via DM.")
@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from discord import Message
+from discord.abc import Messageable, User
+from discord.ext import commands
+
+# Requests to Discord are sent by this many workers at a time
+OUTBOUND_WORKERS = 5
+
+Request = Callable[[], Awaitable[Any]]
+
+
+class Priority(IntEnum):
+    """The priority classes of outbound requests, most urgent first"""
+
+    INTERACTIVE = 0  # Replies to commands
+    ONBOARDING = 1  # Greeting new members
+    ANNOUNCEMENT = 2
+    LOG = 3
+    HOUSEKEEPING = 4  # Maintaining channels, such as pinning talk information
+
+
+class OutboundScheduler:
+    """Sends requests to Discord in priority order, and in the order they were submitted
+    within a priority class. Discord rate limits each route (such as the messages of a
+    channel) separately, so only one request per route is in flight at a time, and a
+    route that is being rate limited doesn't hold up the workers for other routes.
+    """
+
+    def __init__(self, workers: int):
+        self.worker_count = workers
+        self.workers: List[asyncio.Future] = []
+        self.routes: Dict[
+            Hashable, List[Tuple[int, int, float, Request, asyncio.Future]]
+        ] = {}
+        self.busy: Set[Hashable] = set()
+        self.counter = itertools.count()
+        self.condition: Optional[asyncio.Condition] = None
+        self.queued = {priority: 0 for priority in Priority}
+        self.sent = {priority: 0 for priority in Priority}
+        self.total_wait = {priority: 0.0 for priority in Priority}
+        self.max_wait = {priority: 0.0 for priority in Priority}
+
+    async def submit(self, route: Hashable, priority: Priority, request: Request) -> Any:
+        """Queue the request on the given route, and return its result once sent."""
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+            self.workers = [
+                asyncio.ensure_future(self._work()) for _ in range(self.worker_count)
+            ]
+        future = asyncio.get_event_loop().create_future()
+        async with self.condition:
+            heapq.heappush(
+                self.routes.setdefault(route, []),
+                (priority, next(self.counter), time.monotonic(), request, future),
+            )
+            self.queued[priority] += 1
+            self.condition.notify()
+        return await future
+
+    def _ready(self) -> Optional[Hashable]:
+        """The idle route with the most urgent request at its head, if any"""
+        heads = [
+            (queue[0][:2], route)
+            for route, queue in self.routes.items()
+            if route not in self.busy
+        ]
+        return min(heads, key=lambda head: head[0])[1] if heads else None
+
+    async def _work(self):
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self._ready() is not None)
+                route = self._ready()
+                priority, _, queued_at, request, future = heapq.heappop(
+                    self.routes[route]
+                )
+                if not self.routes[route]:
+                    del self.routes[route]
+                self.busy.add(route)
+                self.queued[priority] -= 1
+
+            wait = time.monotonic() - queued_at
+            self.sent[priority] += 1
+            self.total_wait[priority] += wait
+            self.max_wait[priority] = max(self.max_wait[priority], wait)
+            try:
+                if not future.cancelled():
+                    future.set_result(await request())
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+                else:
+                    logging.exception(f"Outbound request on {route} failed!")
+            finally:
+                async with self.condition:
+                    self.busy.discard(route)
+                    self.condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """The queue depth and queue times of each priority class"""
+        stats: Dict[str, Any] = {}
+        for priority in Priority:
+            name = priority.name.capitalize()
+            sent = self.sent[priority]
+            stats[f"{name} queued"] = self.queued[priority]
+            stats[f"{name} sent"] = sent
+            stats[f"{name} average wait (s)"] = (
+                self.total_wait[priority] / sent if sent else 0.0
+            )
+            stats[f"{name} max wait (s)"] = self.max_wait[priority]
+        return stats
+
+
+OUTBOUND = OutboundScheduler(OUTBOUND_WORKERS)
+
+
+def route_of(target: Messageable) -> Hashable:
+    """The rate limit route of sending messages to the given target"""
+    if isinstance(target, commands.Context):
+        target = target.channel
+    if isinstance(target, User):
+        return "dm", target.id
+    return "channel", target.id
+
+
+async def send(
+    target: Messageable, text: str, priority: Priority = Priority.INTERACTIVE
+) -> Message:
+    """Send the text to the target through the outbound scheduler."""
+    if isinstance(target, commands.Context):
+        # A command context's own send goes through the scheduler, on the same route
+        target = target.channel
+    return await OUTBOUND.submit(route_of(target), priority, lambda: target.send(text))
+
+
+async def pin(message: Message, reason: str) -> None:
+    """Pin the message through the outbound scheduler, as housekeeping."""
+    await OUTBOUND.submit(
+        ("pins", message.channel.id),
+        Priority.HOUSEKEEPING,
+        lambda: message.pin(reason=reason),
+    )
+
+
+class OutboundContext(commands.Context):
+    """Command context that sends its replies through the outbound scheduler, as
+    interactive requests.
+    """
+
+    async def send(self, content=None, **kwargs):
+        return await OUTBOUND.submit(
+            route_of(self.channel),
+            Priority.INTERACTIVE,
+            lambda: commands.Context.send(self, content, **kwargs),
+        )
@@ -1,10 +1,14 @@
-from dataclasses import dataclass
-from typing import Dict, Optional
+from __future__ import annotations
+
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
 from urllib.parse import urljoin
 
 import httpx
 
-from regbot.helpers import get_int_env, get_str_env, log
+from regbot import http_client
+from regbot.helpers import get_int_env, get_str_env
 
 USER_TOKEN = get_str_env("QUICKET_USER_TOKEN")
 API_KEY = get_str_env("QUICKET_API_KEY")
@@ -13,11 +17,17 @@ EVENT_ID = get_int_env("QUICKET_EVENT_ID")
 
 
 QUICKET_BASE_URL = "https://api.quicket.co.za"
+MAX_LISTED_BARCODES = 20
 
 
 @dataclass
 class Ticket:
-    """A partial representation of the TicketInformation object from Quicket"""
+    """A partial representation of the TicketInformation object from Quicket.
+    Slotted, with the ticket type interned and the full name precomputed, to keep large
+    guest lists compact.
+    """
+
+    __slots__ = ("barcode", "valid", "first_name", "surname", "type", "full_name")
 
     barcode: str
     valid: bool
@@ -25,43 +35,102 @@ class Ticket:
     surname: str
     type: str
 
+    def __post_init__(self):
+        self.type = sys.intern(self.type)
+        self.full_name = f"{self.first_name} {self.surname}"
+
+
+@dataclass
+class TicketCacheDiff:
+    """The differences between two generations of the tickets cache, by barcode"""
+
+    added: Set[str] = field(default_factory=set)
+    removed: Set[str] = field(default_factory=set)
+    changed: Set[str] = field(default_factory=set)
+    invalidated: Set[str] = field(default_factory=set)
+    duplicates: List[str] = field(default_factory=list)
+
+    @classmethod
+    def between(cls, old: Dict[str, Ticket], new: Dict[str, Ticket]) -> TicketCacheDiff:
+        diff = cls(
+            added=set(new).difference(old),
+            removed=set(old).difference(new),
+        )
+        for barcode in set(old).intersection(new):
+            old_ticket, new_ticket = old[barcode], new[barcode]
+            if old_ticket == new_ticket:
+                continue
+            if old_ticket.valid and not new_ticket.valid:
+                diff.invalidated.add(barcode)
+            else:
+                diff.changed.add(barcode)
+        return diff
+
     @property
-    def full_name(self) -> str:
-        return f"{self.first_name} {self.surname}"
+    def barcodes(self) -> Set[str]:
+        """All the barcodes of tickets that were affected"""
+        return self.added | self.removed | self.changed | self.invalidated
+
+    def summary(self) -> str:
+        """A human readable summary of the differences"""
+        parts = []
+        for name, barcodes in (
+            ("added", self.added),
+            ("removed", self.removed),
+            ("changed", self.changed),
+            ("invalidated", self.invalidated),
+            ("duplicated", self.duplicates),
+        ):
+            if not barcodes:
+                continue
+            listed = ", ".join(sorted(barcodes)[:MAX_LISTED_BARCODES])
+            if len(barcodes) > MAX_LISTED_BARCODES:
+                listed += ", ..."
+            parts.append(f"{len(barcodes)} {name} ({listed})")
+        return "; ".join(parts) or "No changes."
 
 
 TICKETS: Dict[str, Ticket] = {}
+TICKETS_ETAG: Optional[str] = None
 
 
-async def update_ticket_cache() -> None:
-    """Update the global TICKETS cache dictionary from Quicket"""
-    async with httpx.AsyncClient() as client:
-        url = urljoin(QUICKET_BASE_URL, f"api/events/{EVENT_ID}/guests")
-        r = await client.get(
-            url,
-            params={"api_key": API_KEY},
-            headers={"usertoken": USER_TOKEN},
+async def update_ticket_cache() -> Optional[TicketCacheDiff]:
+    """Update the global TICKETS cache dictionary from Quicket. The new guest list is
+    built separately and swapped in once complete, so that lookups never see a partial
+    cache. Returns the differences with the previous cache, or None if the guest list
+    was unchanged according to Quicket.
+    """
+    global TICKETS, TICKETS_ETAG
+
+    headers = {"usertoken": USER_TOKEN}
+    if TICKETS_ETAG is not None:
+        headers["If-None-Match"] = TICKETS_ETAG
+    url = urljoin(QUICKET_BASE_URL, f"api/events/{EVENT_ID}/guests")
+    r = await http_client.get(url, params={"api_key": API_KEY}, headers=headers)
+    if r.status_code == httpx.codes.NOT_MODIFIED:
+        return None
+    r.raise_for_status()
+
+    tickets: Dict[str, Ticket] = {}
+    duplicates = []
+    for result in r.json()["results"]:
+        info = result["TicketInformation"]
+        ticket = Ticket(
+            barcode=str(info["Ticket Barcode"]),
+            valid=bool(info["Valid"]),
+            first_name=str(info["First name"]),
+            surname=str(info["Surname"]),
+            type=str(info["Ticket Type"]),
         )
-
-        global TICKETS
-        TICKETS = {}
-
-        for result in r.json()["results"]:
-            info = result["TicketInformation"]
-            ticket = Ticket(
-                barcode=str(info["Ticket Barcode"]),
-                valid=bool(info["Valid"]),
-                first_name=str(info["First name"]),
-                surname=str(info["Surname"]),
-                type=str(info["Ticket Type"]),
-            )
-            if ticket.barcode in TICKETS:
-                await log(
-                    f"A duplicate barcode {ticket.barcode} was found and the record "
-                    f"replaced! {TICKETS[ticket.barcode].full_name} was replaced by "
-                    f"{ticket.full_name}."
-                )
-            TICKETS[ticket.barcode] = ticket
+        if ticket.barcode in tickets:
+            duplicates.append(ticket.barcode)
+        tickets[ticket.barcode] = ticket
+
+    diff = TicketCacheDiff.between(TICKETS, tickets)
+    diff.duplicates = duplicates
+    TICKETS = tickets
+    TICKETS_ETAG = r.headers.get("ETag")
+    return diff
 
 
 async def get_ticket_by_barcode(barcode: str) -> Optional[Ticket]:
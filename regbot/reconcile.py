@@ -0,0 +1,154 @@
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, DefaultDict, Dict, List, Set
+
+from discord import Guild, HTTPException, Member, Role
+
+from regbot import quicket, sheets
+from regbot.attendees import ATTENDEES, TICKET_TYPE_ROLES
+from regbot.helpers import ATTENDEE_ROLE, SPEAKER_ROLE, find_role
+from regbot.outbound import OUTBOUND, Priority
+
+RECONCILE_CONCURRENCY = 4
+RECONCILE_PROGRESS_SECONDS = 10
+MAX_LISTED_CHANGES = 50
+# The roles that registration grants, and that are reconciled
+MANAGED_ROLES = {ATTENDEE_ROLE, SPEAKER_ROLE, *(role for _, role in TICKET_TYPE_ROLES)}
+
+Progress = Callable[[str], Awaitable[None]]
+
+
+@dataclass
+class RoleChange:
+    """The roles to add to and remove from a member"""
+
+    member: Member
+    add: List[Role] = field(default_factory=list)
+    remove: List[Role] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        changes = [f"+{role.name}" for role in self.add]
+        changes.extend(f"-{role.name}" for role in self.remove)
+        return f"{self.member} ({self.member.id}): {', '.join(changes)}"
+
+
+@dataclass
+class ReconcilePlan:
+    """The role changes that bring the guild's members in line with their registrations"""
+
+    members_checked: int = 0
+    changes: List[RoleChange] = field(default_factory=list)
+    # Members holding the attendee role that aren't in the registration ledger. They are
+    # left alone, as they may have been registered by hand.
+    unregistered_attendees: int = 0
+    missing_roles: Set[str] = field(default_factory=set)
+
+    def summary(self, detailed: bool = False) -> str:
+        """A human readable summary of the plan, listing the changes if detailed."""
+        lines = [
+            f"Checked {self.members_checked} member(s): {len(self.changes)} to change, "
+            f"{self.unregistered_attendees} unregistered attendee(s) left alone."
+        ]
+        if self.missing_roles:
+            lines.append(f"Roles not found: {', '.join(sorted(self.missing_roles))}")
+        if detailed:
+            lines.extend(str(change) for change in self.changes[:MAX_LISTED_CHANGES])
+            if len(self.changes) > MAX_LISTED_CHANGES:
+                lines.append(f"...and {len(self.changes) - MAX_LISTED_CHANGES} more.")
+        return "\n".join(lines)
+
+
+def plan_reconcile(guild: Guild) -> ReconcilePlan:
+    """Compare every member of the guild with the registration ledger and the attendee
+    index, in one pass. Registered members are given the roles their tickets entitle
+    them to that they are missing. Registered members whose tickets were all invalidated
+    lose all the registration roles. Other roles, extra registration roles of members
+    with a valid ticket, and members with tickets missing from the guest list are left
+    alone, as they may have been given or registered by hand.
+    """
+    assert sheets.REGISTRATION_LEDGER is not None, "The ledger hasn't been loaded yet!"
+    assert quicket.TICKETS, "The tickets cache hasn't been loaded yet!"
+
+    roles: Dict[str, Role] = {}
+    for name in MANAGED_ROLES:
+        role = find_role(name)
+        if role is not None:
+            roles[name] = role
+    plan = ReconcilePlan(missing_roles=MANAGED_ROLES.difference(roles))
+    barcodes_by_member: DefaultDict[int, List[str]] = defaultdict(list)
+    for registration in sheets.REGISTRATION_LEDGER.values():
+        if registration.discord_id is not None:
+            barcodes_by_member[registration.discord_id].append(registration.barcode)
+
+    for member in guild.members:
+        if member.bot:
+            continue
+        plan.members_checked += 1
+        current = {role.name for role in member.roles}
+        barcodes = barcodes_by_member.get(member.id)
+        if not barcodes:
+            if ATTENDEE_ROLE in current:
+                plan.unregistered_attendees += 1
+            continue
+
+        entitled: Set[str] = set()
+        valid = unknown = False
+        for barcode in barcodes:
+            attendee = ATTENDEES.get(barcode)
+            if attendee is None:
+                unknown = True
+            elif attendee.ticket.valid:
+                valid = True
+                entitled.update(attendee.roles)
+        if valid:
+            add, remove = entitled.difference(current), set()
+        elif not unknown:
+            add, remove = set(), MANAGED_ROLES.intersection(current)
+        else:
+            continue
+
+        change = RoleChange(
+            member,
+            add=[roles[name] for name in sorted(add) if name in roles],
+            remove=[roles[name] for name in sorted(remove) if name in roles],
+        )
+        if change.add or change.remove:
+            plan.changes.append(change)
+    return plan
+
+
+async def apply_reconcile(plan: ReconcilePlan, progress: Progress) -> int:
+    """Apply the planned role changes, a few at a time, as housekeeping through the
+    outbound scheduler. Reports progress regularly. Returns the number of changes that
+    failed.
+    """
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    done = failed = 0
+    last_report = time.monotonic()
+
+    async def apply(change: RoleChange):
+        nonlocal done, failed, last_report
+        async with semaphore:
+            member = change.member
+
+            async def edit():
+                # Read the roles when sending, as other changes may have been made since
+                roles = [role for role in member.roles[1:] if role not in change.remove]
+                roles.extend(role for role in change.add if role not in roles)
+                await member.edit(roles=roles, reason="Role reconciliation")
+
+            try:
+                await OUTBOUND.submit(("member", member.id), Priority.HOUSEKEEPING, edit)
+            except HTTPException:
+                failed += 1
+            done += 1
+            if time.monotonic() - last_report > RECONCILE_PROGRESS_SECONDS:
+                last_report = time.monotonic()
+                await progress(
+                    f"Reconciling roles: {done}/{len(plan.changes)} done, {failed} failed."
+                )
+
+    await asyncio.gather(*(apply(change) for change in plan.changes))
+    return failed
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from discord import HTTPException
+from gspread.exceptions import APIError
+
+from regbot.helpers import register_stats
+
+REGISTRATION_WORKERS = 8
+REGISTRATION_QUEUE_SIZE = 200
+
+Job = Callable[[], Awaitable[Any]]
+
+
+def is_pushback(error: BaseException) -> bool:
+    """Check if the error means that Discord or Google Sheets is overloaded, or is rate
+    limiting us.
+    """
+    if isinstance(error, HTTPException):
+        return error.status == 429 or error.status >= 500
+    if isinstance(error, APIError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, asyncio.TimeoutError)
+
+
+class RegistrationQueue:
+    """Runs registrations through a bounded queue and pool of workers. Only one
+    registration per barcode and per member can be in the queue at a time.
+
+    The number of registrations run at once adapts to how Discord and Google Sheets
+    cope: it is halved whenever a registration fails due to them pushing back, and grows
+    by one again after a run of successes, up to the number of workers.
+    """
+
+    def __init__(self, workers: int, size: int):
+        self.max_limit = workers
+        self.limit = workers
+        self.active = 0
+        self.pending = 0  # Queued, or waiting for the concurrency limit to allow it
+        self.successes = 0
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.condition = asyncio.Condition()
+        self.in_progress: Set[Tuple[str, Any]] = set()
+        self.workers: List[asyncio.Future] = []
+        self.stats = {
+            "Completed": 0,
+            "Failed": 0,
+            "Shed": 0,
+            "Duplicates": 0,
+            "Pushbacks": 0,
+            "Total wait (s)": 0.0,
+        }
+
+    def is_in_progress(self, barcode: str, member_id: int) -> bool:
+        """Check if a registration of the barcode, or by the member, is in the queue."""
+        keys = (("barcode", barcode), ("member", member_id))
+        in_progress = any(key in self.in_progress for key in keys)
+        if in_progress:
+            self.stats["Duplicates"] += 1
+        return in_progress
+
+    def submit(
+        self, barcode: str, member_id: int, job: Job
+    ) -> Tuple[asyncio.Future, int]:
+        """Queue the registration job. Returns the future of its result, and the number
+        of registrations ahead of it that have yet to start. Raises asyncio.QueueFull
+        if the queue is full, in which case the registration should be tried later.
+        """
+        if not self.workers:
+            self.workers = [
+                asyncio.ensure_future(self._work()) for _ in range(self.max_limit)
+            ]
+        future = asyncio.get_event_loop().create_future()
+        keys = (("barcode", barcode), ("member", member_id))
+        try:
+            self.queue.put_nowait((keys, job, future, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats["Shed"] += 1
+            raise
+        self.in_progress.update(keys)
+        self.pending += 1
+        return future, max(0, self.pending - (self.limit - self.active))
+
+    async def _work(self):
+        while True:
+            keys, job, future, queued_at = await self.queue.get()
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.active < self.limit)
+                self.active += 1
+                self.pending -= 1
+            self.stats["Total wait (s)"] += time.monotonic() - queued_at
+            try:
+                future.set_result(await job())
+            except Exception as e:
+                self.stats["Failed"] += 1
+                if is_pushback(e):
+                    self._back_off()
+                future.set_exception(e)
+            else:
+                self.stats["Completed"] += 1
+                self._speed_up()
+            finally:
+                self.in_progress.difference_update(keys)
+                self.queue.task_done()
+                async with self.condition:
+                    self.active -= 1
+                    self.condition.notify_all()
+
+    def _back_off(self) -> None:
+        self.stats["Pushbacks"] += 1
+        self.successes = 0
+        if self.limit > 1:
+            self.limit //= 2
+            logging.warning(f"Registration concurrency lowered to {self.limit}")
+
+    def _speed_up(self) -> None:
+        self.successes += 1
+        if self.limit < self.max_limit and self.successes >= self.limit:
+            self.successes = 0
+            self.limit += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """The statistics of the queue"""
+        started = self.stats["Completed"] + self.stats["Failed"]
+        return {
+            "Waiting": self.pending,
+            "Running": self.active,
+            "Concurrency limit": self.limit,
+            **{k: v for k, v in self.stats.items() if k != "Total wait (s)"},
+            "Average wait (s)": (
+                self.stats["Total wait (s)"] / started if started else 0.0
+            ),
+        }
+
+
+REGISTRATION_QUEUE = RegistrationQueue(REGISTRATION_WORKERS, REGISTRATION_QUEUE_SIZE)
+register_stats("Registration queue", REGISTRATION_QUEUE.get_stats)
@@ -0,0 +1,76 @@
+"""Simulate a burst of members joining, and measure how quickly the onboarding pipeline
+gets through it, against Discord stand-ins that take a fixed time per request.
+Needs the bot's environmental variables to be set, in order to import regbot.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import List
+from unittest.mock import patch
+
+from regbot import helpers, onboarding
+
+REQUEST_SECONDS = 0.05
+# Three DMs and a welcome message per member, as it was before the onboarding pipeline
+OLD_REQUESTS_PER_MEMBER = 4
+
+
+@dataclass
+class FakeChannel:
+    """Stands in for a channel or member, recording what is sent to it"""
+
+    id: int
+    mention: str
+    name: str = "member"
+    sent: List[str] = field(default_factory=list)
+
+    async def send(self, text: str):
+        await asyncio.sleep(REQUEST_SECONDS)
+        self.sent.append(text)
+
+
+async def burst(size: int) -> None:
+    for key, value in onboarding.ONBOARDING_STATS.items():
+        onboarding.ONBOARDING_STATS[key] = type(value)()
+    welcome_channel = FakeChannel(id=1, mention="#welcome")
+    server_info = helpers.ServerInfo.__new__(helpers.ServerInfo)
+    server_info.help_desk = FakeChannel(id=2, mention="#help-desk")
+    server_info.welcome_channel = welcome_channel
+
+    async def get_server_info():
+        return server_info
+
+    members = [FakeChannel(id=1000 + i, mention=f"<@{10**17 + i}>") for i in range(size)]
+
+    with patch.object(helpers.ServerInfo, "get", get_server_info), patch.object(
+        helpers.bot, "get_channel", lambda _id: FakeChannel(id=_id, mention="#log")
+    ):
+        start = time.monotonic()
+        await asyncio.gather(*(onboarding.onboard(member) for member in members))
+        dms_done = time.monotonic() - start
+        while onboarding._WELCOMER is not None or onboarding.PENDING_WELCOMES:
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(REQUEST_SECONDS * 2)
+        welcomed = time.monotonic() - start
+
+    requests = sum(len(m.sent) for m in members) + len(welcome_channel.sent)
+    stats = onboarding.get_onboarding_stats()
+    print(
+        f"{size} members: DMs done in {dms_done:.2f}s, welcomed in {welcomed:.2f}s "
+        f"({onboarding.WELCOME_BATCH_SECONDS}s batch window), {requests} requests "
+        f"instead of {size * OLD_REQUESTS_PER_MEMBER}, "
+        f"{len(welcome_channel.sent)} welcome message(s), "
+        f"average DM latency {stats['Average DM latency (s)']:.2f}s, "
+        f"max {stats['Max DM latency (s)']:.2f}s"
+    )
+
+
+async def main():
+    # One event loop for all the bursts, as the outbound scheduler is bound to it
+    for size in (50, 300):
+        await burst(size)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""Compare the memory used by the slotted Ticket store against plain dataclasses.
+Needs the bot's environmental variables to be set, in order to import regbot.
+"""
+
+import json
+import random
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from regbot.quicket import Ticket
+
+TICKET_TYPES = [
+    "Early Bird",
+    "Standard",
+    "Student",
+    "Speaker",
+    "Gold Sponsor",
+    "Silver Sponsor",
+    "Patron Sponsor",
+]
+
+
+@dataclass
+class DictTicket:
+    """The Ticket representation as it was before being slotted"""
+
+    barcode: str
+    valid: bool
+    first_name: str
+    surname: str
+    type: str
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.surname}"
+
+
+def guest_list(size: int) -> str:
+    """Generate a JSON guest list like the one returned by Quicket"""
+    random.seed(size)
+    return json.dumps(
+        [
+            [
+                str(1_000_000_000 + i),
+                random.random() > 0.05,
+                f"First{i}",
+                f"Surname{i}",
+                random.choice(TICKET_TYPES),
+            ]
+            for i in range(size)
+        ]
+    )
+
+
+def measure(factory: Callable, size: int) -> int:
+    """Get the number of bytes still allocated after parsing a guest list into a barcode
+    to ticket dictionary, and discarding the parsed JSON.
+    """
+    text = guest_list(size)
+    tracemalloc.start()
+    records = json.loads(text)
+    tickets: Dict[str, object] = {
+        barcode: factory(
+            barcode=barcode, valid=valid, first_name=first, surname=last, type=type_
+        )
+        for barcode, valid, first, last, type_ in records
+    }
+    del records
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(tickets) == size
+    return allocated
+
+
+if __name__ == "__main__":
+    for size in (10_000, 100_000):
+        dict_bytes = measure(DictTicket, size)
+        slotted_bytes = measure(Ticket, size)
+        print(
+            f"{size} tickets: dataclasses {dict_bytes / 2**20:.1f} MiB, "
+            f"slotted {slotted_bytes / 2**20:.1f} MiB "
+            f"({slotted_bytes / dict_bytes:.0%})"
+        )
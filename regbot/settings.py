@@ -0,0 +1,7 @@
+import os
+
+# Settings that have a sensible default, so that they don't have to be set
+
+# Where the sync caches are snapshotted to, and warm started from. It holds attendees'
+# names and ticket barcodes, so it is only readable by the bot's user.
+SNAPSHOT_FILE = os.getenv("REGBOT_SNAPSHOT_FILE", ".regbot_snapshot.json.gz")
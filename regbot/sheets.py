@@ -1,21 +1,30 @@
 from __future__ import annotations
 
+import asyncio
 import random
+import time
 from collections import defaultdict
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field, fields
 from datetime import datetime
-from typing import DefaultDict, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, DefaultDict, Dict, List, Optional, Set, Tuple
 
 import gspread_asyncio
 from discord import User
+from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
 from gspread.models import Cell
-from gspread_asyncio import AsyncioGspreadWorksheet
+from gspread_asyncio import AsyncioGspreadClient, AsyncioGspreadWorksheet
 
 from regbot.google import get_creds, get_str_env
-from regbot.helpers import int_or_none, log
+from regbot.helpers import int_or_none, log, register_stats
 from regbot.quicket import Ticket
 
-client_manager = gspread_asyncio.AsyncioGspreadClientManager(get_creds)
+SHEETS_REAUTH_MINUTES = 45
+client_manager = gspread_asyncio.AsyncioGspreadClientManager(
+    get_creds, reauth_interval=SHEETS_REAUTH_MINUTES
+)
+WORKSHEET_CACHE_TTL_SECONDS = 15 * 60
+WORKSHEET_REFRESH_MARGIN_SECONDS = 10 * 60
 SHEET_ID = get_str_env("GOOGLE_SHEET_ID")
 WORKSHEET = get_str_env("GOOGLE_SHEET_WORKSHEET_NAME")
 REG_BARCODE_COLUMN = 1
@@ -23,6 +32,11 @@ REG_FULL_NAME_COLUMN = 2
 REG_DISCORD_NAME_COLUMN = 3
 REG_DISCORD_ID_COLUMN = 4
 REG_DATE_COLUMN = 5
+REG_MAX_COLUMN_NUMBER = 5
+REG_FLUSH_INTERVAL_SECONDS = 5
+REG_FLUSH_MAX_ROWS = 20
+REG_FLUSH_MIN_BACKOFF_SECONDS = 2
+REG_FLUSH_MAX_BACKOFF_SECONDS = 120
 
 QUIZ_SHEET_ID = get_str_env("QUIZ_GOOGLE_SHEET_ID")
 QUIZ_WORKSHEET = get_str_env("QUIZ_GOOGLE_SHEET_WORKSHEET_NAME")
@@ -34,11 +48,106 @@ QUIZ_ANSWERER_COLUMN = 5
 QUIZ_MAX_COLUMN_NUMBER = 5
 
 
-async def get_worksheet(sheet_id: str, worksheet: str) -> AsyncioGspreadWorksheet:
-    """Get the gspread worksheet used to store state of ticket registration"""
+@dataclass
+class CachedWorksheet:
+    """An opened worksheet handle, and the authorized client that opened it"""
+
+    worksheet: AsyncioGspreadWorksheet
+    client: AsyncioGspreadClient
+    opened_at: float
+
+
+WORKSHEET_CACHE: Dict[Tuple[str, str], CachedWorksheet] = {}
+WORKSHEET_CACHE_STATS = {"Opens": 0, "Opens saved": 0, "Invalidations": 0}
+register_stats("Worksheet cache", lambda: WORKSHEET_CACHE_STATS)
+
+
+async def open_worksheet(sheet_id: str, worksheet: str) -> AsyncioGspreadWorksheet:
+    """Open the given worksheet with a (re)authorized client, and cache the handle"""
     client = await client_manager.authorize()
     sheet = await client.open_by_key(sheet_id)
-    return await sheet.worksheet(worksheet)
+    work_sheet = await sheet.worksheet(worksheet)
+    WORKSHEET_CACHE[(sheet_id, worksheet)] = CachedWorksheet(
+        worksheet=work_sheet, client=client, opened_at=time.monotonic()
+    )
+    WORKSHEET_CACHE_STATS["Opens"] += 1
+    return work_sheet
+
+
+async def get_worksheet(sheet_id: str, worksheet: str) -> AsyncioGspreadWorksheet:
+    """Get the gspread worksheet from cache, or open it if it isn't cached, the cached
+    handle expired or its client has since been reauthorized.
+    """
+    client = await client_manager.authorize()
+    cached = WORKSHEET_CACHE.get((sheet_id, worksheet))
+    if (
+        cached is not None
+        and cached.client is client
+        and time.monotonic() - cached.opened_at < WORKSHEET_CACHE_TTL_SECONDS
+    ):
+        WORKSHEET_CACHE_STATS["Opens saved"] += 1
+        return cached.worksheet
+    return await open_worksheet(sheet_id, worksheet)
+
+
+def force_reauthorize() -> None:
+    """Have the client manager authorize a new client the next time it's used. The
+    current client is dropped from its cache here, as the manager only drops it itself
+    when reauthorizing after its interval.
+    """
+    client_manager._agc_cache.pop(client_manager.auth_time, None)
+    client_manager.auth_time = None
+
+
+def invalidate_worksheets() -> None:
+    """Forget all cached worksheet handles, and force the client to reauthorize so that
+    its own spreadsheet caches are dropped as well.
+    """
+    WORKSHEET_CACHE.clear()
+    force_reauthorize()
+    WORKSHEET_CACHE_STATS["Invalidations"] += 1
+
+
+@asynccontextmanager
+async def opened_worksheet(
+    sheet_id: str, worksheet: str
+) -> AsyncIterator[AsyncioGspreadWorksheet]:
+    """Context manager for using a cached worksheet, which is invalidated if its use
+    results in an authorization or not found error.
+    """
+    try:
+        yield await get_worksheet(sheet_id, worksheet)
+    except (SpreadsheetNotFound, WorksheetNotFound):
+        invalidate_worksheets()
+        raise
+    except APIError as e:
+        if e.response.status_code in (401, 403, 404):
+            invalidate_worksheets()
+        raise
+
+
+async def refresh_worksheet_cache() -> None:
+    """Reauthorize the client if its token is close to expiring, and reopen the cached
+    worksheets that have expired or belong to an old client. Meant to be called
+    regularly, so that commands rarely have to wait for either.
+    """
+    now = asyncio.get_event_loop().time()
+    if (
+        client_manager.auth_time is not None
+        and client_manager.auth_time
+        + client_manager.reauth_interval
+        - WORKSHEET_REFRESH_MARGIN_SECONDS
+        < now
+    ):
+        force_reauthorize()
+    client = await client_manager.authorize()
+    for (sheet_id, worksheet), cached in list(WORKSHEET_CACHE.items()):
+        if (
+            cached.client is not client
+            or time.monotonic() - cached.opened_at
+            > WORKSHEET_CACHE_TTL_SECONDS - WORKSHEET_REFRESH_MARGIN_SECONDS
+        ):
+            await open_worksheet(sheet_id, worksheet)
 
 
 @dataclass
@@ -56,8 +165,8 @@ class QuizQuestion:
     @classmethod
     async def get_all_quiz_questions(cls) -> List[QuizQuestion]:
         """Get Convert the given worksheet """
-        work_sheet = await get_worksheet(QUIZ_SHEET_ID, QUIZ_WORKSHEET)
-        rows = await work_sheet.get_all_values()
+        async with opened_worksheet(QUIZ_SHEET_ID, QUIZ_WORKSHEET) as work_sheet:
+            rows = await work_sheet.get_all_values()
         questions = [
             QuizQuestion(
                 row=i + 1,
@@ -157,64 +266,382 @@ class QuizQuestion:
         """Returns a an dictionary, representing the answerers ID mapped to the sum of
         correct answers, ordered from the highest to lowest sum.
         """
-        questions = await cls.get_all_quiz_questions()
-        sum_dict: DefaultDict[int, int] = defaultdict(int)
-        for question in questions:
-            if question.answerer_id:
-                sum_dict[question.answerer_id] += 1
-        return dict(sorted(sum_dict.items(), reverse=True, key=lambda x: x[1]))
+        state = await get_quiz_state()
+        return {_id: state.scores[_id] for _id in state.leaderboard}
 
     @classmethod
     async def top_scorer_and_score(cls) -> Optional[Tuple[int, int]]:
         """Returns the top scorer (0) and their score (1), with score being the sum of
         correctly answered questions.
         """
-        scores = await cls.scores()
-        if scores:
-            return next(iter(scores.items()))
+        state = await get_quiz_state()
+        if state.leaderboard:
+            leader = state.leaderboard[0]
+            return leader, state.scores[leader]
         return None
 
     @classmethod
     async def get_current_question(cls) -> Optional[QuizQuestion]:
         """Get lowest unanswered quiz question object."""
-        questions = await cls.get_all_quiz_questions()
-        for question in questions:
-            if not question.answerer_id:
-                return question
-        return None
+        state = await get_quiz_state()
+        return state.current_question
 
     async def write_question_to_sheet(self):
         """Writes the current QuizQuestion to the work sheet."""
-        work_sheet = await get_worksheet(QUIZ_SHEET_ID, QUIZ_WORKSHEET)
-        await work_sheet.update_cells(self.cell)
+        async with opened_worksheet(QUIZ_SHEET_ID, QUIZ_WORKSHEET) as work_sheet:
+            await work_sheet.update_cells(self.cell)
 
-    async def mark_as_answered(self, answerer_id: int):
+    async def mark_as_answered(self, answerer_id: int) -> bool:
         """Set the answerer to mark the question as answered and save this state to the
-        work sheet.
+        work sheet, but only if it is still the current question and nobody has answered
+        it yet. Returns whether the answer was accepted.
+
+        Answers are accepted or rejected immediately from memory, after which only the
+        answerer cell is written. Writes and quiz reloads happen one at a time.
         """
+        state = await get_quiz_state()
+        if not state.record_answer(self.row, answerer_id):
+            return False
+        _PENDING_ANSWERS[self.row] = answerer_id
+        try:
+            async with QUIZ_WRITE_LOCK:
+                async with opened_worksheet(QUIZ_SHEET_ID, QUIZ_WORKSHEET) as work_sheet:
+                    await work_sheet.update_cell(
+                        self.row, QUIZ_ANSWERER_COLUMN, str(answerer_id)
+                    )
+        except Exception:
+            if QUIZ_STATE is not None:
+                QUIZ_STATE.revoke_answer(self.row, answerer_id)
+            raise
+        finally:
+            del _PENDING_ANSWERS[self.row]
         self.answerer_id = answerer_id
-        await self.write_question_to_sheet()
+        return True
+
+
+@dataclass
+class QuizState:
+    """The in memory state of the quiz, kept in sync with the quiz work sheet. Holds a
+    pointer to the current question, and a leaderboard that is kept ordered as answers
+    come in.
+    """
+
+    questions: List[QuizQuestion]
+    current: int = 0
+    scores: DefaultDict[int, int] = field(default_factory=lambda: defaultdict(int))
+    # Answerer IDs, ordered from the highest to the lowest score
+    leaderboard: List[int] = field(default_factory=list)
+    _leaderboard_positions: Dict[int, int] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for question in self.questions:
+            if question.answerer_id:
+                self._increment_score(question.answerer_id)
+        self._advance()
+
+    @property
+    def current_question(self) -> Optional[QuizQuestion]:
+        if self.current < len(self.questions):
+            return self.questions[self.current]
+        return None
+
+    def question_by_row(self, row: int) -> Optional[QuizQuestion]:
+        index = row - 2  # Rows are 1 indexed, and the first row is the header row.
+        if 0 <= index < len(self.questions):
+            return self.questions[index]
+        return None
+
+    def record_answer(self, row: int, answerer_id: int) -> bool:
+        """Record the answerer of the question in the given row, if it is the current
+        question, and update the leaderboard and current question accordingly. Returns
+        whether the answer was recorded.
+        """
+        question = self.question_by_row(row)
+        if question is None or question is not self.current_question:
+            return False
+        question.answerer_id = answerer_id
+        self._increment_score(answerer_id)
+        self._advance()
+        return True
+
+    def revoke_answer(self, row: int, answerer_id: int) -> None:
+        """Undo a recorded answer, such as when it could not be saved"""
+        question = self.question_by_row(row)
+        if question is None or question.answerer_id != answerer_id:
+            return
+        question.answerer_id = None
+        self._decrement_score(answerer_id)
+        self.current = min(self.current, row - 2)
+
+    def _advance(self) -> None:
+        """Move the current question pointer to the lowest unanswered question"""
+        while (
+            self.current < len(self.questions)
+            and self.questions[self.current].answerer_id
+        ):
+            self.current += 1
+
+    def _increment_score(self, answerer_id: int) -> None:
+        """Increment the answerer's score, and move them up the leaderboard past those
+        with a lower score.
+        """
+        self.scores[answerer_id] += 1
+        position = self._leaderboard_positions.get(answerer_id)
+        if position is None:
+            position = len(self.leaderboard)
+            self.leaderboard.append(answerer_id)
+        score = self.scores[answerer_id]
+        while position > 0 and self.scores[self.leaderboard[position - 1]] < score:
+            above = self.leaderboard[position - 1]
+            self.leaderboard[position] = above
+            self._leaderboard_positions[above] = position
+            position -= 1
+        self.leaderboard[position] = answerer_id
+        self._leaderboard_positions[answerer_id] = position
+
+    def _decrement_score(self, answerer_id: int) -> None:
+        """Decrement the answerer's score, and move them down the leaderboard past those
+        with a higher score, or off it entirely when they have no score left.
+        """
+        self.scores[answerer_id] -= 1
+        score = self.scores[answerer_id]
+        position = self._leaderboard_positions[answerer_id]
+        last = len(self.leaderboard) - 1
+        while position < last and (
+            score <= 0 or self.scores[self.leaderboard[position + 1]] > score
+        ):
+            below = self.leaderboard[position + 1]
+            self.leaderboard[position] = below
+            self._leaderboard_positions[below] = position
+            position += 1
+        self.leaderboard[position] = answerer_id
+        self._leaderboard_positions[answerer_id] = position
+        if score <= 0:
+            self.leaderboard.pop()
+            del self._leaderboard_positions[answerer_id]
+            del self.scores[answerer_id]
+
+
+QUIZ_STATE: Optional[QuizState] = None
+QUIZ_WRITE_LOCK = asyncio.Lock()
+# Answers that have been accepted, but not yet written to the work sheet, by row.
+_PENDING_ANSWERS: Dict[int, int] = {}
+
+
+async def reload_quiz_state() -> QuizState:
+    """(Re)load the in memory quiz state from the quiz work sheet, keeping the answers
+    that are still being written to it.
+    """
+    global QUIZ_STATE
+    async with QUIZ_WRITE_LOCK:
+        state = QuizState(await QuizQuestion.get_all_quiz_questions())
+        for row, answerer_id in sorted(_PENDING_ANSWERS.items()):
+            state.record_answer(row, answerer_id)
+        QUIZ_STATE = state
+    return QUIZ_STATE
+
+
+async def get_quiz_state() -> QuizState:
+    """Get the in memory quiz state, loading it from the work sheet if needed"""
+    if QUIZ_STATE is None:
+        return await reload_quiz_state()
+    return QUIZ_STATE
+
+
+@dataclass
+class Registration:
+    """A row in the registration work sheet, tying a ticket to a Discord member"""
+
+    barcode: str
+    full_name: str
+    discord_name: str
+    discord_id: Optional[int]
+    date: str
+
+    @classmethod
+    def from_row(cls, row: List[str]) -> Registration:
+        """Create a registration from a row of the work sheet"""
+        row = row + [""] * (REG_MAX_COLUMN_NUMBER - len(row))
+        return cls(
+            barcode=row[REG_BARCODE_COLUMN - 1],
+            full_name=row[REG_FULL_NAME_COLUMN - 1],
+            discord_name=row[REG_DISCORD_NAME_COLUMN - 1],
+            discord_id=int_or_none(row[REG_DISCORD_ID_COLUMN - 1]),
+            date=row[REG_DATE_COLUMN - 1],
+        )
+
+    @property
+    def row(self) -> List[str]:
+        """Convert the registration to a row of the work sheet"""
+        row = [""] * REG_MAX_COLUMN_NUMBER
+        row[REG_BARCODE_COLUMN - 1] = self.barcode
+        row[REG_FULL_NAME_COLUMN - 1] = self.full_name
+        row[REG_DISCORD_NAME_COLUMN - 1] = self.discord_name
+        row[REG_DISCORD_ID_COLUMN - 1] = (
+            str(self.discord_id) if self.discord_id is not None else ""
+        )
+        row[REG_DATE_COLUMN - 1] = self.date
+        return row
+
+
+# Barcode to registration index of the registration work sheet. It is None until it has
+# been loaded from the sheet for the first time.
+REGISTRATION_LEDGER: Optional[Dict[str, Registration]] = None
+# Registrations that are pending or made while the ledger is being reloaded, which the
+# reloaded sheet rows might not contain yet.
+_REGISTERED_DURING_RELOAD: Optional[Dict[str, Registration]] = None
+# Registrations waiting to be appended to the work sheet, oldest first.
+PENDING_REGISTRATIONS: List[Registration] = []
+_FLUSH_LOCK = asyncio.Lock()
+# The flush started by registering, once enough rows are waiting
+_FLUSH_TASK: Optional[asyncio.Future] = None
+
+
+@dataclass
+class WriteBehindStats:
+    """Statistics of the registration rows write-behind queue"""
+
+    flushes: int = 0
+    rows_flushed: int = 0
+    failures: int = 0
+    last_flush_seconds: float = 0.0
+    max_flush_seconds: float = 0.0
+    backoff_seconds: float = 0.0
+    retry_at: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "Queue depth": len(PENDING_REGISTRATIONS),
+            "Flushes": self.flushes,
+            "Rows flushed": self.rows_flushed,
+            "Failed flushes": self.failures,
+            "Last flush latency (s)": self.last_flush_seconds,
+            "Max flush latency (s)": self.max_flush_seconds,
+            "Current backoff (s)": self.backoff_seconds,
+        }
+
+
+WRITE_BEHIND_STATS = WriteBehindStats()
+register_stats("Registration write-behind", WRITE_BEHIND_STATS.as_dict)
+
+
+async def load_registration_ledger() -> Tuple[Set[str], Set[str]]:
+    """(Re)load the in memory registration ledger from the work sheet, and reconcile it
+    with what is known locally. Returns the barcodes that were found in the sheet but
+    not locally (0), and that were known locally but are no longer in the sheet (1).
+    """
+    global REGISTRATION_LEDGER, _REGISTERED_DURING_RELOAD
+
+    _REGISTERED_DURING_RELOAD = {r.barcode: r for r in PENDING_REGISTRATIONS}
+    try:
+        async with opened_worksheet(SHEET_ID, WORKSHEET) as work_sheet:
+            rows = await work_sheet.get_all_values()
+        ledger = {}
+        for row in rows[1:]:  # The first row is the header row, so skip it.
+            registration = Registration.from_row(row)
+            if registration.barcode:
+                ledger[registration.barcode] = registration
+        ledger.update(_REGISTERED_DURING_RELOAD)
+    finally:
+        _REGISTERED_DURING_RELOAD = None
+
+    previous = REGISTRATION_LEDGER or {}
+    appeared = set(ledger).difference(previous)
+    disappeared = set(previous).difference(ledger)
+    REGISTRATION_LEDGER = ledger
+    return appeared, disappeared
+
+
+def add_to_registration_ledger(registration: Registration) -> None:
+    """Record the registration in the in memory ledger"""
+    if REGISTRATION_LEDGER is not None:
+        REGISTRATION_LEDGER[registration.barcode] = registration
+    if _REGISTERED_DURING_RELOAD is not None:
+        _REGISTERED_DURING_RELOAD[registration.barcode] = registration
+
+
+async def flush_registrations(force: bool = False) -> int:
+    """Append all pending registrations to the work sheet in a single request, and
+    return the number of rows written. After a failure, flushing is skipped until the
+    backoff has passed, unless forced.
+    """
+    async with _FLUSH_LOCK:
+        stats = WRITE_BEHIND_STATS
+        if not PENDING_REGISTRATIONS or (not force and time.monotonic() < stats.retry_at):
+            return 0
+
+        batch = PENDING_REGISTRATIONS[:]
+        start = time.monotonic()
+        try:
+            async with opened_worksheet(SHEET_ID, WORKSHEET) as work_sheet:
+                await work_sheet.append_rows([r.row for r in batch])
+        except Exception as e:
+            stats.failures += 1
+            stats.backoff_seconds = min(
+                max(stats.backoff_seconds * 2, REG_FLUSH_MIN_BACKOFF_SECONDS),
+                REG_FLUSH_MAX_BACKOFF_SECONDS,
+            )
+            stats.retry_at = time.monotonic() + stats.backoff_seconds * random.uniform(
+                0.5, 1.5
+            )
+            await log(
+                f"Failed to write {len(batch)} registration row(s) to the sheet, "
+                f"retrying in about {stats.backoff_seconds} seconds: {e}"
+            )
+            return 0
+
+        del PENDING_REGISTRATIONS[: len(batch)]
+        elapsed = time.monotonic() - start
+        stats.flushes += 1
+        stats.rows_flushed += len(batch)
+        stats.last_flush_seconds = elapsed
+        stats.max_flush_seconds = max(stats.max_flush_seconds, elapsed)
+        stats.backoff_seconds = 0.0
+        stats.retry_at = 0.0
+        return len(batch)
+
+
+async def flush_all_registrations() -> None:
+    """Flush the pending registrations regardless of any backoff, for use on shut down"""
+    global _FLUSH_TASK
+    if _FLUSH_TASK is not None:
+        # Let it finish, rather than cancel it in the middle of appending the rows
+        await asyncio.gather(_FLUSH_TASK, return_exceptions=True)
+        _FLUSH_TASK = None
+    await flush_registrations(force=True)
 
 
 async def is_ticket_used(ticket: Ticket) -> bool:
-    """Check if the given ticket exists (was registered) in the sheet"""
-    work_sheet = await get_worksheet(SHEET_ID, WORKSHEET)
-    # r = await work_sheet.find(ticket.barcode)
-    cells = await work_sheet.findall(ticket.barcode)
+    """Check if the given ticket exists (was registered) in the sheet. Uses the in memory
+    ledger, unless it has not been loaded yet, in which case the sheet is searched.
+    """
+    if REGISTRATION_LEDGER is not None:
+        return ticket.barcode in REGISTRATION_LEDGER
+    if ticket.barcode in {r.barcode for r in PENDING_REGISTRATIONS}:
+        return True
+    async with opened_worksheet(SHEET_ID, WORKSHEET) as work_sheet:
+        cells = await work_sheet.findall(ticket.barcode)
     return bool(cells and [c for c in cells if c.col == REG_BARCODE_COLUMN])
 
 
 async def register_ticket(ticket: Ticket, member: User) -> bool:
-    """Registers the user to the ticket by appending a row with the relevant information
-    to the work sheet
+    """Registers the user to the ticket by queueing a row with the relevant information
+    to be appended to the work sheet. The queue is flushed regularly, or immediately once
+    enough rows are waiting.
     """
-    work_sheet = await get_worksheet(SHEET_ID, WORKSHEET)
-    row = ["", "", "", "", ""]
-    row[REG_BARCODE_COLUMN - 1] = ticket.barcode
-    row[REG_FULL_NAME_COLUMN - 1] = ticket.full_name
-    row[REG_DISCORD_NAME_COLUMN - 1] = member.name
-    row[REG_DISCORD_ID_COLUMN - 1] = str(member.id)
-    row[REG_DATE_COLUMN - 1] = str(datetime.now())
-    await work_sheet.append_row(row)
-    await log(f"Registering row to sheet: {row}")
+    global _FLUSH_TASK
+    registration = Registration(
+        barcode=ticket.barcode,
+        full_name=ticket.full_name,
+        discord_name=member.name,
+        discord_id=member.id,
+        date=str(datetime.now()),
+    )
+    PENDING_REGISTRATIONS.append(registration)
+    add_to_registration_ledger(registration)
+    if len(PENDING_REGISTRATIONS) >= REG_FLUSH_MAX_ROWS and (
+        _FLUSH_TASK is None or _FLUSH_TASK.done()
+    ):
+        _FLUSH_TASK = asyncio.ensure_future(flush_registrations())
+    await log(f"Registering row to sheet: {registration.row}")
     return True
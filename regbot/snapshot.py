@@ -0,0 +1,151 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import arrow
+from discord import Client
+
+import regbot.quicket as quicket
+import regbot.wafer as wafer
+import regbot.youtube as youtube
+from regbot.attendees import update_attendees
+from regbot.settings import SNAPSHOT_FILE
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_MAX_AGE_MINUTES = 60
+
+# Broadcast channels by channel ID, waiting for the bot to connect to be resolved into
+# channels.
+_UNRESOLVED_BROADCAST_CHANNELS: Dict[int, dict] = {}
+_UNRESOLVED_ANNOUNCED_BROADCASTS: set = set()
+_SNAPSHOT_LOCK = asyncio.Lock()
+
+
+def _serialize_broadcast(broadcast: dict) -> dict:
+    return {**broadcast, "start_time": broadcast["start_time"].isoformat()}
+
+
+def _deserialize_broadcast(broadcast: dict) -> dict:
+    return {**broadcast, "start_time": arrow.get(broadcast["start_time"])}
+
+
+def _write_snapshot(snapshot: Dict[str, Any]) -> None:
+    """Atomically write the snapshot to disk, by writing it to a temporary file that
+    replaces the snapshot file only once complete. Only the bot's user can read it.
+    """
+    temporary_file = f"{SNAPSHOT_FILE}.tmp"
+    fd = os.open(temporary_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(temporary_file, 0o600)  # In case it was left behind with other permissions
+    with open(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as handle:
+        json.dump(snapshot, handle, separators=(",", ":"))
+    os.replace(temporary_file, SNAPSHOT_FILE)
+
+
+async def save_snapshot() -> None:
+    """Save a snapshot of all the sync caches to disk, so that they can be warm started
+    after a restart. The caches are copied on the event
+    loop, but encoded and written in a worker thread.
+    """
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "written_at": time.time(),
+        "tickets": [
+            [t.barcode, t.valid, t.first_name, t.surname, t.type]
+            for t in quicket.TICKETS.values()
+        ],
+        "tickets_etag": quicket.TICKETS_ETAG,
+        "speakers_tickets": list(wafer.SPEAKERS_TICKETS),
+        "calendar_ics": wafer.CALENDAR_ICS,
+        "announced_events": [list(key) for key in wafer.ANNOUNCED_EVENTS],
+        "broadcast_channels": {
+            **{
+                str(channel.id): _serialize_broadcast(broadcast)
+                for channel, broadcast in youtube.BROADCAST_CHANNELS.items()
+            },
+            **{
+                str(_id): _serialize_broadcast(broadcast)
+                for _id, broadcast in _UNRESOLVED_BROADCAST_CHANNELS.items()
+            },
+        },
+        "announced_broadcasts": [c.id for c in youtube.ANNOUNCED_BROADCASTS]
+        + list(_UNRESOLVED_ANNOUNCED_BROADCASTS),
+    }
+    async with _SNAPSHOT_LOCK:
+        await asyncio.get_event_loop().run_in_executor(None, _write_snapshot, snapshot)
+
+
+def load_snapshot() -> Optional[bool]:
+    """Load the sync caches from the snapshot on disk, if there is one. Announcement
+    state is always loaded, but the caches are only loaded if the snapshot is fresh,
+    otherwise they are left for the sync loops to refresh. Returns whether the snapshot
+    was fresh, or None if no usable snapshot was found.
+    """
+    try:
+        with gzip.open(SNAPSHOT_FILE, "rt", encoding="utf-8") as handle:
+            snapshot = json.load(handle)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable snapshot {SNAPSHOT_FILE}: {e}")
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        logging.warning(f"Ignoring snapshot {SNAPSHOT_FILE} of an unknown version.")
+        return None
+
+    wafer.ANNOUNCED_EVENTS.update(
+        (name, begin) for name, begin in snapshot["announced_events"]
+    )
+    _UNRESOLVED_ANNOUNCED_BROADCASTS.update(snapshot["announced_broadcasts"])
+
+    age_minutes = (time.time() - snapshot["written_at"]) / 60
+    if age_minutes > SNAPSHOT_MAX_AGE_MINUTES:
+        logging.info(
+            f"Snapshot is stale ({age_minutes:.0f} minutes old), so only the "
+            "announcement state was loaded."
+        )
+        return False
+
+    quicket.TICKETS = {
+        barcode: quicket.Ticket(
+            barcode=barcode,
+            valid=valid,
+            first_name=first_name,
+            surname=surname,
+            type=type_,
+        )
+        for barcode, valid, first_name, surname, type_ in snapshot["tickets"]
+    }
+    quicket.TICKETS_ETAG = snapshot["tickets_etag"]
+    wafer.SPEAKERS_TICKETS = set(snapshot["speakers_tickets"])
+    update_attendees()
+    if snapshot["calendar_ics"] is not None:
+        wafer.load_calendar(snapshot["calendar_ics"])
+    _UNRESOLVED_BROADCAST_CHANNELS.update(
+        {
+            int(_id): _deserialize_broadcast(broadcast)
+            for _id, broadcast in snapshot["broadcast_channels"].items()
+        }
+    )
+    logging.info(f"Loaded a snapshot that is {age_minutes:.0f} minutes old.")
+    return True
+
+
+def resolve_snapshot_channels(client: Client) -> None:
+    """Resolve the channel IDs of the loaded snapshot into channels, once connected"""
+    channel_broadcast_map = dict(youtube.BROADCAST_CHANNELS)
+    for _id, broadcast in list(_UNRESOLVED_BROADCAST_CHANNELS.items()):
+        channel = client.get_channel(_id)
+        if channel is not None:
+            channel_broadcast_map.setdefault(channel, broadcast)
+        del _UNRESOLVED_BROADCAST_CHANNELS[_id]
+    youtube.save_channel_broadcast_map(channel_broadcast_map)
+
+    for _id in list(_UNRESOLVED_ANNOUNCED_BROADCASTS):
+        channel = client.get_channel(_id)
+        if channel is not None:
+            youtube.mark_broadcast_as_announced(channel)
+        _UNRESOLVED_ANNOUNCED_BROADCASTS.discard(_id)
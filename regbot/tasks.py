@@ -1,24 +1,49 @@
-from typing import List
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
 
 from discord.channel import TextChannel
 from discord.ext import commands, tasks
-from discord.utils import get
 
+from regbot import RegBot
+from regbot.attendees import update_attendees
 from regbot.helpers import (
     ServerInfo,
+    find_channel,
     get_int_env,
     log,
+    register_stats,
     safe_send_message,
     to_discord_title_safe,
 )
+from regbot.outbound import Priority, pin, send
 from regbot.quicket import update_ticket_cache
+from regbot.reconcile import apply_reconcile, plan_reconcile
+from regbot.sheets import (
+    REG_FLUSH_INTERVAL_SECONDS,
+    flush_all_registrations,
+    flush_registrations,
+    load_registration_ledger,
+    refresh_worksheet_cache,
+    reload_quiz_state,
+)
+from regbot.snapshot import save_snapshot
 from regbot.wafer import (
+    ANNOUNCED_EVENTS,
+    EventKey,
     all_upcoming_events,
+    event_key,
+    find_event,
     mark_as_announced,
     update_calendar_cache,
     update_speakers_cache,
 )
 from regbot.youtube import (
+    ANNOUNCED_BROADCASTS,
     all_upcoming_broadcasts,
     get_all_broadcasts,
     get_broadcast_channels,
@@ -29,16 +54,157 @@ from regbot.youtube import (
 
 QUICKET_CACHE_EXPIRE_MINUTES = get_int_env("QUICKET_CACHE_EXPIRE_MINUTES")
 WAFER_CACHE_EXPIRE_MINUTES = get_int_env("WAFER_CACHE_EXPIRE_MINUTES")
-WAFER_ANNOUNCE_INTERVAL_SECONDS = 30
+REGISTRATION_LEDGER_SYNC_MINUTES = 5
+WORKSHEET_CACHE_REFRESH_MINUTES = 5
+QUIZ_STATE_REFRESH_MINUTES = 5
+ROLE_RECONCILE_MINUTES = 60
+ROLE_RECONCILE_DELAY_SECONDS = 60
+LOOP_LAG_INTERVAL_SECONDS = 1
+LOOP_LAG_PROBE_SECONDS = 0.1
+# How long to wait before restarting an announcement scheduler that failed
+SCHEDULER_RESTART_SECONDS = 60
 WAFER_UPCOMING_EVENTS_BOUNDARY_MINUTES = 5
 
 YOUTUBE_CREATE_CHANNELS_MINUTES = 10
-YOUTUBE_ANNOUNCE_INTERVAL_SECONDS = 10
-YOUTUBE_UPCOMING_BOUNDARY_SECONDS = 20
-assert YOUTUBE_ANNOUNCE_INTERVAL_SECONDS < YOUTUBE_UPCOMING_BOUNDARY_SECONDS, (
-    "The amount of time between checks (interval) must be sorter than how far into the "
-    "future (boundary) broadcasts are announced!"
-)
+YOUTUBE_UPCOMING_BOUNDARY_SECONDS = 10
+
+
+class AnnouncementScheduler:
+    """Fires a callback for each scheduled item at its fire time (a UNIX timestamp).
+    Items are kept in a min-heap, and the scheduler sleeps until the next one is due, or
+    until the schedule changes. Items are fired one at a time, and an item that is being
+    fired can't be scheduled again in the meantime.
+    """
+
+    def __init__(self, name: str, fire: Callable[[Any], Awaitable[None]]):
+        self.name = name
+        self.fire = fire
+        self.heap: List[Tuple[float, int, Hashable]] = []
+        self.fire_times: Dict[Hashable, float] = {}
+        self.firing: Set[Hashable] = set()
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+        self.fired = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        register_stats(f"{name} scheduler", self.stats)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "Scheduled": len(self.fire_times),
+            "Fired": self.fired,
+            "Last lateness (s)": self.last_lateness,
+            "Max lateness (s)": self.max_lateness,
+            "Mean lateness (s)": self.total_lateness / self.fired if self.fired else 0.0,
+        }
+
+    def schedule(self, key: Hashable, fire_at: float) -> None:
+        """Schedule the item, replacing its previous fire time if it had one"""
+        if key in self.firing or self.fire_times.get(key) == fire_at:
+            return
+        self.fire_times[key] = fire_at
+        heapq.heappush(self.heap, (fire_at, next(self.counter), key))
+        self.changed.set()
+
+    def cancel(self, key: Hashable) -> None:
+        """Unschedule the item. Its heap entry is discarded once it reaches the top."""
+        if self.fire_times.pop(key, None) is not None:
+            self.changed.set()
+
+    def sync(self, fire_times: Dict[Hashable, float]) -> None:
+        """Make the schedule match the given fire times by item, only touching the items
+        that changed.
+        """
+        for key in set(self.fire_times).difference(fire_times):
+            self.cancel(key)
+        for key, fire_at in fire_times.items():
+            self.schedule(key, fire_at)
+
+    def _next(self) -> Optional[Tuple[float, Hashable]]:
+        """The next item that is due, discarding cancelled or rescheduled heap entries"""
+        while self.heap:
+            fire_at, _, key = self.heap[0]
+            if self.fire_times.get(key) == fire_at:
+                return fire_at, key
+            heapq.heappop(self.heap)
+        return None
+
+    async def run(self) -> None:
+        """Fire the scheduled items as they become due, forever"""
+        while True:
+            self.changed.clear()
+            upcoming = self._next()
+            delay = None if upcoming is None else upcoming[0] - time.time()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            assert upcoming is not None
+            fire_at, key = upcoming
+            heapq.heappop(self.heap)
+            del self.fire_times[key]
+            lateness = time.time() - fire_at
+            self.fired += 1
+            self.last_lateness = lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            self.total_lateness += lateness
+            logging.info(f"{self.name} scheduler fired {key} {lateness:.3f}s late.")
+            self.firing.add(key)
+            try:
+                await self.fire(key)
+            except Exception:
+                logging.exception(f"{self.name} scheduler failed to fire {key}!")
+            finally:
+                self.firing.discard(key)
+
+    async def run_forever(self, reschedule: Callable[[], Awaitable[None]]) -> None:
+        """Schedule the items with the given coroutine function, and fire them, forever.
+        Restarts after a while if that fails.
+        """
+        while True:
+            try:
+                await reschedule()
+                await self.run()
+            except Exception:
+                logging.exception(f"{self.name} scheduler failed, restarting it soon!")
+                await asyncio.sleep(SCHEDULER_RESTART_SECONDS)
+
+
+class LoopLagMonitor(commands.Cog):
+    """For measuring how late the event loop wakes up sleeping coroutines, which shows
+    whether something is blocking it.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.probes = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        register_stats("Event loop lag", self.stats)
+        self.measure.start()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "Probes": self.probes,
+            "Last lag (s)": self.last_lag,
+            "Max lag (s)": self.max_lag,
+            "Mean lag (s)": self.total_lag / self.probes if self.probes else 0.0,
+        }
+
+    @tasks.loop(seconds=LOOP_LAG_INTERVAL_SECONDS)
+    async def measure(self):
+        start = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_PROBE_SECONDS)
+        lag = time.monotonic() - start - LOOP_LAG_PROBE_SECONDS
+        self.probes += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
 
 
 class QuicketSync(commands.Cog):
@@ -51,14 +217,126 @@ class QuicketSync(commands.Cog):
     @tasks.loop(minutes=QUICKET_CACHE_EXPIRE_MINUTES)
     async def sync(self):
         await log("Refreshing Quicket cache...")
-        await update_ticket_cache()
-        await log("Quicket cache refreshed.")
+        diff = await update_ticket_cache()
+        if diff is None:
+            await log("Quicket cache refreshed, the guest list is unchanged.")
+        else:
+            await log(f"Quicket cache refreshed. {diff.summary()}")
+            update_attendees(diff.barcodes)
+            await save_snapshot()
 
     @sync.before_loop
     async def before_sync(self):
         await self.bot.wait_until_ready()
 
 
+class RegistrationLedgerSync(commands.Cog):
+    """For loading the registration ledger on start, keeping it reconciled with the
+    registration work sheet, and writing queued registrations to the work sheet.
+    """
+
+    def __init__(self, bot: RegBot):
+        self.bot = bot
+        self.sync.start()
+        self.flush.start()
+        bot.add_shutdown_hook(flush_all_registrations)
+
+    @tasks.loop(minutes=REGISTRATION_LEDGER_SYNC_MINUTES)
+    async def sync(self):
+        try:
+            appeared, disappeared = await load_registration_ledger()
+        except Exception:
+            # tasks.loop would stop for good on errors such as Sheets API errors
+            return logging.exception("Failed to reload the registration ledger!")
+        if appeared and self.sync.current_loop:
+            await log(
+                f"Registration ledger reconciled, {len(appeared)} registration(s) were "
+                "found in the sheet that were not made by me."
+            )
+        if disappeared:
+            await log(
+                f"Registration ledger reconciled, {len(disappeared)} registration(s) were "
+                f"removed from the sheet: {', '.join(sorted(disappeared))}"
+            )
+
+    @sync.before_loop
+    async def before_sync(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=REG_FLUSH_INTERVAL_SECONDS)
+    async def flush(self):
+        try:
+            await flush_registrations()
+        except Exception:
+            logging.exception("Failed to flush the queued registrations!")
+
+
+class RoleReconcile(commands.Cog):
+    """For regularly bringing the registration roles of all members in line with the
+    registration ledger, Quicket tickets and Wafer speakers.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.reconcile.start()
+
+    @tasks.loop(minutes=ROLE_RECONCILE_MINUTES)
+    async def reconcile(self):
+        server_info = await ServerInfo.get()
+        try:
+            plan = plan_reconcile(server_info.guild)
+        except AssertionError as e:
+            return await log(f"Skipped reconciling the roles: {e}")
+        if not plan.changes:
+            return
+        await log(f"Reconciling roles. {plan.summary(detailed=True)}")
+        failed = await apply_reconcile(plan, log)
+        await log(
+            f"Role reconciliation complete, {len(plan.changes) - failed} member(s) changed "
+            f"and {failed} failed."
+        )
+
+    @reconcile.before_loop
+    async def before_reconcile(self):
+        await self.bot.wait_until_ready()
+        # Give the caches and the ledger a chance to load first
+        await asyncio.sleep(ROLE_RECONCILE_DELAY_SECONDS)
+
+
+class WorksheetCacheRefresh(commands.Cog):
+    """For keeping the Google Sheets authorization and opened worksheets fresh, so that
+    commands don't have to wait for them.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.refresh.start()
+
+    @tasks.loop(minutes=WORKSHEET_CACHE_REFRESH_MINUTES)
+    async def refresh(self):
+        try:
+            await refresh_worksheet_cache()
+        except Exception:
+            logging.exception("Failed to refresh the worksheet cache!")
+
+
+class QuizSync(commands.Cog):
+    """For regularly reloading the in memory quiz state from the quiz work sheet, in
+    order to pick up changes made by organizers.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.sync.start()
+
+    @tasks.loop(minutes=QUIZ_STATE_REFRESH_MINUTES)
+    async def sync(self):
+        try:
+            await reload_quiz_state()
+        except Exception:
+            logging.exception("Failed to reload the quiz state!")
+
+
 class WaferSync(commands.Cog):
     """For regularly syncing Wafer data"""
 
@@ -66,13 +344,36 @@ class WaferSync(commands.Cog):
         self.bot = bot
         self.sync_speakers.start()
         self.sync_events.start()
-        self.announcement_loop.start()
+        self.scheduler = AnnouncementScheduler("Wafer events", self.announce)
+        self.scheduler_task = bot.loop.create_task(self.run_scheduler())
+
+    def cog_unload(self):
+        self.scheduler_task.cancel()
+
+    async def reschedule(self):
+        """Schedule the announcements of all upcoming events that have yet to be
+        announced.
+        """
+        events = await all_upcoming_events()
+        self.scheduler.sync(
+            {
+                event_key(event): event.begin.shift(
+                    minutes=-WAFER_UPCOMING_EVENTS_BOUNDARY_MINUTES
+                ).float_timestamp
+                for event in events
+            }
+        )
 
     @tasks.loop(minutes=WAFER_CACHE_EXPIRE_MINUTES)
     async def sync_speakers(self):
         await log("Refreshing Wafer speakers cache...")
-        await update_speakers_cache()
-        await log("Wafer speakers cache refreshed.")
+        added, removed = await update_speakers_cache()
+        update_attendees(added | removed)
+        await log(
+            f"Wafer speakers cache refreshed, {len(added)} speaker ticket(s) added and "
+            f"{len(removed)} removed."
+        )
+        await save_snapshot()
 
     @sync_speakers.before_loop
     async def before_sync_speakers(self):
@@ -81,34 +382,125 @@ class WaferSync(commands.Cog):
     @tasks.loop(minutes=WAFER_CACHE_EXPIRE_MINUTES)
     async def sync_events(self):
         await log("Refreshing Wafer events cache...")
-        await update_calendar_cache()
-        await log("Wafer events cache refreshed.")
+        diff = await update_calendar_cache()
+        if diff is None:
+            await log("Wafer events cache refreshed, the calendar is unchanged.")
+        else:
+            await log(f"Wafer events cache refreshed. {diff.summary()}")
+            await save_snapshot()
+            await self.reschedule()
 
     @sync_events.before_loop
     async def before_sync_events(self):
         await self.bot.wait_until_ready()
 
-    @tasks.loop(seconds=WAFER_ANNOUNCE_INTERVAL_SECONDS)
-    async def announcement_loop(self):
-        """Regular check for events to announce, then do so and cache to avoid repeating."""
+    async def run_scheduler(self):
+        await self.bot.wait_until_ready()
+        await self.scheduler.run_forever(self.reschedule)
+
+    async def announce(self, key: EventKey):
+        """Announce the event, then cache it to avoid repeating."""
+        event = find_event(key)
+        if event is None or key in ANNOUNCED_EVENTS:
+            return
         server_info = await ServerInfo.get()
-        events = await all_upcoming_events(minutes=WAFER_UPCOMING_EVENTS_BOUNDARY_MINUTES)
-        for event in events:
-            channel_title = to_discord_title_safe(event.name)
-            channel = get(server_info.guild.channels, name=channel_title)
-            channel_mention = (
-                "it's discord channel" if channel is None else channel.mention
-            )
-            await server_info.announcement_channel.send(
-                f"The event **{event.name}** is happening in "
-                f"{WAFER_UPCOMING_EVENTS_BOUNDARY_MINUTES} minutes!\n"
-                f"Please go to {channel_mention} to watch it."
-            )
-            await mark_as_announced(event)
+        channel_title = to_discord_title_safe(event.name)
+        channel = find_channel(channel_title)
+        channel_mention = "it's discord channel" if channel is None else channel.mention
+        await send(
+            server_info.announcement_channel,
+            f"The event **{event.name}** is happening in "
+            f"{WAFER_UPCOMING_EVENTS_BOUNDARY_MINUTES} minutes!\n"
+            f"Please go to {channel_mention} to watch it.",
+            Priority.ANNOUNCEMENT,
+        )
+        await mark_as_announced(event)
+        await save_snapshot()
 
-    @announcement_loop.before_loop
-    async def before_announcement_loop(self):
-        await self.bot.wait_until_ready()
+
+@dataclass
+class ChannelPlan:
+    """The changes needed to make the talk channels mirror the broadcasts"""
+
+    # Broadcasts by channel name, in the order their channels should be in
+    broadcasts: Dict[str, dict] = field(default_factory=dict)
+    existing: Dict[str, TextChannel] = field(default_factory=dict)
+    create: List[dict] = field(default_factory=list)
+    topics: Dict[TextChannel, str] = field(default_factory=dict)
+    duplicates: List[TextChannel] = field(default_factory=list)
+    stale: List[TextChannel] = field(default_factory=list)
+
+    def position_changes(self, channels: Dict[str, TextChannel]) -> List[Dict[str, int]]:
+        """The bulk channel position update that puts the given channels, by name, in
+        the planned order. The channels are shuffled between the positions they already
+        take up, and only the ones that have to move are included.
+        """
+        ordered = [channels[name] for name in self.broadcasts if name in channels]
+        current = sorted(ordered, key=lambda c: (c.position, c.id))
+        if ordered == current:
+            return []
+        slots = [c.position for c in current]
+        if len(set(slots)) < len(slots):
+            slots = list(range(slots[0], slots[0] + len(slots)))
+        return [
+            {"id": channel.id, "position": position}
+            for channel, position in zip(ordered, slots)
+            if channel.position != position
+        ]
+
+    def summary(self, detailed: bool = False) -> str:
+        """A human readable summary of the plan, listing every change if detailed."""
+        moves = len(self.position_changes(self.existing))
+        summary = (
+            f"{len(self.create)} channel(s) to create, {len(self.topics)} to update, "
+            f"{len(self.duplicates) + len(self.stale)} to delete and {moves} existing "
+            "one(s) to move."
+        )
+        if not detailed:
+            return summary
+        lines = [summary]
+        lines.extend(f"Create `{b['title']}`" for b in self.create)
+        lines.extend(f"Update the topic of `{c.name}`" for c in self.topics)
+        lines.extend(f"Delete duplicate `{c.name}`" for c in self.duplicates)
+        lines.extend(f"Delete `{c.name}` as it has no broadcast" for c in self.stale)
+        if moves or self.create:
+            lines.append("Order: " + ", ".join(f"`{name}`" for name in self.broadcasts))
+        return "\n".join(lines)
+
+
+def plan_talk_channels(
+    broadcasts: List[dict], channels: List[TextChannel]
+) -> ChannelPlan:
+    """Compare the given broadcasts with the existing talk channels, and plan what has to
+    change. Channels of talks over an hour old are ordered after the rest.
+    """
+    plan = ChannelPlan()
+    for channel in sorted(channels, key=lambda c: (c.position, c.id)):
+        if channel.name in plan.existing:
+            plan.duplicates.append(channel)
+        else:
+            plan.existing[channel.name] = channel
+
+    positions: Dict[str, Tuple[bool, int]] = {}
+    for i, broadcast in enumerate(broadcasts):
+        if broadcast["title"] not in positions:
+            positions[broadcast["title"]] = (broadcast["over_hour_old"], i)
+            plan.broadcasts[broadcast["title"]] = broadcast
+    plan.broadcasts = {
+        name: plan.broadcasts[name]
+        for name in sorted(positions, key=lambda name: positions[name])
+    }
+
+    for name, broadcast in plan.broadcasts.items():
+        channel = plan.existing.get(name)
+        if channel is None:
+            plan.create.append(broadcast)
+        elif (channel.topic or "").strip() != broadcast["description"].strip():
+            plan.topics[channel] = broadcast["description"]
+    plan.stale = [
+        channel for name, channel in plan.existing.items() if name not in plan.broadcasts
+    ]
+    return plan
 
 
 class YouTubeVideoSync(commands.Cog):
@@ -117,115 +509,129 @@ class YouTubeVideoSync(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.create_channels.start()
-        self.announcement_loop.start()
-
-    @staticmethod
-    async def purge_duplicate_titled_channels(
-        channels: List[TextChannel],
-    ) -> List[TextChannel]:
-        """Make sure that only one channel per channel name in the given list remains.
-        Not done in any particular order.
+        self.scheduler = AnnouncementScheduler("YouTube broadcasts", self.announce)
+        self.scheduler_task = bot.loop.create_task(self.run_scheduler())
+
+    def cog_unload(self):
+        self.scheduler_task.cancel()
+
+    async def reschedule(self):
+        """Schedule the announcements of all upcoming broadcasts that have yet to be
+        announced.
         """
-        names = set()
-        unique_channels = []
-        for channel in channels:
-            if channel.name in names:
-                reason = f"Deleting duplicate talk channel: `{channel}`"
-                await log(reason)
-                await channel.delete(reason=reason)
-            else:
-                names.add(channel.name)
-                unique_channels.append(channel)
-        return unique_channels
+        channels = await all_upcoming_broadcasts()
+        channel_map = get_broadcast_channels()
+        self.scheduler.sync(
+            {
+                channel: channel_map[channel]["start_time"]
+                .shift(seconds=-YOUTUBE_UPCOMING_BOUNDARY_SECONDS)
+                .float_timestamp
+                for channel in channels
+            }
+        )
+
+    async def plan_channels(self, sync: bool = True) -> ChannelPlan:
+        """Plan the changes needed to make the talk channels mirror the broadcasts. Only
+        the sync's own plans count towards its YouTube quota statistics.
+        """
+        broadcasts = await get_all_broadcasts(sync)
+        server_info = await ServerInfo.get()
+        return plan_talk_channels(broadcasts, server_info.youtube_category.text_channels)
 
     @tasks.loop(minutes=YOUTUBE_CREATE_CHANNELS_MINUTES)
     async def create_channels(self):
-        """Create discord channels that mirror YouTube channels if they don't yet exist."""
-        broadcasts = get_all_broadcasts()
-        await log("Found broadcasts, iterating through them...")
+        """Create discord channels that mirror YouTube channels if they don't yet exist,
+        and bring the existing ones up to date. Only what differs is changed.
+        """
+        plan = await self.plan_channels()
+        await log(f"Planned the talk channels: {plan.summary()}")
         server_info = await ServerInfo.get()
         category = server_info.youtube_category
-        existing_channels = await self.purge_duplicate_titled_channels(category.channels)
-        existing_channels = {channel.name: channel for channel in existing_channels}
-
-        current_names = set()
-        channel_broadcast_map = {}
-        for i, broadcast in enumerate(broadcasts):
-            if broadcast["title"] in current_names:
-                continue
-            position = 100 + i if broadcast["over_hour_old"] else i
-            if broadcast["title"] in existing_channels:
-                await log(
-                    f"Found existing channel for, so updating it `{broadcast['title']}`"
-                )
-                channel = existing_channels[broadcast["title"]]
-                await channel.edit(
-                    position=position,
-                    topic=broadcast["description"],
-                )
-            else:
-                await log(f"Creating channel for talk: `{broadcast['title']}`")
-                channel = await category.create_text_channel(
-                    name=broadcast["title"],
-                    reason="Talk YouTube channel",
-                    position=position,
-                    topic=broadcast["description"],
-                )
-                message = await channel.send(
-                    f"__**Talk title**__: {broadcast['original_title']}"
-                )
-                await message.pin(reason="Talk title")
-                message = await channel.send(
-                    f"__**Talk link**__: {get_youtube_link(broadcast['id'])}"
-                )
-                await message.pin(reason="Talk link")
-                messages = await safe_send_message(
-                    channel,
-                    f"__**Talk description**__:\n{broadcast['original_description']}",
-                )
-                for message in messages:
-                    await message.pin(reason="Talk description")
-
-            current_names.add(broadcast["title"])
-            channel_broadcast_map[channel] = broadcast
-        await log("Completed making broadcast channels.")
-        save_channel_broadcast_map(channel_broadcast_map)
+        channels = dict(plan.existing)
 
-        existing_names = set(existing_channels.keys())
-        to_delete = existing_names.difference(current_names)
-        for name in to_delete:
-            reason = f"Deleting {name} as there is no broadcast tied to it."
+        for channel in plan.duplicates:
+            reason = f"Deleting duplicate talk channel: `{channel}`"
             await log(reason)
-            await existing_channels[name].delete(reason=reason)
+            await channel.delete(reason=reason)
+        for channel in plan.stale:
+            reason = f"Deleting {channel.name} as there is no broadcast tied to it."
+            await log(reason)
+            await channel.delete(reason=reason)
+            del channels[channel.name]
+
+        for broadcast in plan.create:
+            await log(f"Creating channel for talk: `{broadcast['title']}`")
+            channel = await category.create_text_channel(
+                name=broadcast["title"],
+                reason="Talk YouTube channel",
+                topic=broadcast["description"],
+            )
+            message = await send(
+                channel,
+                f"__**Talk title**__: {broadcast['original_title']}",
+                Priority.HOUSEKEEPING,
+            )
+            await pin(message, reason="Talk title")
+            message = await send(
+                channel,
+                f"__**Talk link**__: {get_youtube_link(broadcast['id'])}",
+                Priority.HOUSEKEEPING,
+            )
+            await pin(message, reason="Talk link")
+            messages = await safe_send_message(
+                channel,
+                f"__**Talk description**__:\n{broadcast['original_description']}",
+                Priority.HOUSEKEEPING,
+            )
+            for message in messages:
+                await pin(message, reason="Talk description")
+            channels[broadcast["title"]] = channel
+
+        for channel, topic in plan.topics.items():
+            await log(f"Updating the topic of talk channel `{channel.name}`")
+            await channel.edit(topic=topic)
+
+        positions = plan.position_changes(channels)
+        if positions:
+            await log(f"Moving {len(positions)} talk channel(s) into order")
+            await self.bot.http.bulk_channel_update(
+                category.guild.id, positions, reason="Ordering talk channels"
+            )
+
+        await log("Completed making broadcast channels.")
+        save_channel_broadcast_map(
+            {channels[name]: broadcast for name, broadcast in plan.broadcasts.items()}
+        )
+        await save_snapshot()
+        await self.reschedule()
 
     @create_channels.before_loop
     async def before_create_channels(self):
         await self.bot.wait_until_ready()
 
-    @tasks.loop(seconds=YOUTUBE_ANNOUNCE_INTERVAL_SECONDS)
-    async def announcement_loop(self):
-        """Regular check for broadcasts to announce, then do so and cache to avoid
-        repeating.
-        """
+    async def run_scheduler(self):
+        await self.bot.wait_until_ready()
+        await self.scheduler.run_forever(self.reschedule)
+
+    async def announce(self, channel: TextChannel):
+        """Announce the broadcast in its channel, then cache it to avoid repeating."""
+        broadcast = get_broadcast_channels().get(channel)
+        if broadcast is None or channel in ANNOUNCED_BROADCASTS:
+            return
         server_info = await ServerInfo.get()
-        channels = await all_upcoming_broadcasts(
-            seconds=YOUTUBE_UPCOMING_BOUNDARY_SECONDS
+        await send(
+            channel,
+            f"{server_info.attendee.mention} This talk is starting now!\n"
+            f"**Talk Link**: {get_youtube_link(broadcast['id'])}",
+            Priority.ANNOUNCEMENT,
         )
-        channel_map = get_broadcast_channels()
-        for channel in channels:
-            broadcast = channel_map[channel]
-            await channel.send(
-                f"{server_info.attendee.mention} This talk is starting now!\n"
-                f"**Talk Link**: {get_youtube_link(broadcast['id'])}"
-            )
-            await channel.send(
-                "Remember that you can ask a question with the `!question` command like "
-                "so:\n`!question your question text here`."
-                "\n But remember to keep it short, as it must be no longer than 200 "
-                "characters after we add your name to the question."
-            )
-            mark_broadcast_as_announced(channel)
-
-    @announcement_loop.before_loop
-    async def before_announcement_loop(self):
-        await self.bot.wait_until_ready()
+        await send(
+            channel,
+            "Remember that you can ask a question with the `!question` command like "
+            "so:\n`!question your question text here`."
+            "\n But remember to keep it short, as it must be no longer than 200 "
+            "characters after we add your name to the question.",
+            Priority.ANNOUNCEMENT,
+        )
+        mark_broadcast_as_announced(channel)
+        await save_snapshot()
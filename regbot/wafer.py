@@ -1,11 +1,15 @@
-from asyncio import sleep
-from typing import Optional, Set
+import asyncio
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import DefaultDict, Dict, List, Optional, Set, Tuple
 from urllib.parse import urljoin
 
 import arrow
 import httpx
 from ics import Calendar, Event
 
+from regbot import http_client
 from regbot.helpers import get_str_env
 
 USERNAME = get_str_env("WAFER_USERNAME")
@@ -14,43 +18,84 @@ BASE_URL = get_str_env("WAFER_BASE_URL")
 TICKETS_URL = get_str_env("WAFER_TICKETS_ENDPOINT")
 TALKS_URL = get_str_env("WAFER_TALKS_ENDPOINT")
 ICS_ENDPOINT = get_str_env("WAFER_ICS_ENDPOINT")
+# PyConZA is prone to network errors if not rate limiting
+REQUESTS_PER_SECOND = float(os.getenv("WAFER_REQUESTS_PER_SECOND", "0.67"))
+RATE_LIMITER = http_client.TokenBucket(REQUESTS_PER_SECOND)
 
 
-SPEAKERS_TICKETS: Set[str] = set()
-EVENTS_CACHE: set = set()
-ANNOUNCED_EVENT_NAMES: Set[str] = set()
+# Events are keyed by their name and start, as names alone aren't unique, and the
+# calendar's UIDs aren't guaranteed to be stable.
+EventKey = Tuple[str, str]
 
+SPEAKERS_TICKETS: Set[str] = set()
+EVENTS_CACHE: Dict[EventKey, Event] = {}
+CALENDAR_ICS: Optional[str] = None
+CALENDAR_ETAG: Optional[str] = None
+CALENDAR_LAST_MODIFIED: Optional[str] = None
+ANNOUNCED_EVENTS: Set[EventKey] = set()
 
-async def update_speakers_cache() -> None:
-    """Update the speakers cache from Wafer"""
-    async with httpx.AsyncClient() as client:
-        speakers_uids: Set[int] = set()
 
-        next_url = urljoin(BASE_URL, TALKS_URL)
+async def _fetch_pages(url: str, kind: str, queue: asyncio.Queue) -> None:
+    """Fetch all the pages of the given paginated Wafer endpoint, rate limited, and put
+    each page's results on the queue. Ends with putting None as the results.
+    """
+    try:
+        next_url: Optional[str] = url
         while next_url is not None:
-            r = await client.get(next_url, auth=(USERNAME, PASSWORD))
+            r = await http_client.get(
+                next_url, rate_limiter=RATE_LIMITER, auth=(USERNAME, PASSWORD)
+            )
+            r.raise_for_status()
             d = r.json()
-            for result in d["results"]:
-                speakers_uids = speakers_uids.union(set(result["authors"]))
+            await queue.put((kind, d["results"]))
             next_url = d["next"]
-            if next_url is not None:
-                await sleep(
-                    1.5
-                )  # PyConZA is prone to network errors if not rate limiting
+    finally:
+        await queue.put((kind, None))
 
-        await sleep(1.5)  # PyConZA is prone to network errors if not rate limiting
-        next_url = urljoin(BASE_URL, TICKETS_URL)
-        while next_url is not None:
-            r = await client.get(next_url, auth=(USERNAME, PASSWORD))
-            d = r.json()
-            for result in d["results"]:
-                if result["user"] in speakers_uids:
-                    SPEAKERS_TICKETS.add(str(result["barcode"]))
-            next_url = d["next"]
-            if next_url is not None:
-                await sleep(
-                    1.5
-                )  # PyConZA is prone to network errors if not rate limiting
+
+async def update_speakers_cache() -> Tuple[Set[str], Set[str]]:
+    """Update the speakers cache from Wafer. Talks and tickets are fetched at the same
+    time, and joined as their pages come in. The new set of speaker ticket barcodes is
+    swapped in once complete. Returns the barcodes that were added (0) and removed (1).
+    """
+    global SPEAKERS_TICKETS
+
+    queue: asyncio.Queue = asyncio.Queue()
+    producers = [
+        asyncio.ensure_future(_fetch_pages(urljoin(BASE_URL, url), kind, queue))
+        for kind, url in (("talks", TALKS_URL), ("tickets", TICKETS_URL))
+    ]
+    speakers_uids: Set[int] = set()
+    barcodes_by_uid: DefaultDict[int, List[str]] = defaultdict(list)
+    speakers_tickets: Set[str] = set()
+    try:
+        remaining = len(producers)
+        while remaining:
+            kind, results = await queue.get()
+            if results is None:
+                remaining -= 1
+            elif kind == "talks":
+                for result in results:
+                    for uid in result["authors"]:
+                        if uid not in speakers_uids:
+                            speakers_uids.add(uid)
+                            speakers_tickets.update(barcodes_by_uid.get(uid, ()))
+            else:
+                for result in results:
+                    barcode = str(result["barcode"])
+                    barcodes_by_uid[result["user"]].append(barcode)
+                    if result["user"] in speakers_uids:
+                        speakers_tickets.add(barcode)
+        for producer in producers:
+            producer.result()  # Raise any errors from fetching
+    finally:
+        for producer in producers:
+            producer.cancel()
+
+    added = speakers_tickets.difference(SPEAKERS_TICKETS)
+    removed = SPEAKERS_TICKETS.difference(speakers_tickets)
+    SPEAKERS_TICKETS = speakers_tickets
+    return added, removed
 
 
 async def is_barcode_belong_to_speaker(barcode: str) -> bool:
@@ -58,20 +103,106 @@ async def is_barcode_belong_to_speaker(barcode: str) -> bool:
     return barcode in SPEAKERS_TICKETS
 
 
-async def update_calendar_cache() -> None:
-    """Update the ICal events cache from wafer."""
+def event_key(event: Event) -> EventKey:
+    """The key of the event, its name and start"""
+    return event.name, event.begin.isoformat()
+
+
+@dataclass
+class CalendarDiff:
+    """The differences between two versions of the calendar, by event key. A rescheduled
+    event counts as removed, and added at its new time.
+    """
+
+    added: Set[EventKey] = field(default_factory=set)
+    removed: Set[EventKey] = field(default_factory=set)
+    changed: Set[EventKey] = field(default_factory=set)
+
+    def summary(self) -> str:
+        """A human readable summary of the differences"""
+        return (
+            f"{len(self.added)} event(s) added, {len(self.removed)} removed and "
+            f"{len(self.changed)} changed."
+        )
+
+
+def parse_calendar(ics: str) -> Dict[EventKey, Event]:
+    """Parse the ICal text into events by key, leaving out breaks. CPU heavy for big
+    calendars, so it's best run in a worker thread.
+    """
+    c = Calendar(ics)
+    return {event_key(e): e for e in c.events if "break" not in e.name.lower()}
+
+
+def apply_calendar(events: Dict[EventKey, Event], ics: str) -> CalendarDiff:
+    """Apply the differences between the given events and the events cache to the
+    cache. Unchanged events are kept as is.
+    """
+    global CALENDAR_ICS
+
+    diff = CalendarDiff(
+        added=set(events).difference(EVENTS_CACHE),
+        removed=set(EVENTS_CACHE).difference(events),
+    )
+    for key in set(events).intersection(EVENTS_CACHE):
+        old, new = EVENTS_CACHE[key], events[key]
+        if (old.end, old.location, old.description) != (
+            new.end,
+            new.location,
+            new.description,
+        ):
+            diff.changed.add(key)
+
+    for key in diff.removed:
+        del EVENTS_CACHE[key]
+    EVENTS_CACHE.update((key, events[key]) for key in diff.added | diff.changed)
+    CALENDAR_ICS = ics
+    return diff
+
+
+async def update_calendar_cache() -> Optional[CalendarDiff]:
+    """Update the ICal events cache from wafer. The calendar is only downloaded if it
+    changed since the last time, and is parsed in a worker thread so as not to block the
+    event loop. Returns the differences applied to the cache, or None if the calendar
+    was unchanged.
+    """
+    global CALENDAR_ETAG, CALENDAR_LAST_MODIFIED
+
+    headers = {}
+    if CALENDAR_ETAG is not None:
+        headers["If-None-Match"] = CALENDAR_ETAG
+    if CALENDAR_LAST_MODIFIED is not None:
+        headers["If-Modified-Since"] = CALENDAR_LAST_MODIFIED
     ical_url = urljoin(BASE_URL, ICS_ENDPOINT)
-    async with httpx.AsyncClient() as client:
-        r = await client.get(ical_url)
-        c = Calendar(r.text)
-    global EVENTS_CACHE
-    EVENTS_CACHE = {e for e in c.events if "break" not in e.name.lower()}
+    r = await http_client.get(ical_url, headers=headers)
+    if r.status_code == httpx.codes.NOT_MODIFIED:
+        return None
+    r.raise_for_status()
+    diff = None
+    if r.text != CALENDAR_ICS:
+        events = await asyncio.get_event_loop().run_in_executor(
+            None, parse_calendar, r.text
+        )
+        diff = apply_calendar(events, r.text)
+    # Only once the calendar is applied, so that a failed parse is retried
+    CALENDAR_ETAG = r.headers.get("ETag")
+    CALENDAR_LAST_MODIFIED = r.headers.get("Last-Modified")
+    return diff
+
+
+def load_calendar(ics: str) -> None:
+    """Load the events cache from the given ICal text."""
+    apply_calendar(parse_calendar(ics), ics)
+
+
+def find_event(key: EventKey) -> Optional[Event]:
+    """Get the cached event with the given key, if there is one."""
+    return EVENTS_CACHE.get(key)
 
 
 async def mark_as_announced(event: Event) -> None:
-    """Cache the event name, in order to mark it as done."""
-    global ANNOUNCED_EVENT_NAMES
-    ANNOUNCED_EVENT_NAMES.add(event.name)
+    """Cache the event key, in order to mark it as done."""
+    ANNOUNCED_EVENTS.add(event_key(event))
 
 
 async def all_upcoming_events(minutes: Optional[int] = None) -> Set[Event]:
@@ -80,11 +211,11 @@ async def all_upcoming_events(minutes: Optional[int] = None) -> Set[Event]:
     """
     events = set()
     now = arrow.utcnow()
-    for event in EVENTS_CACHE:
+    for key, event in EVENTS_CACHE.items():
         diff = (event.begin - now).total_seconds()
         diff_minutes = round(diff / 60)
         if (
-            event.name not in ANNOUNCED_EVENT_NAMES
+            key not in ANNOUNCED_EVENTS
             and diff > 0
             and (minutes and diff_minutes <= minutes or not minutes)
         ):
@@ -1,22 +1,132 @@
-from typing import Dict, List, Optional, Set
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import arrow
+import google_auth_httplib2
 import googleapiclient.discovery
+import httplib2
 from discord.channel import TextChannel
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 
+from regbot import http_client
 from regbot.google import get_client_credentials
-from regbot.helpers import get_str_env, to_discord_description_safe, to_discord_title_safe
+from regbot.helpers import (
+    get_str_env,
+    register_stats,
+    to_discord_description_safe,
+    to_discord_title_safe,
+)
 
 YOUTUBE_PLAYLIST = get_str_env("YOUTUBE_PLAYLIST")
 CHANNEL_BROADCAST_MAP_TYPE = Dict[TextChannel, dict]
 BROADCAST_CHANNELS: CHANNEL_BROADCAST_MAP_TYPE = {}
 ANNOUNCED_BROADCASTS = set()
+YOUTUBE_WORKERS = 4
+YOUTUBE_TIMEOUT_SECONDS = 30
+# The YouTube client library is blocking, so its requests are run in this thread pool.
+YOUTUBE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=YOUTUBE_WORKERS, thread_name_prefix="youtube"
+)
+_THREAD_LOCAL = threading.local()
+YOUTUBE_SERVICE = None
+_YOUTUBE_SERVICE_CREDENTIALS = None
+_YOUTUBE_SERVICE_LOCK = threading.Lock()
+YOUTUBE_MAX_RESULTS = 50
+# Quota units of the API methods used, where it isn't the single unit of a list call.
+YOUTUBE_QUOTA_COSTS = {"youtube.liveChatMessages.insert": 50}
+# Responses by request, along with their ETag, for making conditional requests.
+ETAG_CACHE: Dict[str, dict] = {}
+QUOTA_STATS = {
+    "Quota used (last sync)": 0,
+    "Quota used (since start)": 0,
+    "Quota used (questions)": 0,
+    "Quota used (channel plans)": 0,
+    "Not modified responses": 0,
+}
+register_stats("YouTube", lambda: QUOTA_STATS)
+# Questions are relayed to each live chat by this many workers at a time
+QUESTION_WORKERS = 2
+QUESTION_QUEUE_SIZE = 100
+QUESTION_COOLDOWN_SECONDS = 30
+QUESTION_MAX_ATTEMPTS = 4
 
 
 def get_youtube():
-    """Returns an authenticated YouTube resource"""
+    """Returns an authenticated YouTube resource. It is built once, from the discovery
+    document bundled with the client library, and only rebuilt if the credentials
+    change.
+    """
+    global YOUTUBE_SERVICE, _YOUTUBE_SERVICE_CREDENTIALS
     credentials = get_client_credentials()
-    return googleapiclient.discovery.build("youtube", "v3", credentials=credentials)
+    with _YOUTUBE_SERVICE_LOCK:
+        if YOUTUBE_SERVICE is None or credentials is not _YOUTUBE_SERVICE_CREDENTIALS:
+            YOUTUBE_SERVICE = googleapiclient.discovery.build(
+                "youtube",
+                "v3",
+                credentials=credentials,
+                static_discovery=True,
+                cache_discovery=False,
+            )
+            _YOUTUBE_SERVICE_CREDENTIALS = credentials
+        return YOUTUBE_SERVICE
+
+
+def _get_thread_http(credentials) -> google_auth_httplib2.AuthorizedHttp:
+    """Get the authorized http object of the current thread, as httplib2 is not thread
+    safe.
+    """
+    http = getattr(_THREAD_LOCAL, "http", None)
+    if http is None or http.credentials is not credentials:
+        http = google_auth_httplib2.AuthorizedHttp(
+            credentials, http=httplib2.Http(timeout=YOUTUBE_TIMEOUT_SECONDS)
+        )
+        _THREAD_LOCAL.http = http
+    return http
+
+
+async def execute(
+    request: HttpRequest, quota_stat: str = "Quota used (last sync)"
+) -> dict:
+    """Execute the YouTube API request in the YouTube thread pool, without blocking the
+    event loop. Its cost is added to the given quota statistic, besides the total.
+    Raises asyncio.TimeoutError if it takes too long, in which case the thread is left
+    to time out on its own.
+    """
+    credentials = get_client_credentials()
+    cost = YOUTUBE_QUOTA_COSTS.get(request.methodId, 1)
+    QUOTA_STATS[quota_stat] += cost
+    QUOTA_STATS["Quota used (since start)"] += cost
+    future = asyncio.get_event_loop().run_in_executor(
+        YOUTUBE_EXECUTOR, lambda: request.execute(http=_get_thread_http(credentials))
+    )
+    return await asyncio.wait_for(future, YOUTUBE_TIMEOUT_SECONDS)
+
+
+async def execute_conditionally(
+    key: str, request: HttpRequest, quota_stat: str = "Quota used (last sync)"
+) -> dict:
+    """Execute the YouTube API request, but only have the response sent if it changed
+    since the last request with the same key, otherwise the cached response is used.
+    """
+    cached = ETAG_CACHE.get(key)
+    if cached is not None:
+        request.headers["If-None-Match"] = cached["etag"]
+    try:
+        response = await execute(request, quota_stat)
+    except HttpError as e:
+        if cached is not None and e.resp.status == 304:
+            QUOTA_STATS["Not modified responses"] += 1
+            return cached
+        raise
+    if "etag" in response:
+        ETAG_CACHE[key] = response
+    return response
 
 
 def save_channel_broadcast_map(channel_broadcast_map: CHANNEL_BROADCAST_MAP_TYPE):
@@ -27,7 +137,7 @@ def save_channel_broadcast_map(channel_broadcast_map: CHANNEL_BROADCAST_MAP_TYPE
     BROADCAST_CHANNELS = channel_broadcast_map
 
 
-def get_all_broadcasts() -> List[dict]:
+async def get_all_broadcasts(sync: bool = True) -> List[dict]:
     """Get all the broadcasts for the playlist in the defined environment and return
     a list of ordered dictionaries defining them with the following keys:
         "id": Can be used to generate a link to the YouTube video
@@ -35,22 +145,55 @@ def get_all_broadcasts() -> List[dict]:
         "description"
         "start_time": This is what the list is sorted by.
         "live_chat_id": For the Q&A command to use.
+    The quota used is reported as the last sync's, unless it isn't for the sync.
     """
+    quota_stat = "Quota used (last sync)" if sync else "Quota used (channel plans)"
+    if sync:
+        QUOTA_STATS[quota_stat] = 0
     youtube = get_youtube()
-    video_ids = []
+    video_ids: List[str] = []
 
-    request = youtube.playlistItems().list(
-        part="contentDetails", playlistId=YOUTUBE_PLAYLIST, maxResults=50
-    )
-    response = request.execute()
-    video_ids = [item["contentDetails"]["videoId"] for item in response["items"]]
+    page_token = None
+    while True:
+        request = youtube.playlistItems().list(
+            part="contentDetails",
+            playlistId=YOUTUBE_PLAYLIST,
+            maxResults=YOUTUBE_MAX_RESULTS,
+            pageToken=page_token,
+        )
+        response = await execute_conditionally(
+            f"playlistItems:{page_token}", request, quota_stat
+        )
+        video_ids += [item["contentDetails"]["videoId"] for item in response["items"]]
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
 
-    request = youtube.liveBroadcasts().list(
-        part="snippet", id=",".join(video_ids), maxResults=50
+    chunks = [
+        ",".join(video_ids[i : i + YOUTUBE_MAX_RESULTS])
+        for i in range(0, len(video_ids), YOUTUBE_MAX_RESULTS)
+    ]
+    responses = await asyncio.gather(
+        *(
+            execute_conditionally(
+                f"liveBroadcasts:{chunk}",
+                youtube.liveBroadcasts().list(
+                    part="snippet", id=chunk, maxResults=YOUTUBE_MAX_RESULTS
+                ),
+                quota_stat,
+            )
+            for chunk in chunks
+        )
     )
-    response = request.execute()
+    items: List[Dict[str, Any]] = [
+        item for response in responses for item in response["items"]
+    ]
+    # Forget the responses of chunks that no longer exist
+    for key in [k for k in ETAG_CACHE if k.startswith("liveBroadcasts:")]:
+        if key[len("liveBroadcasts:") :] not in chunks:
+            del ETAG_CACHE[key]
     broadcasts = []
-    for item in response["items"]:
+    for item in items:
         start_time = arrow.get(item["snippet"]["scheduledStartTime"])
         broadcasts.append(
             {
@@ -104,3 +247,170 @@ async def all_upcoming_broadcasts(
         ):
             channels.add(channel)
     return channels
+
+
+@dataclass
+class QueuedQuestion:
+    """A question waiting to be relayed to a live chat, along with the futures of
+    everyone who asked it.
+    """
+
+    text: str
+    futures: List[asyncio.Future] = field(default_factory=list)
+
+
+class QuestionRelay:
+    """Relays questions to a YouTube live chat through a bounded queue. Questions are
+    sent by a fixed number of workers, duplicates of a queued question are collapsed
+    into it, each user has a cooldown between questions, and sends that are rate
+    limited are retried with backoff.
+    """
+
+    def __init__(self, live_chat_id: str, title: str):
+        self.live_chat_id = live_chat_id
+        self.title = title
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUESTION_QUEUE_SIZE)
+        self.pending: Dict[str, QueuedQuestion] = {}
+        self.last_asked: Dict[int, float] = {}
+        self.sent = 0
+        self.failed = 0
+        self.collapsed = 0
+        self.retries = 0
+        self.quota_used = 0
+        self.workers = [
+            asyncio.ensure_future(self._work()) for _ in range(QUESTION_WORKERS)
+        ]
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def cooldown_remaining(self, author_id: int) -> float:
+        """Seconds until the given user may ask another question."""
+        last_asked = self.last_asked.get(author_id)
+        if last_asked is None:
+            return 0
+        return max(0.0, last_asked + QUESTION_COOLDOWN_SECONDS - time.monotonic())
+
+    def submit(
+        self, author_id: int, question: str, text: str
+    ) -> Tuple[asyncio.Future, int]:
+        """Queue the text to be sent as the given question. If the same question is
+        already queued, then it is collapsed into it instead. Returns the future of the
+        send, and the question's position in the queue (0 if collapsed). Raises
+        asyncio.QueueFull if the queue is full.
+        """
+        future = asyncio.get_event_loop().create_future()
+        key = self._key(question)
+        queued = self.pending.get(key)
+        if queued is not None:
+            self.collapsed += 1
+            position = 0
+        else:
+            queued = QueuedQuestion(text)
+            self.queue.put_nowait((key, queued))
+            self.pending[key] = queued
+            position = self.queue.qsize()
+        queued.futures.append(future)
+        self.last_asked[author_id] = time.monotonic()
+        return future, position
+
+    async def _work(self):
+        while True:
+            key, queued = await self.queue.get()
+            try:
+                error = await self._send(queued.text)
+            except Exception as e:
+                # Whatever went wrong, the askers are told and the relay keeps going
+                logging.exception(f"Relaying a question to {self.title} failed!")
+                self.failed += 1
+                error = e
+            finally:
+                del self.pending[key]
+                self.queue.task_done()
+            for future in queued.futures:
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    async def _send(self, text: str) -> Optional[Exception]:
+        """Send the text to the live chat, retrying if rate limited. Returns the error
+        if it couldn't be sent.
+        """
+        error: Optional[Exception] = None
+        for attempt in range(QUESTION_MAX_ATTEMPTS):
+            request = (
+                get_youtube()
+                .liveChatMessages()
+                .insert(
+                    part="snippet",
+                    body={
+                        "snippet": {
+                            "liveChatId": self.live_chat_id,
+                            "type": "textMessageEvent",
+                            "textMessageDetails": {"messageText": text},
+                        }
+                    },
+                )
+            )
+            self.quota_used += YOUTUBE_QUOTA_COSTS.get(request.methodId, 1)
+            try:
+                await execute(request, quota_stat="Quota used (questions)")
+            except HttpError as e:
+                error = e
+                if is_rate_limited(e) and attempt + 1 < QUESTION_MAX_ATTEMPTS:
+                    self.retries += 1
+                    await asyncio.sleep(http_client.backoff_seconds(attempt + 1))
+                    continue
+            except asyncio.TimeoutError as e:
+                # It may well have been sent, so it isn't retried
+                error = e
+            else:
+                self.sent += 1
+                return None
+            break
+        self.failed += 1
+        return error
+
+    def stats(self) -> Dict[str, Any]:
+        """The statistics of this relay"""
+        return {
+            f"{self.title} queue depth": self.queue.qsize(),
+            f"{self.title} sent": self.sent,
+            f"{self.title} failed": self.failed,
+            f"{self.title} collapsed duplicates": self.collapsed,
+            f"{self.title} rate limit retries": self.retries,
+            f"{self.title} quota used": self.quota_used,
+        }
+
+
+QUESTION_RELAYS: Dict[str, QuestionRelay] = {}
+
+
+def is_rate_limited(error: HttpError) -> bool:
+    """Check if the YouTube API error is due to being rate limited."""
+    return error.resp.status == 429 or (
+        error.resp.status == 403 and b"rateLimitExceeded" in (error.content or b"")
+    )
+
+
+def get_question_relay(live_chat_id: str, title: str) -> QuestionRelay:
+    """Get the question relay of the given live chat, starting it if need be."""
+    relay = QUESTION_RELAYS.get(live_chat_id)
+    if relay is None:
+        relay = QUESTION_RELAYS[live_chat_id] = QuestionRelay(live_chat_id, title)
+    return relay
+
+
+def get_question_stats() -> Dict[str, Any]:
+    """The statistics of all the question relays"""
+    stats: Dict[str, Any] = {}
+    for relay in QUESTION_RELAYS.values():
+        stats.update(relay.stats())
+    return stats
+
+
+register_stats("YouTube questions", get_question_stats)
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import sys
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Callable, List, Optional
+
+import pytest
+from discord import Forbidden
+
+# regbot reads its configuration from the environment on import, so give every setting
+# a placeholder value before the tests import it
+for name in (
+    "EVENT_NAME",
+    "DISCORD_TOKEN",
+    "DISCORD_REGISTERED_ROLE_NAME",
+    "DISCORD_REGISTRATION_ROLE",
+    "DISCORD_ORGANIZER_ROLE",
+    "DISCORD_SPEAKER_ROLE",
+    "DISCORD_SPONSOR_PATRON_ROLE",
+    "DISCORD_SPONSOR_SILVER_ROLE",
+    "DISCORD_SPONSOR_GOLD_ROLE",
+    "DISCORD_SPONSOR_PLATINUM_ROLE",
+    "QUICKET_USER_TOKEN",
+    "QUICKET_API_KEY",
+    "GOOGLE_SHEET_ID",
+    "GOOGLE_SHEET_WORKSHEET_NAME",
+    "QUIZ_GOOGLE_SHEET_ID",
+    "QUIZ_GOOGLE_SHEET_WORKSHEET_NAME",
+    "GOOGLE_PROJECT_ID",
+    "GOOGLE_PRIVATE_KEY_ID",
+    "GOOGLE_PRIVATE_KEY",
+    "GOOGLE_CLIENT_EMAIL",
+    "GOOGLE_CLIENT_ID",
+    "GOOGLE_CLIENT_X509_CERT_URL",
+    "GOOGLE_OAUTH_CLIENT_ID",
+    "GOOGLE_OAUTH_CLIENT_SECRET",
+    "WAFER_USERNAME",
+    "WAFER_PASSWORD",
+    "WAFER_TICKETS_ENDPOINT",
+    "WAFER_TALKS_ENDPOINT",
+    "WAFER_ICS_ENDPOINT",
+    "YOUTUBE_PLAYLIST",
+):
+    os.environ.setdefault(name, name.lower())
+for name in (
+    "DISCORD_LOG_CHANNEL_ID",
+    "DISCORD_HELPDESK_CHANNEL_ID",
+    "DISCORD_WELCOME_CHANNEL_ID",
+    "DISCORD_ANNOUNCEMENT_CHANNEL_ID",
+    "DISCORD_ANNOUNCEMENT_STAGING_CHANNEL_ID",
+    "DISCORD_GUILD_ID",
+    "DISCORD_YOUTUBE_CATEGORY",
+    "QUICKET_CACHE_EXPIRE_MINUTES",
+    "QUICKET_EVENT_ID",
+    "WAFER_CACHE_EXPIRE_MINUTES",
+):
+    os.environ.setdefault(name, "1")
+os.environ.setdefault("WAFER_BASE_URL", "http://wafer.invalid/")
+for name in ("FEATURE_REGISTRATION", "FEATURE_YOUTUBE", "FEATURE_QUIZ"):
+    os.environ.setdefault(name, "true")
+
+
+EVERYONE = SimpleNamespace(id=0, name="@everyone")
+
+
+@dataclass(eq=False)
+class FakeChannel:
+    """Stands in for a Discord channel, recording what is sent to it. Sends wait for the
+    gate if one is set, and fail while there are failures left.
+    """
+
+    id: int
+    mention: str = ""
+    name: str = "channel"
+    position: int = 0
+    topic: Optional[str] = None
+    failures: int = 0
+    gate: Optional[asyncio.Event] = None
+    sent: List[str] = field(default_factory=list)
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(0)
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Failed to send")
+        self.sent.append(content)
+        return content
+
+
+@dataclass(eq=False)
+class FakeMember(FakeChannel):
+    """Stands in for a guild member, who can be sent DMs too. Edits are recorded and
+    replace the roles, besides @everyone. Nickname changes are forbidden if set to.
+    """
+
+    name: str = "member"
+    roles: List[Any] = field(default_factory=list)
+    bot: bool = False
+    forbid_nick: bool = False
+    edits: List[dict] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.roles = [EVERYONE] + self.roles
+
+    async def edit(self, reason=None, **changes):
+        await asyncio.sleep(0)
+        if self.forbid_nick and "nick" in changes:
+            raise Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "Nope")
+        self.edits.append(changes)
+        if "roles" in changes:
+            self.roles = [EVERYONE] + list(changes["roles"])
+
+
+@pytest.fixture
+def run() -> Callable:
+    """Run a coroutine in a new event loop, failing if it takes longer than the timeout"""
+
+    def run(coroutine, timeout: float = 1):
+        return asyncio.run(asyncio.wait_for(coroutine, timeout))
+
+    return run
+
+
+@pytest.fixture
+def fake_channel():
+    return FakeChannel
+
+
+@pytest.fixture
+def fake_member():
+    return FakeMember
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """A fresh outbound scheduler, in place of the app's one, including in the modules
+    that imported it by name.
+    """
+    from regbot import outbound
+
+    scheduler = outbound.OutboundScheduler(outbound.OUTBOUND_WORKERS)
+    for name, module in list(sys.modules.items()):
+        if name.startswith("regbot") and module is not outbound:
+            if getattr(module, "OUTBOUND", None) is outbound.OUTBOUND:
+                monkeypatch.setattr(module, "OUTBOUND", scheduler)
+    monkeypatch.setattr(outbound, "OUTBOUND", scheduler)
+    return scheduler
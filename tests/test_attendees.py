@@ -0,0 +1,46 @@
+import pytest
+
+from regbot import attendees, quicket, wafer
+from regbot.attendees import get_attendee, update_attendees
+from regbot.helpers import ATTENDEE_ROLE, SPEAKER_ROLE, SPONSOR_GOLD_ROLE
+from regbot.quicket import Ticket
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    monkeypatch.setattr(attendees, "ATTENDEES", {})
+    monkeypatch.setattr(
+        quicket,
+        "TICKETS",
+        {
+            "1": Ticket("1", True, "Ada", "Lovelace", "General"),
+            "2": Ticket("2", True, "Grace", "Hopper" * 10, "Gold Sponsor"),
+        },
+    )
+    monkeypatch.setattr(wafer, "SPEAKERS_TICKETS", {"1"})
+
+
+def test_attendees_are_joined_from_tickets_and_speakers():
+    update_attendees()
+
+    speaker, sponsor = get_attendee("1"), get_attendee("2")
+    assert speaker.roles == (ATTENDEE_ROLE, SPEAKER_ROLE)
+    assert speaker.speaker and not speaker.sponsor
+    assert sponsor.roles == (ATTENDEE_ROLE, SPONSOR_GOLD_ROLE)
+    assert sponsor.sponsor and sponsor.nickname_truncated
+    assert len(sponsor.nickname) == attendees.MAX_NICKNAME_LENGTH
+    assert get_attendee("3") is None
+
+
+def test_only_the_given_barcodes_are_rejoined():
+    update_attendees()
+    unchanged = get_attendee("2")
+    del quicket.TICKETS["1"]
+    quicket.TICKETS["3"] = Ticket("3", True, "Alan", "Turing", "General")
+    wafer.SPEAKERS_TICKETS = {"2"}
+
+    update_attendees({"1", "3"})
+
+    assert set(attendees.ATTENDEES) == {"2", "3"}
+    assert get_attendee("2") is unchanged
+    assert not get_attendee("3").speaker
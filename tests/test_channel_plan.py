@@ -0,0 +1,63 @@
+import pytest
+
+from regbot.tasks import plan_talk_channels
+
+
+def broadcast(title, over_hour_old=False, description=None):
+    return {
+        "id": title,
+        "title": title,
+        "description": description or f"About {title}",
+        "over_hour_old": over_hour_old,
+    }
+
+
+@pytest.fixture
+def channel(fake_channel):
+    def channel(channel_id, name, position, topic=None):
+        return fake_channel(
+            id=channel_id, name=name, position=position, topic=topic or f"About {name}"
+        )
+
+    return channel
+
+
+def test_plan_only_changes_what_differs(channel):
+    broadcasts = [
+        broadcast("keynote"),
+        broadcast("talk", description="New"),
+        broadcast("new"),
+    ]
+    keynote, talk = channel(1, "keynote", 0), channel(2, "talk", 1)
+    stale, duplicate = channel(3, "old-talk", 2), channel(4, "keynote", 3)
+
+    plan = plan_talk_channels(broadcasts, [talk, keynote, stale, duplicate])
+
+    assert [b["title"] for b in plan.create] == ["new"]
+    assert plan.topics == {talk: "New"}
+    assert plan.stale == [stale]
+    assert plan.duplicates == [duplicate]
+    assert plan.position_changes(plan.existing) == []
+    assert plan.summary().startswith("1 channel(s) to create, 1 to update, 2 to delete")
+
+
+def test_old_talks_are_ordered_last():
+    broadcasts = [broadcast(f"talk-{i}", over_hour_old=i < 3) for i in range(150)]
+
+    plan = plan_talk_channels(broadcasts, [])
+
+    order = list(plan.broadcasts)
+    assert order[:147] == [f"talk-{i}" for i in range(3, 150)]
+    assert order[147:] == ["talk-0", "talk-1", "talk-2"]
+
+
+def test_channels_are_moved_between_the_positions_they_take_up(channel):
+    broadcasts = [broadcast("a"), broadcast("b"), broadcast("c")]
+    channels = [channel(1, "c", 5), channel(2, "b", 6), channel(3, "a", 7)]
+
+    plan = plan_talk_channels(broadcasts, channels)
+
+    assert plan.position_changes(plan.existing) == [
+        {"id": 3, "position": 5},
+        {"id": 1, "position": 7},
+    ]
@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from regbot import events, helpers
+
+
+def channel(name: str, category_id: int = 10, topic: str = ""):
+    return SimpleNamespace(
+        id=5,
+        name=name,
+        category_id=category_id,
+        topic=topic,
+        guild=SimpleNamespace(id=helpers.GUILD_ID),
+    )
+
+
+@pytest.fixture(autouse=True)
+def indexes(monkeypatch):
+    monkeypatch.setattr(helpers, "CHANNELS_BY_ID", {})
+    monkeypatch.setattr(helpers, "CHANNELS_BY_NAME", {})
+    monkeypatch.setattr(helpers, "SERVER_INFO_CACHE", "cached")
+
+
+def update(before, after):
+    helpers.index_channel(before)
+    asyncio.run(events.on_guild_channel_update(before, after))
+
+
+def test_topic_updates_keep_the_server_info():
+    after = channel("general", topic="Say hi")
+    update(channel("general"), after)
+
+    assert helpers.SERVER_INFO_CACHE == "cached"
+    assert helpers.find_channel("general") is after
+
+
+@pytest.mark.parametrize(
+    "after",
+    [channel("chat"), channel("general", category_id=11)],
+    ids=["name", "category"],
+)
+def test_renames_and_moves_forget_the_server_info(after):
+    update(channel("general"), after)
+
+    assert helpers.SERVER_INFO_CACHE is None
+    assert helpers.find_channel(after.name) is after
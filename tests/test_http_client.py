@@ -0,0 +1,170 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+import httpx
+import pytest
+
+from regbot import http_client
+from regbot.http_client import TokenBucket
+
+# A response for the stand-in server to give: its status and headers, or None to close
+# the connection without responding
+Reply = Optional[Tuple[int, dict]]
+
+
+class StandInServer:
+    """A local HTTP server, giving the scripted replies in turn"""
+
+    def __init__(self, replies: List[Reply]):
+        self.replies = replies
+        self.requests = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/guests"
+
+    async def __aenter__(self) -> "StandInServer":
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        self.requests += 1
+        reply = self.replies.pop(0)
+        if reply is not None:
+            status, headers = reply
+            head = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+            writer.write(
+                f"HTTP/1.1 {status} Stand-in\r\nContent-Length: 2\r\n"
+                f"Connection: close\r\n{head}\r\nok".encode()
+            )
+            await writer.drain()
+        writer.close()
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """The backoff delays slept for, with the jitter always at its maximum"""
+    delays: List[float] = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(http_client, "asyncio", SimpleNamespace(sleep=sleep))
+    monkeypatch.setattr(http_client.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(http_client, "HTTP_CLIENT", None)
+    return delays
+
+
+def get_from(replies: List[Reply]) -> Tuple[httpx.Response, int]:
+    """Get from a stand-in server giving the replies, with a pooled client injected
+    into the application. Returns the response and the number of attempts made.
+    """
+
+    async def get():
+        http_client.set_http_client(http_client.create_http_client())
+        try:
+            async with StandInServer(replies) as server:
+                response = await http_client.get(server.url)
+                return response, server.requests
+        finally:
+            await http_client.close_http_client()
+
+    return asyncio.run(asyncio.wait_for(get(), 5))
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__(rate=1000.0)
+        self.acquired = 0
+
+    async def acquire(self) -> None:
+        self.acquired += 1
+        await super().acquire()
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=50.0, capacity=2.0)
+
+    async def take(n):
+        start = time.monotonic()
+        for _ in range(n):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # Two tokens in the bucket, then one every 20ms
+    elapsed = asyncio.run(take(5))
+    assert 0.05 <= elapsed < 0.5
+
+
+def test_every_attempt_takes_a_token(monkeypatch):
+    statuses = [503, 503, 200]
+
+    class FakeClient:
+        async def request(self, method, url, **kwargs):
+            return httpx.Response(statuses.pop(0))
+
+    monkeypatch.setattr(http_client, "HTTP_CLIENT", FakeClient())
+    monkeypatch.setattr(http_client, "backoff_seconds", lambda attempt: 0.0)
+    bucket = CountingBucket()
+
+    async def get():
+        return await http_client.get("https://example.com/", rate_limiter=bucket)
+
+    response = asyncio.run(get())
+
+    assert response.status_code == 200
+    assert bucket.acquired == 3
+
+
+def test_backoff_is_exponential_with_full_jitter():
+    for attempt, cap in enumerate((1.0, 2.0, 4.0, 8.0, 16.0, 30.0, 30.0)):
+        delays = [http_client.backoff_seconds(attempt) for _ in range(50)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_retryable_statuses_and_transport_errors_are_retried(delays):
+    response, attempts = get_from([(503, {}), None, (429, {}), (200, {})])
+
+    assert response.status_code == 200
+    assert attempts == 4
+    assert delays == [1.0, 2.0, 4.0]
+    assert http_client.HTTP_CLIENT is None
+
+
+def test_retry_after_is_respected(delays):
+    response, attempts = get_from([(429, {"Retry-After": "7"}), (200, {})])
+
+    assert (response.status_code, attempts) == (200, 2)
+    assert delays == [7.0]
+
+
+def test_retries_give_up_after_the_maximum(delays):
+    response, attempts = get_from([(502, {})] * (http_client.HTTP_MAX_RETRIES + 1))
+
+    assert response.status_code == 502
+    assert attempts == http_client.HTTP_MAX_RETRIES + 1
+    assert len(delays) == http_client.HTTP_MAX_RETRIES
+
+
+def test_transport_errors_are_raised_after_the_maximum(delays):
+    with pytest.raises(httpx.TransportError):
+        get_from([None] * (http_client.HTTP_MAX_RETRIES + 1))
+
+    assert len(delays) == http_client.HTTP_MAX_RETRIES
+
+
+def test_other_statuses_are_not_retried(delays):
+    response, attempts = get_from([(404, {})])
+
+    assert (response.status_code, attempts) == (404, 1)
+    assert delays == []
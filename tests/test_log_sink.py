@@ -0,0 +1,131 @@
+import asyncio
+from collections import deque
+
+import pytest
+
+from regbot import bot, helpers, outbound
+
+
+@pytest.fixture
+def channel(monkeypatch, scheduler, fake_channel):
+    channel = fake_channel(id=helpers.LOG_CHANNEL)
+    monkeypatch.setattr(helpers.bot, "get_channel", lambda _id: channel)
+    monkeypatch.setattr(helpers, "LOG_BUFFER", deque())
+    monkeypatch.setattr(helpers, "LOG_STATS", dict.fromkeys(helpers.LOG_STATS, 0))
+    monkeypatch.setattr(helpers, "LOG_FLUSH_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(helpers, "_LOG_BUFFER_LENGTH", 0)
+    for name in ("_LOG_WAKEUP", "_LOG_WORKER", "_LOG_FLUSH_LOCK"):
+        monkeypatch.setattr(helpers, name, None)
+    return channel
+
+
+@pytest.fixture
+def run_logging(run):
+    """Run the coroutine, then stop the log sink's worker"""
+
+    def run_logging(coroutine):
+        async def run_and_close():
+            try:
+                return await coroutine
+            finally:
+                helpers._LOG_WORKER.cancel()
+
+        return run(run_and_close())
+
+    return run_logging
+
+
+def buffered_length() -> int:
+    return sum(len(line) + 1 for line in helpers.LOG_BUFFER)
+
+
+def test_lines_are_merged_into_few_messages(channel, run_logging):
+    lines = [f"{i:04} " + "x" * 95 for i in range(50)] + ["y" * 4500]
+
+    async def log_all():
+        for line in lines:
+            await helpers.log(line)
+        assert helpers._LOG_BUFFER_LENGTH == buffered_length()
+        await helpers.flush_logs()
+
+    run_logging(log_all())
+
+    assert all(len(message) <= helpers.DISCORD_MESSAGE_LIMIT for message in channel.sent)
+    assert len(channel.sent) == 6
+    assert "\n".join(channel.sent[:3]).split("\n") == lines[:50]
+    assert "".join(channel.sent[3:]) == lines[50]
+    assert helpers._LOG_BUFFER_LENGTH == 0
+
+
+def test_unsent_lines_are_requeued_within_the_buffer_size(
+    channel, monkeypatch, run_logging
+):
+    monkeypatch.setattr(helpers, "LOG_BUFFER_SIZE", 5)
+    channel.failures = 1
+
+    async def log_all():
+        channel.gate = asyncio.Event()
+        for i in range(5):
+            await helpers.log(f"old {i}")
+        flushing = asyncio.ensure_future(helpers.flush_logs())
+        await asyncio.sleep(0.01)
+        for i in range(3):
+            await helpers.log(f"new {i}")
+        channel.gate.set()
+        await flushing
+
+    run_logging(log_all())
+
+    assert list(helpers.LOG_BUFFER) == ["old 3", "old 4", "new 0", "new 1", "new 2"]
+    assert helpers._LOG_BUFFER_LENGTH == buffered_length()
+    assert helpers.LOG_STATS["Lines dropped"] == 3
+    assert helpers.LOG_STATS["Send errors"] == 1
+
+
+def test_worker_keeps_flushing_after_errors(channel, monkeypatch, run_logging):
+    channel.failures = 1
+    get_channel = helpers.bot.get_channel
+    calls = 0
+
+    def fail_once(_id):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RuntimeError("Not ready")
+        return get_channel(_id)
+
+    monkeypatch.setattr(helpers.bot, "get_channel", fail_once)
+
+    async def log_and_wait():
+        await helpers.log("Hello")
+        while not channel.sent:
+            await asyncio.sleep(0.01)
+
+    run_logging(log_and_wait())
+
+    assert channel.sent == ["Hello"]
+    assert calls == 3
+
+
+def test_logs_are_flushed_on_close_after_the_workers_were_cancelled(
+    channel, monkeypatch, run
+):
+    monkeypatch.setattr(bot, "shutdown_hooks", [helpers.close_log_sink])
+    monkeypatch.setattr(bot, "_closed", False)
+
+    async def shut_down():
+        await outbound.send(channel, "Started", outbound.Priority.LOG)
+        await helpers.log("Shutting down")
+        # Like discord.py's clean up on SIGINT/SIGTERM, which cancels every task before
+        # the bot is closed
+        workers = [*outbound.OUTBOUND.workers, helpers._LOG_WORKER]
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await bot.close()
+
+    run(shut_down())
+
+    assert bot.is_closed()
+    assert channel.sent == ["Started", "Shutting down"]
+    assert not helpers.LOG_BUFFER
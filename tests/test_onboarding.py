@@ -0,0 +1,134 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from regbot import helpers, onboarding
+
+
+@pytest.fixture
+def welcome_channel(monkeypatch, scheduler, fake_channel):
+    welcome_channel = fake_channel(id=1, mention="#welcome")
+    server_info = SimpleNamespace(
+        help_desk=fake_channel(id=2, mention="#help-desk"),
+        welcome_channel=welcome_channel,
+    )
+
+    async def get_server_info():
+        return server_info
+
+    async def log(message):
+        pass
+
+    monkeypatch.setattr(onboarding, "ServerInfo", SimpleNamespace(get=get_server_info))
+    monkeypatch.setattr(onboarding, "log", log)
+    monkeypatch.setattr(onboarding, "WELCOME_BATCH_SECONDS", 0.02)
+    monkeypatch.setattr(onboarding, "PENDING_WELCOMES", [])
+    monkeypatch.setattr(onboarding, "_WELCOMER", None)
+    monkeypatch.setattr(
+        onboarding, "ONBOARDING_STATS", dict.fromkeys(onboarding.ONBOARDING_STATS, 0)
+    )
+    return welcome_channel
+
+
+@pytest.fixture
+def members(fake_member):
+    def members(count, start=0):
+        return [
+            fake_member(id=1000 + i, mention=f"<@{10**17 + i}>")
+            for i in range(start, start + count)
+        ]
+
+    return members
+
+
+@pytest.fixture
+def run_welcoming(run):
+    """Run the coroutine, and then until everyone is welcomed"""
+
+    def run_welcoming(coroutine):
+        async def run_until_welcomed():
+            await coroutine
+            while onboarding._WELCOMER is not None:
+                await onboarding._WELCOMER
+
+        run(run_until_welcomed())
+
+    return run_welcoming
+
+
+def test_welcomes_fit_in_discord_messages():
+    mentions = [f"<@{10**17 + i}>" for i in range(300)]
+
+    batches = onboarding.batch_welcomes(mentions)
+
+    assert [mention for batch in batches for mention in batch] == mentions
+    assert len(batches) == 4
+    assert all(
+        len(onboarding.get_welcome(batch)) <= helpers.DISCORD_MESSAGE_LIMIT
+        for batch in batches
+    )
+
+
+def test_members_joining_together_are_welcomed_together(
+    welcome_channel, members, run_welcoming
+):
+    joined = members(100)
+
+    async def join():
+        await asyncio.gather(*(onboarding.onboard(member) for member in joined))
+
+    run_welcoming(join())
+
+    assert all(len(member.sent) == 1 for member in joined)
+    assert len(welcome_channel.sent) == 2
+    assert onboarding.get_onboarding_stats()["Members welcomed"] == 100
+    assert onboarding.PENDING_WELCOMES == []
+
+
+def test_failed_welcomes_are_sent_with_the_next_batch(
+    welcome_channel, members, run_welcoming
+):
+    welcome_channel.failures = 1
+
+    async def join():
+        await asyncio.gather(*(onboarding.onboard(member) for member in members(3)))
+        await asyncio.sleep(onboarding.WELCOME_BATCH_SECONDS * 1.5)
+        await asyncio.gather(*(onboarding.onboard(member) for member in members(2, 3)))
+
+    run_welcoming(join())
+
+    assert len(welcome_channel.sent) == 1
+    assert all(f"<@{10**17 + i}>" in welcome_channel.sent[0] for i in range(5))
+    stats = onboarding.get_onboarding_stats()
+    assert stats["Welcome messages failed"] == 1
+    assert stats["Members welcomed"] == 5
+
+
+def test_members_that_join_while_welcoming_are_welcomed_next(
+    welcome_channel, members, run_welcoming
+):
+    async def join():
+        await onboarding.onboard(members(1)[0])
+        while not onboarding.PENDING_WELCOMES or welcome_channel.sent:
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(onboarding.WELCOME_BATCH_SECONDS)
+        # The first batch is being sent
+        await onboarding.onboard(members(1, 1)[0])
+
+    run_welcoming(join())
+
+    assert len(welcome_channel.sent) == 2
+    assert onboarding.get_onboarding_stats()["Members welcomed"] == 2
+
+
+def test_dm_failures_are_counted(welcome_channel, members, run_welcoming):
+    member = members(1)[0]
+    member.failures = 1
+
+    run_welcoming(onboarding.onboard(member))
+
+    stats = onboarding.get_onboarding_stats()
+    assert stats["DMs failed"] == 1
+    assert stats["Members onboarded"] == 0
+    assert stats["Members welcomed"] == 1
@@ -0,0 +1,105 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any
+
+import pytest
+from discord.ext import commands
+
+from regbot import helpers
+from regbot.outbound import OutboundContext, Priority
+
+
+@dataclass
+class FakeMessage:
+    channel: Any
+    _state: None = None
+
+
+@pytest.fixture
+def context(monkeypatch, scheduler, fake_channel):
+    # Stands in for sending through Discord, which is what the base context does
+    monkeypatch.setattr(
+        commands.Context,
+        "send",
+        lambda self, content=None, **_: self.channel.send(content),
+    )
+    return OutboundContext(message=FakeMessage(fake_channel(id=1)), prefix="!")
+
+
+def test_safe_send_message_through_outbound_context(context, run):
+    run(helpers.safe_send_message(context, "a" * 2500))
+
+    assert context.channel.sent == ["a" * 2000, "a" * 500]
+
+
+def test_outbound_context_send(context, run):
+    assert run(context.send("Hello")) == "Hello"
+    assert context.channel.sent == ["Hello"]
+
+
+def test_requests_are_sent_in_priority_order(scheduler, run):
+    order = []
+
+    def request(name):
+        async def send():
+            order.append(name)
+
+        return send
+
+    async def submit_all():
+        # Hold the route, so that the rest queue up behind the first request
+        blocker = asyncio.Event()
+        first = asyncio.ensure_future(
+            scheduler.submit("route", Priority.LOG, blocker.wait)
+        )
+        await asyncio.sleep(0.01)
+        rest = [
+            scheduler.submit("route", Priority.HOUSEKEEPING, request("housekeeping")),
+            scheduler.submit("route", Priority.LOG, request("log")),
+            scheduler.submit("route", Priority.INTERACTIVE, request("interactive 1")),
+            scheduler.submit("route", Priority.INTERACTIVE, request("interactive 2")),
+        ]
+        waiting = asyncio.ensure_future(asyncio.gather(*rest))
+        await asyncio.sleep(0.01)
+        blocker.set()
+        await first
+        await waiting
+
+    run(submit_all())
+
+    assert order == ["interactive 1", "interactive 2", "log", "housekeeping"]
+
+
+def test_one_request_per_route_at_a_time(scheduler, run):
+    in_flight = {"a": 0, "b": 0}
+    most = {"a": 0, "b": 0}
+
+    def request(route):
+        async def send():
+            in_flight[route] += 1
+            most[route] = max(most[route], in_flight[route])
+            await asyncio.sleep(0.01)
+            in_flight[route] -= 1
+
+        return send
+
+    async def submit_all():
+        await asyncio.gather(
+            *(
+                scheduler.submit(route, Priority.ANNOUNCEMENT, request(route))
+                for route in "abab"
+            )
+        )
+
+    run(submit_all())
+
+    assert most == {"a": 1, "b": 1}
+    assert scheduler.stats()["Announcement sent"] == 4
+
+
+def test_failed_request_raises_to_submitter(scheduler, run):
+    async def fail():
+        raise ValueError("Nope")
+
+    with pytest.raises(ValueError):
+        run(scheduler.submit("route", Priority.INTERACTIVE, fail))
@@ -0,0 +1,98 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from regbot import http_client, quicket
+from regbot.quicket import Ticket, TicketCacheDiff
+
+
+def guest(barcode, valid=True, first_name="First", ticket_type="General"):
+    return {
+        "TicketInformation": {
+            "Ticket Barcode": barcode,
+            "Valid": valid,
+            "First name": first_name,
+            "Surname": "Last",
+            "Ticket Type": ticket_type,
+        }
+    }
+
+
+class Guests(list):
+    requests: list
+
+
+@pytest.fixture
+def guests(monkeypatch):
+    """The guest lists to respond with in turn, or None for not modified"""
+    guests = Guests()
+    guests.requests = []
+
+    async def get(url, **kwargs):
+        guests.requests.append(kwargs["headers"])
+        results = guests.pop(0)
+        return SimpleNamespace(
+            status_code=httpx.codes.NOT_MODIFIED if results is None else httpx.codes.OK,
+            headers={"ETag": "v1"},
+            json=lambda: {"results": results},
+            raise_for_status=lambda: None,
+        )
+
+    monkeypatch.setattr(http_client, "get", get)
+    monkeypatch.setattr(quicket, "TICKETS", {})
+    monkeypatch.setattr(quicket, "TICKETS_ETAG", None)
+    return guests
+
+
+def test_a_complete_guest_list_is_swapped_in(guests):
+    guests.extend(
+        [
+            [guest(1), guest(2), guest(3, ticket_type="Sponsor")],
+            [guest(1), guest(2, valid=False), guest(3, first_name="Renamed"), guest(4)]
+            + [guest(4)],
+        ]
+    )
+
+    first = asyncio.run(quicket.update_ticket_cache())
+    old_tickets = quicket.TICKETS
+    second = asyncio.run(quicket.update_ticket_cache())
+
+    assert first.added == {"1", "2", "3"}
+    assert old_tickets is not quicket.TICKETS
+    assert len(old_tickets) == 3
+    assert (second.added, second.removed) == ({"4"}, set())
+    assert (second.changed, second.invalidated) == ({"3"}, {"2"})
+    assert second.duplicates == ["4"]
+    assert second.barcodes == {"2", "3", "4"}
+    assert quicket.TICKETS["3"].full_name == "Renamed Last"
+    assert guests.requests[1]["If-None-Match"] == "v1"
+
+
+def test_an_unchanged_guest_list_is_kept(guests):
+    guests.extend([[guest(1)], None])
+
+    asyncio.run(quicket.update_ticket_cache())
+    tickets = quicket.TICKETS
+
+    assert asyncio.run(quicket.update_ticket_cache()) is None
+    assert quicket.TICKETS is tickets
+
+
+def test_tickets_are_slotted_and_their_types_interned():
+    ticket = Ticket("1", True, "First", "Last", "".join(["Gene", "ral"]))
+
+    assert not hasattr(ticket, "__dict__")
+    assert ticket.type is sys.intern("General")
+    assert ticket.full_name == "First Last"
+
+
+def test_diff_summaries_list_a_limited_number_of_barcodes():
+    old = {str(i): Ticket(str(i), True, "A", "B", "General") for i in range(30)}
+    diff = TicketCacheDiff.between(old, {})
+
+    assert diff.summary().startswith("30 removed (0, 1, 10, 11,")
+    assert diff.summary().endswith(", ...)")
+    assert TicketCacheDiff().summary() == "No changes."
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import pytest
+
+from regbot import attendees, quicket, reconcile, sheets
+from regbot.attendees import Attendee
+from regbot.helpers import ATTENDEE_ROLE, SPEAKER_ROLE, SPONSOR_GOLD_ROLE
+from regbot.quicket import Ticket
+from regbot.sheets import Registration
+
+ROLES = {
+    name: SimpleNamespace(id=i, name=name)
+    for i, name in enumerate(sorted(reconcile.MANAGED_ROLES | {"volunteer"}), 1)
+}
+
+
+@pytest.fixture
+def member(fake_member):
+    def member(member_id, *roles, bot=False):
+        return fake_member(
+            id=member_id,
+            name=f"member {member_id}",
+            roles=[ROLES[r] for r in roles],
+            bot=bot,
+        )
+
+    return member
+
+
+@pytest.fixture(autouse=True)
+def registrations(monkeypatch, scheduler):
+    tickets = {
+        "valid": Ticket("valid", True, "Valid", "Attendee", "Gold Sponsor"),
+        "invalid": Ticket("invalid", False, "Invalid", "Attendee", "General"),
+    }
+    ledger = {
+        barcode: Registration(barcode, "Name", "member", member_id, "today")
+        for barcode, member_id in (("valid", 1), ("invalid", 2), ("unknown", 3))
+    }
+    monkeypatch.setattr(quicket, "TICKETS", tickets)
+    monkeypatch.setattr(sheets, "REGISTRATION_LEDGER", ledger)
+    monkeypatch.setattr(
+        attendees,
+        "ATTENDEES",
+        {
+            "valid": Attendee.from_ticket(tickets["valid"], speaker=True),
+            "invalid": Attendee.from_ticket(tickets["invalid"], speaker=False),
+        },
+    )
+    monkeypatch.setattr(reconcile, "ATTENDEES", attendees.ATTENDEES)
+    monkeypatch.setattr(reconcile, "find_role", ROLES.get)
+
+
+def guild(*members):
+    return SimpleNamespace(members=list(members))
+
+
+def test_plan_gives_missing_roles_and_takes_invalidated_ones(member):
+    valid = member(1, ATTENDEE_ROLE, "volunteer")
+    invalid = member(2, ATTENDEE_ROLE, SPEAKER_ROLE, "volunteer")
+    unknown = member(3, ATTENDEE_ROLE)
+    unregistered = member(4, ATTENDEE_ROLE)
+    bot = member(5, bot=True)
+
+    plan = reconcile.plan_reconcile(guild(valid, invalid, unknown, unregistered, bot))
+
+    assert plan.members_checked == 4
+    assert plan.unregistered_attendees == 1
+    changes = {change.member.id: change for change in plan.changes}
+    assert set(changes) == {1, 2}
+    assert changes[1].add == [
+        ROLES[name] for name in sorted((SPEAKER_ROLE, SPONSOR_GOLD_ROLE))
+    ]
+    assert changes[1].remove == []
+    assert changes[2].add == []
+    assert changes[2].remove == [
+        ROLES[name] for name in sorted((ATTENDEE_ROLE, SPEAKER_ROLE))
+    ]
+
+
+def test_apply_keeps_unmanaged_roles_and_roles_given_since_planning(member, run):
+    valid = member(1, ATTENDEE_ROLE)
+    invalid = member(2, ATTENDEE_ROLE, "volunteer")
+    plan = reconcile.plan_reconcile(guild(valid, invalid))
+    valid.roles.append(ROLES["volunteer"])
+
+    async def progress(message):
+        pass
+
+    failed = run(reconcile.apply_reconcile(plan, progress))
+
+    assert failed == 0
+    assert {role.name for role in valid.roles[1:]} == {
+        ATTENDEE_ROLE,
+        SPEAKER_ROLE,
+        SPONSOR_GOLD_ROLE,
+        "volunteer",
+    }
+    assert [role.name for role in invalid.roles[1:]] == ["volunteer"]
+    assert reconcile.plan_reconcile(guild(valid, invalid)).changes == []
+
+
+def test_plan_needs_the_caches(monkeypatch):
+    monkeypatch.setattr(sheets, "REGISTRATION_LEDGER", None)
+
+    with pytest.raises(AssertionError):
+        reconcile.plan_reconcile(guild())
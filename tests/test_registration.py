@@ -0,0 +1,232 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import pytest
+from discord import HTTPException
+
+from regbot import outbound
+from regbot.outbound import Priority
+from regbot.registration import RegistrationQueue
+
+# The package's `commands` attribute is discord's commands extension, not the module
+commands = importlib.import_module("regbot.commands")
+
+
+def http_error(status: int) -> HTTPException:
+    return HTTPException(SimpleNamespace(status=status, reason="Error"), "Error")
+
+
+def test_registrations_are_deduplicated_by_barcode_and_member(run):
+    async def submit():
+        queue = RegistrationQueue(workers=2, size=10)
+        gate = asyncio.Event()
+        done, waiting = queue.submit("123", 1, gate.wait)
+        duplicates = (queue.is_in_progress("123", 2), queue.is_in_progress("456", 1))
+        unrelated = queue.is_in_progress("456", 2)
+        gate.set()
+        await done
+        return queue, waiting, duplicates, unrelated
+
+    queue, waiting, duplicates, unrelated = run(submit())
+
+    assert waiting == 0
+    assert duplicates == (True, True)
+    assert not unrelated
+    assert not queue.is_in_progress("123", 1)
+    assert queue.get_stats()["Duplicates"] == 2
+
+
+def test_registrations_are_shed_when_the_queue_is_full(run):
+    async def submit():
+        queue = RegistrationQueue(workers=1, size=2)
+        gate = asyncio.Event()
+        futures = [queue.submit("0", 0, gate.wait)]
+        await asyncio.sleep(0)  # Let the worker take the first registration
+        futures += [queue.submit(str(i), i, gate.wait) for i in (1, 2)]
+        positions = [waiting for _, waiting in futures]
+        with pytest.raises(asyncio.QueueFull):
+            queue.submit("3", 3, gate.wait)
+        gate.set()
+        await asyncio.gather(*(done for done, _ in futures))
+        return queue, positions
+
+    queue, positions = run(submit())
+
+    assert positions == [0, 1, 2]
+    assert queue.get_stats()["Shed"] == 1
+    assert queue.get_stats()["Completed"] == 3
+
+
+def test_concurrency_backs_off_on_pushback_and_recovers(run):
+    async def submit():
+        queue = RegistrationQueue(workers=4, size=10)
+
+        async def pushed_back():
+            raise http_error(429)
+
+        async def failed():
+            raise http_error(404)
+
+        async def succeeded():
+            return "Done"
+
+        results = []
+        for i, job in enumerate([pushed_back, pushed_back, failed]):
+            done, _ = queue.submit(str(i), i, job)
+            results.append(await asyncio.gather(done, return_exceptions=True))
+        limits = [queue.limit]
+        for i in range(10):
+            done, _ = queue.submit(str(i), i, succeeded)
+            await done
+            limits.append(queue.limit)
+        return queue, limits
+
+    queue, limits = run(submit())
+
+    assert limits[0] == 1
+    assert limits[-1] == 4
+    assert limits == sorted(limits)
+    assert queue.get_stats()["Pushbacks"] == 2
+    assert queue.get_stats()["Failed"] == 3
+
+
+class FakeContext:
+    def __init__(self, channel_type: str = "text"):
+        self.author = SimpleNamespace(id=1, name="attendee")
+        self.channel = SimpleNamespace(type=SimpleNamespace(name=channel_type))
+        self.message = SimpleNamespace(delete=self.delete)
+        self.deleted = False
+        self.sent = []
+
+    async def delete(self):
+        self.deleted = True
+
+    async def send(self, content):
+        self.sent.append(content)
+
+
+def test_barcode_is_deleted_when_a_registration_is_in_progress(monkeypatch, run):
+    queue = RegistrationQueue(workers=1, size=1)
+    monkeypatch.setattr(commands, "REGISTRATION_QUEUE", queue)
+    monkeypatch.setattr(queue, "is_in_progress", lambda barcode, member_id: True)
+    ctx = FakeContext()
+
+    run(commands.register.callback(ctx, "123"))
+
+    assert ctx.deleted
+    assert "already in progress" in ctx.sent[0]
+
+
+def test_barcode_is_deleted_when_the_queue_is_full(monkeypatch, run):
+    queue = RegistrationQueue(workers=1, size=1)
+    monkeypatch.setattr(commands, "REGISTRATION_QUEUE", queue)
+
+    def full(*args):
+        raise asyncio.QueueFull
+
+    monkeypatch.setattr(queue, "submit", full)
+    ctx = FakeContext()
+
+    run(commands.register.callback(ctx, "123"))
+
+    assert ctx.deleted
+    assert "a lot of people registering" in ctx.sent[0]
+
+
+def test_barcode_is_not_deleted_in_direct_messages(monkeypatch, run):
+    queue = RegistrationQueue(workers=1, size=1)
+    monkeypatch.setattr(commands, "REGISTRATION_QUEUE", queue)
+    monkeypatch.setattr(queue, "is_in_progress", lambda barcode, member_id: True)
+    ctx = FakeContext("private")
+
+    run(commands.register.callback(ctx, "123"))
+
+    assert not ctx.deleted
+
+
+@pytest.fixture
+def member(monkeypatch, scheduler, fake_member):
+    member = fake_member(
+        id=1,
+        name="attendee",
+        mention="attendee",
+        roles=[SimpleNamespace(id=1, name="early bird")],
+    )
+    guild = SimpleNamespace(get_member=lambda _id: member)
+
+    async def get_server_info():
+        return SimpleNamespace(
+            guild=guild,
+            help_desk=SimpleNamespace(mention="#help-desk"),
+            registration=SimpleNamespace(name="registration"),
+        )
+
+    async def nothing(*args):
+        return False
+
+    attendee = SimpleNamespace(
+        ticket=SimpleNamespace(barcode="123", full_name="Attendee Name"),
+        nickname="Attendee Name",
+        nickname_truncated=False,
+        roles=("attendee",),
+        speaker=False,
+        sponsor=False,
+    )
+    monkeypatch.setattr(commands, "ServerInfo", SimpleNamespace(get=get_server_info))
+    monkeypatch.setattr(commands, "get_attendee", lambda barcode: attendee)
+    monkeypatch.setattr(
+        commands, "find_role", lambda name: SimpleNamespace(id=2, name=name)
+    )
+    monkeypatch.setattr(commands, "is_ticket_used", nothing)
+    monkeypatch.setattr(commands, "register_ticket", nothing)
+    monkeypatch.setattr(commands, "log", nothing)
+    return member
+
+
+def role_names(edit):
+    return [role.name for role in edit["roles"]]
+
+
+def test_registration_edits_the_member_once(member, run):
+    ctx = FakeContext()
+
+    run(commands.process_registration(ctx, "123"))
+
+    assert len(member.edits) == 1
+    assert role_names(member.edits[0]) == ["early bird", "attendee"]
+    assert member.edits[0]["nick"] == "Attendee Name"
+    assert ctx.sent[0].startswith("Registration successful!")
+
+
+def test_registration_keeps_roles_given_before_the_edit_is_sent(member, run):
+    async def register():
+        # Another change of the member's roles is in flight
+        gate = asyncio.Event()
+        other = asyncio.ensure_future(
+            outbound.OUTBOUND.submit(
+                ("member", member.id), Priority.HOUSEKEEPING, gate.wait
+            )
+        )
+        await asyncio.sleep(0.01)
+        registration = asyncio.ensure_future(
+            commands.process_registration(FakeContext(), "123")
+        )
+        await asyncio.sleep(0.01)
+        member.roles.append(SimpleNamespace(id=3, name="speaker"))
+        gate.set()
+        await asyncio.gather(other, registration)
+
+    run(register())
+
+    assert role_names(member.edits[0]) == ["early bird", "speaker", "attendee"]
+
+
+def test_registration_gives_roles_when_the_nickname_is_forbidden(member, run):
+    member.forbid_nick = True
+
+    run(commands.process_registration(FakeContext(), "123"))
+
+    assert len(member.edits) == 1
+    assert "nick" not in member.edits[0]
+    assert role_names(member.edits[0]) == ["early bird", "attendee"]
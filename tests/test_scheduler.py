@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from regbot import tasks
+from regbot.tasks import AnnouncementScheduler
+
+
+def run_until_fired(scheduler, count, reschedule=None):
+    async def run():
+        runner = asyncio.ensure_future(
+            scheduler.run() if reschedule is None else scheduler.run_forever(reschedule)
+        )
+        try:
+            while scheduler.fired < count:
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.05)  # Give it the chance to fire too much
+        finally:
+            runner.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 1))
+
+
+def test_items_fire_in_order_of_their_fire_times():
+    fired = []
+
+    async def fire(key):
+        fired.append(key)
+
+    scheduler = AnnouncementScheduler("Test order", fire)
+    now = time.time()
+    scheduler.sync({"third": now + 0.06, "first": now, "second": now + 0.03})
+    scheduler.schedule("cancelled", now + 0.01)
+    scheduler.cancel("cancelled")
+    scheduler.schedule("moved", now + 0.01)
+    scheduler.schedule("moved", now + 0.09)
+
+    run_until_fired(scheduler, 4)
+
+    assert fired == ["first", "second", "third", "moved"]
+    assert scheduler.stats()["Scheduled"] == 0
+
+
+def test_items_being_fired_are_not_scheduled_again():
+    fired = []
+
+    async def fire(key):
+        # A resync while the announcement is being sent still sees it as upcoming
+        scheduler.sync({key: time.time()})
+        await asyncio.sleep(0.01)
+        fired.append(key)
+
+    scheduler = AnnouncementScheduler("Test in flight", fire)
+    scheduler.schedule("talk", time.time())
+
+    run_until_fired(scheduler, 1)
+
+    assert fired == ["talk"]
+    assert scheduler.fired == 1
+
+
+def test_failures_are_logged_and_the_scheduler_carries_on(monkeypatch):
+    monkeypatch.setattr(tasks, "SCHEDULER_RESTART_SECONDS", 0)
+    fired = []
+    reschedules = 0
+
+    async def fire(key):
+        if key == "broken":
+            raise RuntimeError("Failed to announce")
+        fired.append(key)
+
+    async def reschedule():
+        nonlocal reschedules
+        reschedules += 1
+        if reschedules == 1:
+            raise RuntimeError("Failed to reschedule")
+        scheduler.sync({"broken": time.time(), "working": time.time() + 0.01})
+
+    scheduler = AnnouncementScheduler("Test failures", fire)
+
+    run_until_fired(scheduler, 2, reschedule)
+
+    assert fired == ["working"]
+    assert reschedules == 2
@@ -0,0 +1,323 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import gspread_asyncio
+import pytest
+from gspread.exceptions import WorksheetNotFound
+
+from regbot import sheets
+from regbot.quicket import Ticket
+from regbot.sheets import QuizQuestion, QuizState, WriteBehindStats
+
+
+class FakeWorksheet:
+    def __init__(self, rows=()):
+        self.rows = [list(row) for row in rows]
+        self.appends = 0
+        self.failures = 0
+
+    async def append_rows(self, rows):
+        await asyncio.sleep(0.01)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Sheets is down")
+        self.appends += 1
+        self.rows.extend(rows)
+
+    async def get_all_values(self):
+        await asyncio.sleep(0.01)
+        return [list(row) for row in self.rows]
+
+    async def findall(self, text):
+        return [
+            SimpleNamespace(row=r + 1, col=c + 1)
+            for r, row in enumerate(self.rows)
+            for c, value in enumerate(row)
+            if value == text
+        ]
+
+    async def update_cell(self, row, col, value):
+        await asyncio.sleep(0.01)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Sheets is down")
+        self.rows[row - 1][col - 1] = value
+
+
+@pytest.fixture
+def worksheet(monkeypatch):
+    worksheet = FakeWorksheet()
+
+    @asynccontextmanager
+    async def opened_worksheet(sheet_id, name):
+        yield worksheet
+
+    async def log(message):
+        pass
+
+    monkeypatch.setattr(sheets, "opened_worksheet", opened_worksheet)
+    monkeypatch.setattr(sheets, "log", log)
+    monkeypatch.setattr(sheets, "PENDING_REGISTRATIONS", [])
+    monkeypatch.setattr(sheets, "REGISTRATION_LEDGER", {})
+    monkeypatch.setattr(sheets, "WRITE_BEHIND_STATS", WriteBehindStats())
+    monkeypatch.setattr(sheets, "_FLUSH_LOCK", asyncio.Lock())
+    monkeypatch.setattr(sheets, "_FLUSH_TASK", None)
+    monkeypatch.setattr(sheets, "QUIZ_STATE", None)
+    monkeypatch.setattr(sheets, "QUIZ_WRITE_LOCK", asyncio.Lock())
+    monkeypatch.setattr(sheets, "_PENDING_ANSWERS", {})
+    return worksheet
+
+
+REGISTRATION_HEADER = ["Barcode", "Full name", "Discord name", "Discord ID", "Date"]
+
+
+def ticket(i: int) -> Ticket:
+    return Ticket(f"{i:06}", True, "First", f"Last {i}", "General")
+
+
+def member(i: int):
+    return SimpleNamespace(id=i, name=f"member {i}")
+
+
+def test_registrations_are_appended_in_batches(worksheet):
+    async def register():
+        for i in range(sheets.REG_FLUSH_MAX_ROWS + 5):
+            await sheets.register_ticket(ticket(i), member(i))
+        # Only one flush was started by reaching the batch size
+        flush_task = sheets._FLUSH_TASK
+        assert flush_task is not None and not flush_task.done()
+        await sheets.register_ticket(ticket(-1), member(-1))
+        assert sheets._FLUSH_TASK is flush_task
+        await sheets.flush_all_registrations()
+        assert flush_task.done()
+        assert sheets._FLUSH_TASK is None
+
+    asyncio.run(register())
+
+    assert len(worksheet.rows) == sheets.REG_FLUSH_MAX_ROWS + 6
+    assert worksheet.appends == 1
+    assert sheets.PENDING_REGISTRATIONS == []
+    assert sheets.WRITE_BEHIND_STATS.rows_flushed == sheets.REG_FLUSH_MAX_ROWS + 6
+
+
+def test_failed_flushes_back_off_until_forced(worksheet):
+    worksheet.failures = 1
+
+    async def register():
+        await sheets.register_ticket(ticket(1), member(1))
+        assert await sheets.is_ticket_used(ticket(1))
+        assert await sheets.flush_registrations() == 0
+        assert await sheets.flush_registrations() == 0  # Backing off
+        assert worksheet.rows == []
+        await sheets.flush_all_registrations()
+
+    asyncio.run(register())
+
+    assert [row[0] for row in worksheet.rows] == ["000001"]
+    assert sheets.WRITE_BEHIND_STATS.failures == 1
+    assert sheets.WRITE_BEHIND_STATS.backoff_seconds == 0
+
+
+def test_ledger_reload_keeps_registrations_that_are_not_written_yet(worksheet):
+    worksheet.rows = [
+        REGISTRATION_HEADER,
+        ["000002", "First Last 2", "member 2", "2", "yesterday"],
+    ]
+
+    async def reload():
+        await sheets.register_ticket(ticket(1), member(1))
+        return await sheets.load_registration_ledger()
+
+    appeared, disappeared = asyncio.run(reload())
+
+    assert set(sheets.REGISTRATION_LEDGER) == {"000001", "000002"}
+    assert sheets.REGISTRATION_LEDGER["000002"].discord_id == 2
+    assert appeared == {"000002"}
+    assert disappeared == set()
+
+
+def test_tickets_are_looked_up_in_the_sheet_until_the_ledger_is_loaded(
+    worksheet, monkeypatch
+):
+    monkeypatch.setattr(sheets, "REGISTRATION_LEDGER", None)
+    worksheet.rows = [
+        REGISTRATION_HEADER,
+        ["000002", "First Last 2", "member 2", "2", "yesterday"],
+    ]
+
+    async def check():
+        return [await sheets.is_ticket_used(ticket(i)) for i in (1, 2)]
+
+    assert asyncio.run(check()) == [False, True]
+
+
+def test_registrations_during_a_reload_are_kept(worksheet):
+    async def reload():
+        reloading = asyncio.ensure_future(sheets.load_registration_ledger())
+        await asyncio.sleep(0)
+        await sheets.register_ticket(ticket(1), member(1))
+        await reloading
+
+    asyncio.run(reload())
+
+    assert set(sheets.REGISTRATION_LEDGER) == {"000001"}
+
+
+class FakeClient:
+    def __init__(self):
+        self.opened = 0
+
+    async def open_by_key(self, sheet_id):
+        return self
+
+    async def worksheet(self, name):
+        self.opened += 1
+        return SimpleNamespace(name=name, client=self)
+
+
+@pytest.fixture
+def client_manager(monkeypatch):
+    """A real client manager, authorizing fake clients"""
+    monkeypatch.setattr(gspread_asyncio.gspread, "authorize", lambda creds: None)
+    monkeypatch.setattr(
+        gspread_asyncio, "AsyncioGspreadClient", lambda manager, gc: FakeClient()
+    )
+    client_manager = gspread_asyncio.AsyncioGspreadClientManager(lambda: None)
+    monkeypatch.setattr(sheets, "client_manager", client_manager)
+    monkeypatch.setattr(sheets, "WORKSHEET_CACHE", {})
+    monkeypatch.setattr(
+        sheets, "WORKSHEET_CACHE_STATS", dict.fromkeys(sheets.WORKSHEET_CACHE_STATS, 0)
+    )
+    return client_manager
+
+
+def test_worksheet_handles_are_reused_until_the_client_changes(client_manager):
+    async def get():
+        first = await sheets.get_worksheet("sheet", "registrations")
+        assert await sheets.get_worksheet("sheet", "registrations") is first
+        sheets.invalidate_worksheets()
+        reopened = await sheets.get_worksheet("sheet", "registrations")
+        assert reopened is not first
+        assert reopened.client is await client_manager.authorize()
+
+    asyncio.run(get())
+
+    assert sheets.WORKSHEET_CACHE_STATS == {
+        "Opens": 2,
+        "Opens saved": 1,
+        "Invalidations": 1,
+    }
+    # The replaced client isn't kept around by the manager
+    assert len(client_manager._agc_cache) == 1
+
+
+def test_worksheet_handles_are_forgotten_when_not_found(client_manager):
+    async def use():
+        async with sheets.opened_worksheet("sheet", "registrations"):
+            raise WorksheetNotFound("registrations")
+
+    with pytest.raises(WorksheetNotFound):
+        asyncio.run(use())
+
+    assert sheets.WORKSHEET_CACHE == {}
+    assert client_manager.auth_time is None
+    assert client_manager._agc_cache == {}
+    assert sheets.WORKSHEET_CACHE_STATS["Invalidations"] == 1
+
+
+def test_clients_close_to_expiring_are_replaced_in_the_background(
+    client_manager, monkeypatch
+):
+    monkeypatch.setattr(
+        sheets, "WORKSHEET_REFRESH_MARGIN_SECONDS", client_manager.reauth_interval
+    )
+
+    async def refresh():
+        first = await sheets.get_worksheet("sheet", "registrations")
+        await sheets.refresh_worksheet_cache()
+        return first
+
+    first = asyncio.run(refresh())
+
+    cached = sheets.WORKSHEET_CACHE[("sheet", "registrations")]
+    assert cached.worksheet is not first
+    assert list(client_manager._agc_cache.values()) == [cached.client]
+
+
+def test_quiz_state_keeps_the_leaderboard_ordered():
+    questions = [
+        QuizQuestion(row=i + 2, question="", answer="", channel_id=1, channel_hint="")
+        for i in range(5)
+    ]
+    state = QuizState(questions)
+
+    assert state.record_answer(2, 10)
+    assert not state.record_answer(2, 20)  # Already answered
+    assert not state.record_answer(4, 20)  # Not the current question
+    assert state.record_answer(3, 20)
+    assert state.record_answer(4, 20)
+    assert state.leaderboard == [20, 10]
+    assert state.current_question is questions[3]
+
+    state.revoke_answer(4, 20)
+    state.revoke_answer(3, 20)
+
+    assert state.leaderboard == [10]
+    assert state.current_question is questions[1]
+
+
+def quiz_rows(*answerers):
+    rows = [["Question", "Answer", "Channel", "Hint", "Answerer"]]
+    for i, answerer in enumerate(answerers):
+        rows.append([f"Question {i}", f"Answer {i}", "1", "Hint", answerer])
+    return rows
+
+
+def test_only_the_first_answer_is_accepted(worksheet):
+    worksheet.rows = quiz_rows("", "")
+
+    async def answer():
+        question = await QuizQuestion.get_current_question()
+        return await asyncio.gather(
+            question.mark_as_answered(10), question.mark_as_answered(20)
+        )
+
+    assert asyncio.run(answer()) == [True, False]
+    assert worksheet.rows[1][4] == "10"
+    assert sheets.QUIZ_STATE.leaderboard == [10]
+
+
+def test_answers_that_could_not_be_saved_are_revoked(worksheet):
+    worksheet.rows = quiz_rows("", "")
+    worksheet.failures = 1
+
+    async def answer():
+        question = await QuizQuestion.get_current_question()
+        with pytest.raises(RuntimeError):
+            await question.mark_as_answered(10)
+        return await QuizQuestion.get_current_question()
+
+    assert asyncio.run(answer()).row == 2
+    assert sheets.QUIZ_STATE.leaderboard == []
+    assert sheets._PENDING_ANSWERS == {}
+
+
+def test_reloads_keep_answers_that_are_being_saved(worksheet):
+    worksheet.rows = quiz_rows("", "")
+
+    async def answer():
+        question = await QuizQuestion.get_current_question()
+        answering = asyncio.ensure_future(question.mark_as_answered(10))
+        await asyncio.sleep(0)
+        # Waits for the answer to be saved, then finds it in the sheet
+        reloading = asyncio.ensure_future(sheets.reload_quiz_state())
+        await asyncio.sleep(0)
+        assert sheets.QUIZ_STATE.current_question.row == 3
+        await answering
+        return await reloading
+
+    state = asyncio.run(answer())
+
+    assert state.current_question.row == 3
+    assert state.leaderboard == [10]
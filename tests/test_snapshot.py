@@ -0,0 +1,86 @@
+import asyncio
+import gzip
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from regbot import attendees, quicket, snapshot, wafer, youtube
+from regbot.quicket import Ticket
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot, "SNAPSHOT_FILE", str(tmp_path / "snapshot.json.gz"))
+    monkeypatch.setattr(
+        quicket, "TICKETS", {"123": Ticket("123", True, "First", "Last", "General")}
+    )
+    monkeypatch.setattr(quicket, "TICKETS_ETAG", '"tickets"')
+    monkeypatch.setattr(wafer, "SPEAKERS_TICKETS", {"123"})
+    monkeypatch.setattr(wafer, "EVENTS_CACHE", {})
+    monkeypatch.setattr(wafer, "CALENDAR_ICS", None)
+    monkeypatch.setattr(wafer, "ANNOUNCED_EVENTS", {("Keynote", "2020-10-08T09:00:00")})
+    monkeypatch.setattr(youtube, "BROADCAST_CHANNELS", {})
+    monkeypatch.setattr(youtube, "ANNOUNCED_BROADCASTS", set())
+    monkeypatch.setattr(attendees, "ATTENDEES", {})
+
+
+def clear_caches():
+    quicket.TICKETS = {}
+    quicket.TICKETS_ETAG = None
+    wafer.SPEAKERS_TICKETS = set()
+    wafer.ANNOUNCED_EVENTS.clear()
+
+
+def test_snapshot_round_trip():
+    asyncio.run(snapshot.save_snapshot())
+    clear_caches()
+
+    assert snapshot.load_snapshot() is True
+
+    assert quicket.TICKETS == {"123": Ticket("123", True, "First", "Last", "General")}
+    assert quicket.TICKETS_ETAG == '"tickets"'
+    assert wafer.SPEAKERS_TICKETS == {"123"}
+    assert wafer.ANNOUNCED_EVENTS == {("Keynote", "2020-10-08T09:00:00")}
+    assert attendees.ATTENDEES["123"].speaker
+
+
+def test_snapshot_is_only_readable_by_its_owner():
+    asyncio.run(snapshot.save_snapshot())
+
+    mode = stat.S_IMODE(os.stat(snapshot.SNAPSHOT_FILE).st_mode)
+    assert mode == 0o600
+    assert not os.path.exists(f"{snapshot.SNAPSHOT_FILE}.tmp")
+
+
+def rewrite_snapshot(**changes):
+    with gzip.open(snapshot.SNAPSHOT_FILE, "rt", encoding="utf-8") as handle:
+        data = json.load(handle)
+    data.update(changes)
+    with gzip.open(snapshot.SNAPSHOT_FILE, "wt", encoding="utf-8") as handle:
+        json.dump(data, handle)
+
+
+def test_stale_snapshot_only_loads_the_announcement_state():
+    asyncio.run(snapshot.save_snapshot())
+    rewrite_snapshot(written_at=time.time() - 2 * 60 * snapshot.SNAPSHOT_MAX_AGE_MINUTES)
+    clear_caches()
+
+    assert snapshot.load_snapshot() is False
+
+    assert quicket.TICKETS == {}
+    assert wafer.ANNOUNCED_EVENTS == {("Keynote", "2020-10-08T09:00:00")}
+
+
+def test_unusable_snapshots_are_ignored():
+    assert snapshot.load_snapshot() is None
+
+    asyncio.run(snapshot.save_snapshot())
+    rewrite_snapshot(version=snapshot.SNAPSHOT_VERSION - 1)
+    assert snapshot.load_snapshot() is None
+
+    with open(snapshot.SNAPSHOT_FILE, "wb") as handle:
+        handle.write(b"Not a snapshot")
+    assert snapshot.load_snapshot() is None
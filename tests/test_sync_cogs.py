@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+from gspread.exceptions import APIError
+
+from regbot import tasks
+
+
+def api_error(status: int) -> APIError:
+    response = SimpleNamespace(
+        status_code=status, json=lambda: {"error": {"code": status, "message": "Oops"}}
+    )
+    return APIError(response)
+
+
+def failing(status: int = 503):
+    async def fail(*args, **kwargs):
+        raise api_error(status)
+
+    return fail
+
+
+def test_registration_loops_log_sheets_errors(monkeypatch, caplog):
+    monkeypatch.setattr(tasks, "load_registration_ledger", failing(429))
+    monkeypatch.setattr(tasks, "flush_registrations", failing())
+    cog = SimpleNamespace(sync=SimpleNamespace(current_loop=1))
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(tasks.RegistrationLedgerSync.sync.coro(cog))
+        asyncio.run(tasks.RegistrationLedgerSync.flush.coro(cog))
+
+    assert [r.message for r in caplog.records] == [
+        "Failed to reload the registration ledger!",
+        "Failed to flush the queued registrations!",
+    ]
+
+
+def test_worksheet_cache_refresh_logs_sheets_errors(monkeypatch, caplog):
+    monkeypatch.setattr(tasks, "refresh_worksheet_cache", failing(401))
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(tasks.WorksheetCacheRefresh.refresh.coro(SimpleNamespace()))
+
+    assert [r.message for r in caplog.records] == [
+        "Failed to refresh the worksheet cache!"
+    ]
+
+
+def test_quiz_sync_logs_sheets_errors(monkeypatch, caplog):
+    monkeypatch.setattr(tasks, "reload_quiz_state", failing(500))
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(tasks.QuizSync.sync.coro(SimpleNamespace()))
+
+    assert [r.message for r in caplog.records] == ["Failed to reload the quiz state!"]
+
+
+def test_loop_lag_monitor_measures_blocking(monkeypatch):
+    monkeypatch.setattr(tasks, "LOOP_LAG_PROBE_SECONDS", 0.01)
+    cog = SimpleNamespace(probes=0, last_lag=0.0, max_lag=0.0, total_lag=0.0)
+
+    async def measure():
+        # Something blocking the loop while the probe sleeps
+        asyncio.get_event_loop().call_later(0.005, time.sleep, 0.05)
+        await tasks.LoopLagMonitor.measure.coro(cog)
+        await tasks.LoopLagMonitor.measure.coro(cog)
+
+    asyncio.run(measure())
+
+    stats = tasks.LoopLagMonitor.stats(cog)
+    assert stats["Probes"] == 2
+    assert stats["Max lag (s)"] >= 0.04
+    assert stats["Last lag (s)"] < 0.04
+    assert stats["Mean lag (s)"] == cog.total_lag / 2
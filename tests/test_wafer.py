@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from regbot import http_client, wafer
+
+
+def calendar(*events) -> str:
+    """ICal text of the given (name, start hour, location) events"""
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:test"]
+    for name, hour, location in events:
+        lines += [
+            "BEGIN:VEVENT",
+            f"SUMMARY:{name}",
+            f"DTSTART:20201008T{hour:02}0000Z",
+            f"DTEND:20201008T{hour:02}3000Z",
+            f"LOCATION:{location}",
+            "END:VEVENT",
+        ]
+    return "\n".join(lines + ["END:VCALENDAR"])
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    monkeypatch.setattr(wafer, "EVENTS_CACHE", {})
+    monkeypatch.setattr(wafer, "ANNOUNCED_EVENTS", set())
+    monkeypatch.setattr(wafer, "CALENDAR_ICS", None)
+    monkeypatch.setattr(wafer, "CALENDAR_ETAG", None)
+    monkeypatch.setattr(wafer, "CALENDAR_LAST_MODIFIED", None)
+
+
+def test_events_with_the_same_name_are_kept_apart():
+    wafer.load_calendar(
+        calendar(
+            ("Lightning talks", 9, "A"), ("Lightning talks", 16, "A"), ("Break", 10, "A")
+        )
+    )
+
+    assert sorted(wafer.EVENTS_CACHE) == [
+        ("Lightning talks", "2020-10-08T09:00:00+00:00"),
+        ("Lightning talks", "2020-10-08T16:00:00+00:00"),
+    ]
+    first = wafer.find_event(("Lightning talks", "2020-10-08T09:00:00+00:00"))
+    asyncio.run(wafer.mark_as_announced(first))
+    assert wafer.ANNOUNCED_EVENTS == {("Lightning talks", "2020-10-08T09:00:00+00:00")}
+
+
+def test_calendar_changes_are_applied_as_a_diff():
+    wafer.load_calendar(
+        calendar(("Keynote", 9, "A"), ("Talk", 11, "A"), ("Gone", 12, "A"))
+    )
+    keynote = wafer.EVENTS_CACHE[("Keynote", "2020-10-08T09:00:00+00:00")]
+
+    diff = wafer.apply_calendar(
+        wafer.parse_calendar(
+            calendar(("Keynote", 9, "A"), ("Talk", 11, "B"), ("Talk", 14, "A"))
+        ),
+        "new",
+    )
+
+    assert diff.added == {("Talk", "2020-10-08T14:00:00+00:00")}
+    assert diff.removed == {("Gone", "2020-10-08T12:00:00+00:00")}
+    assert diff.changed == {("Talk", "2020-10-08T11:00:00+00:00")}
+    assert wafer.EVENTS_CACHE[("Keynote", "2020-10-08T09:00:00+00:00")] is keynote
+    assert wafer.EVENTS_CACHE[("Talk", "2020-10-08T11:00:00+00:00")].location == "B"
+    assert len(wafer.EVENTS_CACHE) == 3
+
+
+def respond(monkeypatch, text, status_code=200):
+    requests = []
+
+    async def get(url, headers):
+        requests.append(dict(headers))
+        return SimpleNamespace(
+            status_code=status_code,
+            text=text,
+            headers={"ETag": '"v1"', "Last-Modified": "Thu, 08 Oct 2020 08:00:00 GMT"},
+            raise_for_status=lambda: None,
+        )
+
+    monkeypatch.setattr(http_client, "get", get)
+    return requests
+
+
+def test_validators_are_only_saved_once_the_calendar_is_applied(monkeypatch):
+    respond(monkeypatch, calendar(("Keynote", 9, "A")))
+    parse_calendar = wafer.parse_calendar
+
+    def fail(ics):
+        raise ValueError("Unparsable")
+
+    monkeypatch.setattr(wafer, "parse_calendar", fail)
+    with pytest.raises(ValueError):
+        asyncio.run(wafer.update_calendar_cache())
+    assert wafer.CALENDAR_ETAG is None
+    assert wafer.CALENDAR_ICS is None
+
+    monkeypatch.setattr(wafer, "parse_calendar", parse_calendar)
+    diff = asyncio.run(wafer.update_calendar_cache())
+    assert len(diff.added) == 1
+    assert wafer.CALENDAR_ETAG == '"v1"'
+
+    requests = respond(monkeypatch, "", status_code=304)
+    assert asyncio.run(wafer.update_calendar_cache()) is None
+    assert requests[0]["If-None-Match"] == '"v1"'
+    assert len(wafer.EVENTS_CACHE) == 1
@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from regbot import http_client, youtube
+from regbot.youtube import QuestionRelay
+
+
+class FakeYouTube:
+    """Stands in for the YouTube resource, building live chat message inserts"""
+
+    def liveChatMessages(self):
+        return self
+
+    def insert(self, part, body):
+        return SimpleNamespace(
+            methodId="youtube.liveChatMessages.insert",
+            text=body["snippet"]["textMessageDetails"]["messageText"],
+        )
+
+
+def rate_limited() -> HttpError:
+    return HttpError(SimpleNamespace(status=429, reason="Too Many Requests"), b"")
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """The texts sent, with the responses to give taken from `sent.responses`"""
+    sent = SimpleNamespace(texts=[], responses=[], quota_stats=[])
+
+    async def execute(request, quota_stat="Quota used (last sync)"):
+        sent.quota_stats.append(quota_stat)
+        sent.texts.append(request.text)
+        await asyncio.sleep(0.01)
+        response = sent.responses.pop(0) if sent.responses else {}
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(youtube, "get_youtube", FakeYouTube)
+    monkeypatch.setattr(youtube, "execute", execute)
+    monkeypatch.setattr(http_client, "backoff_seconds", lambda attempt: 0)
+    return sent
+
+
+def test_duplicate_questions_are_collapsed(sent, run):
+    async def ask():
+        relay = QuestionRelay("chat", "talk")
+        first, position = relay.submit(1, "What's next?", "1: What's next?")
+        second, collapsed = relay.submit(2, "what's   NEXT?", "2: what's NEXT?")
+        await asyncio.gather(first, second)
+        return relay, position, collapsed
+
+    relay, position, collapsed = run(ask())
+
+    assert (position, collapsed) == (1, 0)
+    assert sent.texts == ["1: What's next?"]
+    assert relay.stats()["talk collapsed duplicates"] == 1
+    assert relay.cooldown_remaining(2) > 0
+
+
+def test_rate_limited_questions_are_retried(sent, run):
+    sent.responses = [rate_limited(), rate_limited()]
+
+    async def ask():
+        relay = QuestionRelay("chat", "talk")
+        future, _ = relay.submit(1, "Why?", "Why?")
+        await future
+        return relay
+
+    relay = run(ask())
+
+    assert sent.texts == ["Why?"] * 3
+    assert sent.quota_stats == ["Quota used (questions)"] * 3
+    assert relay.stats()["talk rate limit retries"] == 2
+    assert relay.stats()["talk sent"] == 1
+
+
+def test_relay_keeps_going_after_an_unexpected_error(sent, run):
+    sent.responses = [ValueError("Unexpected"), rate_limited(), {}] + [
+        rate_limited()
+    ] * youtube.QUESTION_MAX_ATTEMPTS
+
+    async def ask():
+        relay = QuestionRelay("chat", "talk")
+        results = []
+        for question in ("One?", "Two?", "Three?"):
+            future, _ = relay.submit(1, question, question)
+            results.append(await asyncio.gather(future, return_exceptions=True))
+        return relay, results
+
+    relay, results = run(ask())
+
+    assert isinstance(results[0][0], ValueError)
+    assert results[1] == [None]
+    assert isinstance(results[2][0], HttpError)
+    assert relay.stats()["talk failed"] == 2
+    assert relay.stats()["talk sent"] == 1
+
+
+def test_question_quota_is_not_counted_as_sync_quota(monkeypatch, run):
+    request = SimpleNamespace(
+        methodId="youtube.liveChatMessages.insert", execute=lambda http: {}
+    )
+    monkeypatch.setattr(youtube, "get_client_credentials", lambda: None)
+    monkeypatch.setattr(youtube, "_get_thread_http", lambda credentials: None)
+    monkeypatch.setattr(youtube, "QUOTA_STATS", dict.fromkeys(youtube.QUOTA_STATS, 0))
+
+    run(youtube.execute(request, quota_stat="Quota used (questions)"))
+
+    assert youtube.QUOTA_STATS["Quota used (questions)"] == 50
+    assert youtube.QUOTA_STATS["Quota used (since start)"] == 50
+    assert youtube.QUOTA_STATS["Quota used (last sync)"] == 0
+
+
+class FakeBroadcasts:
+    """Stands in for the YouTube resource, listing one broadcast in the playlist"""
+
+    def playlistItems(self):
+        return SimpleNamespace(list=lambda **kwargs: self.request("playlistItems"))
+
+    def liveBroadcasts(self):
+        return SimpleNamespace(list=lambda **kwargs: self.request("liveBroadcasts"))
+
+    def request(self, kind):
+        return SimpleNamespace(methodId=f"youtube.{kind}.list", kind=kind, headers={})
+
+
+def test_channel_plans_dont_count_as_the_last_sync(monkeypatch, run):
+    async def execute(request, quota_stat="Quota used (last sync)"):
+        youtube.QUOTA_STATS[quota_stat] += 1
+        if request.kind == "playlistItems":
+            return {"items": [{"contentDetails": {"videoId": "v1"}}]}
+        snippet = {
+            "title": "Talk",
+            "description": "",
+            "scheduledStartTime": "2020-10-08T10:00:00Z",
+            "liveChatId": "chat",
+        }
+        return {"items": [{"id": "v1", "snippet": snippet}]}
+
+    monkeypatch.setattr(youtube, "get_youtube", FakeBroadcasts)
+    monkeypatch.setattr(youtube, "execute", execute)
+    monkeypatch.setattr(youtube, "ETAG_CACHE", {})
+    monkeypatch.setattr(youtube, "QUOTA_STATS", dict.fromkeys(youtube.QUOTA_STATS, 0))
+
+    assert [b["id"] for b in run(youtube.get_all_broadcasts())] == ["v1"]
+    assert [b["id"] for b in run(youtube.get_all_broadcasts(sync=False))] == ["v1"]
+
+    assert youtube.QUOTA_STATS["Quota used (last sync)"] == 2
+    assert youtube.QUOTA_STATS["Quota used (channel plans)"] == 2
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    credentials = SimpleNamespace(name="credentials")
+    monkeypatch.setattr(youtube, "get_client_credentials", lambda: credentials)
+    monkeypatch.setattr(
+        youtube.google_auth_httplib2,
+        "AuthorizedHttp",
+        lambda credentials, http: SimpleNamespace(credentials=credentials),
+    )
+    return credentials
+
+
+class BlockingRequest:
+    """A request that blocks its thread, like the YouTube client library's requests"""
+
+    methodId = "youtube.liveBroadcasts.list"
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.http = None
+
+    def execute(self, http):
+        time.sleep(self.seconds)
+        self.http = http
+        return {"thread": threading.current_thread().name}
+
+
+def test_requests_run_in_the_pool_without_blocking_the_loop(credentials, run):
+    requests = [BlockingRequest(0.1) for _ in range(youtube.YOUTUBE_WORKERS)]
+
+    async def execute_all():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        start = time.monotonic()
+        responses = await asyncio.gather(*(youtube.execute(r) for r in requests))
+        elapsed = time.monotonic() - start
+        ticker.cancel()
+        return responses, ticks, elapsed
+
+    responses, ticks, elapsed = run(execute_all())
+
+    assert all(r["thread"].startswith("youtube") for r in responses)
+    # Run side by side, with the loop free to run other coroutines meanwhile
+    assert elapsed < 0.3
+    assert ticks >= 5
+    # Each thread has its own authorized http object
+    by_thread = {r["thread"]: req.http for r, req in zip(responses, requests)}
+    assert len({id(http) for http in by_thread.values()}) == len(by_thread)
+    assert all(req.http.credentials is credentials for req in requests)
+
+
+def test_slow_requests_time_out(credentials, monkeypatch, run):
+    monkeypatch.setattr(youtube, "YOUTUBE_TIMEOUT_SECONDS", 0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        run(youtube.execute(BlockingRequest(0.2)))
+
+
+def test_the_service_is_built_once_per_credentials(monkeypatch):
+    credentials = [SimpleNamespace(name="first")]
+    built = []
+
+    def build(*args, credentials, **kwargs):
+        time.sleep(0.01)  # Give other threads the chance to build it too
+        built.append(credentials)
+        return SimpleNamespace(credentials=credentials)
+
+    monkeypatch.setattr(youtube.googleapiclient.discovery, "build", build)
+    monkeypatch.setattr(youtube, "get_client_credentials", lambda: credentials[0])
+    monkeypatch.setattr(youtube, "YOUTUBE_SERVICE", None)
+    monkeypatch.setattr(youtube, "_YOUTUBE_SERVICE_CREDENTIALS", None)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        services = list(executor.map(lambda _: youtube.get_youtube(), range(8)))
+    assert len({id(service) for service in services}) == 1
+    assert youtube.get_youtube() is services[0]
+
+    credentials[0] = SimpleNamespace(name="refreshed")
+    rebuilt = youtube.get_youtube()
+
+    assert rebuilt is not services[0]
+    assert rebuilt.credentials is credentials[0]
+    assert [c.name for c in built] == ["first", "refreshed"]